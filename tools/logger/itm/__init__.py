@@ -2,4 +2,12 @@ from .itm_framer import ITMOpcode
 from .itm_framer import build_value
 from .itm_framer import ITMStimulusPort
 from .itm_framer import ITMFramer
-from .itm_framer import MAX_ITM_FRAME_SIZE
\ No newline at end of file
+from .itm_framer import MAX_ITM_FRAME_SIZE
+from .tpiu import TPIUDeframer
+from .itm_framer import ITM_HEADER_TABLE
+from .itm_tokenizer import ITMTokenizer
+from .itm_framer import ResetTokenDetector
+from .itm_framer import ITMFilter
+from .itm_tracer import Tracer
+from .itm_tracer import TraceEvent
+from .raw_channels import RawChannels
\ No newline at end of file
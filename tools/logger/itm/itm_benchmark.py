@@ -0,0 +1,90 @@
+# Copyright (c) 2018-2019 Texas Instruments Incorporated. All rights reserved.
+#
+# Measure how the time ITMFramer takes to parse a buffer scales with its size, and how ITMTokenizer compares
+#####################################################################################
+
+import sys
+import time
+import random
+import logging
+import argparse
+
+from . import ITMFramer
+from .itm_framer import ITM_RESET_TOKEN
+from .itm_tokenizer import ITMTokenizer
+
+
+def synthetic_stream(size, seed=0):
+    """
+    Build an ITM stream of software packets of all sizes, with a timestamp now and then
+
+    Args:
+      size: minimum number of bytes
+      seed: random seed
+
+    Returns:
+        bytes starting with a reset token
+    """
+    rng = random.Random(seed)
+    out = bytearray(ITM_RESET_TOKEN)
+    while len(out) < size:
+        if rng.random() < 0.1:
+            # Local timestamp with 2 payload bytes
+            out += bytes([0xC0, 0x80 | rng.randrange(0x80), rng.randrange(0x80)])
+        else:
+            port = rng.choice([11, 13, 14, 15, 16])
+            size_code = rng.choice([1, 2, 3])
+            payload = {1: 1, 2: 2, 3: 4}[size_code]
+            out += bytes([(port << 3) | size_code]) + bytes(rng.randrange(256) for _ in range(payload))
+    return bytes(out)
+
+
+######################################################
+###  MAIN  ##################
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 7)
+    parser = argparse.ArgumentParser(description='Measure ITM framer throughput for increasing buffer sizes. The time '
+                                                 'per byte stays flat when parsing is linear in the buffer size.')
+    parser.add_argument('--min_size',
+                        default=1 << 14,
+                        help='Smallest buffer size in bytes, default is 16 KiB')
+    parser.add_argument('--max_size',
+                        default=1 << 22,
+                        help='Largest buffer size in bytes, default is 4 MiB')
+    parser.add_argument('--repeat',
+                        default=3,
+                        help='Best of this many runs per size, default is 3')
+    parser.add_argument('--tokenizer',
+                        action='store_true',
+                        help='Also time ITMTokenizer on the same buffers, which needs numpy')
+    args = parser.parse_args()
+
+    # Only measure parsing
+    logging.disable(logging.CRITICAL)
+    stream = synthetic_stream(int(args.max_size))
+    header = "{:>10} {:>10} {:>10} {:>10}".format("bytes", "frames", "ms", "ns/byte")
+    if args.tokenizer:
+        header += " {:>10} {:>10} {:>10}".format("tok ms", "tok ns/B", "speedup")
+    print(header)
+    size = int(args.min_size)
+    while size <= int(args.max_size):
+        buf = stream[:size]
+        best = None
+        for _ in range(int(args.repeat)):
+            framer = ITMFramer()
+            start = time.perf_counter()
+            frames, _ = framer.parse_batch(buf)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        line = "{:>10} {:>10} {:>10.1f} {:>10.1f}".format(size, len(frames), best * 1e3, best * 1e9 / size)
+        if args.tokenizer:
+            best_tok = None
+            for _ in range(int(args.repeat)):
+                tokenizer = ITMTokenizer()
+                start = time.perf_counter()
+                packets, _ = tokenizer.tokenize(buf)
+                elapsed = time.perf_counter() - start
+                best_tok = elapsed if best_tok is None else min(best_tok, elapsed)
+            line += " {:>10.1f} {:>10.1f} {:>9.1f}x".format(best_tok * 1e3, best_tok * 1e9 / size, best / best_tok)
+        print(line)
+        size *= 2
@@ -7,11 +7,9 @@ import sys
 import os
 import logging
 import argparse
-import time
-import queue
 
-from serial_rx import SerialRx
-from . import ITMFramer
+from serial_rx import open_source
+from . import ITMFramer, MAX_ITM_FRAME_SIZE
 
 ######################################################
 ###  MAIN  ##################
@@ -20,7 +18,8 @@ if __name__ == '__main__':
     """ This is the Main Function """
     parser = argparse.ArgumentParser(description='Used to log serial port and parse received ITM frames.')
     parser.add_argument("port",
-                        help="Com port to open. for win: COM54, for mac: /dev/tty.usbmodemXXX")
+                        help="Com port to open. for win: COM54, for mac: /dev/tty.usbmodemXXX. "
+                             "Use file:PATH to parse a raw capture instead")
     parser.add_argument("-b", "--baud",
                         default=12000000,
                         help="baud rate of the serial port, default is 6000000 bps")
@@ -42,32 +41,28 @@ if __name__ == '__main__':
     logger.critical("ITM example Started")
 
     # Create and start serial receiver
-    serial_rx = SerialRx(args.port, int(args.baud))
+    serial_rx = open_source(args.port, baud=int(args.baud))
     # Create and start parser
-    itm_frame_q = queue.Queue()
-    itm = ITMFramer(itm_frame_q)
+    itm = ITMFramer()
 
     # Loop, receiving data and sending to ITM framer
-    buf = bytearray()
+    unparsed = 0
     try:
         while True:
-            buf += serial_rx.receive()
-            if len(buf) == 0:
-                time.sleep(0.3)
-            else:
-                # Pass buffer to ITM framer
-                buf = itm.parse(buf)
-                # Get all parsed ITM frames
-                while True:
-                    # Receive all pared ITM frames
-                    try:
-                        frame = itm_frame_q.get(block=False)
-                        logger.info(str(frame))
-                    except queue.Empty:
-                        break
-                    except Exception as e:
-                        logger.error(e)
-                        break
+            # Wait for new data
+            serial_rx.wait(unparsed + 1, 0.3)
+            buf = serial_rx.peek()
+            unparsed = len(buf)
+            if len(buf) > MAX_ITM_FRAME_SIZE:
+                # Pass buffer to ITM framer, leaving unparsed data in the receive buffer
+                frames, rest = itm.parse_batch(buf)
+                unparsed = len(rest)
+                serial_rx.consume(len(buf) - unparsed)
+                for frame in frames:
+                    logger.info(str(frame))
+            # Stop at the end of a capture file
+            if serial_rx.eof and serial_rx.occupancy == unparsed:
+                break
 
     except Exception as e:
         logger.critical(e)
@@ -4,47 +4,26 @@ ARM v7-M Architecture Reference Manual: https://developer.arm.com/docs/ddi0403/e
 """
 
 import sys
+import re
 import time
 import logging
 import queue
-from dataclasses import *
+from collections import namedtuple, deque
 from enum import Enum
-
-verbose_timestamp = 0  # Show ITM timestamps
-verbose_itm = 0  # Show ITM parsing debug info, not including timestamps
+from functools import partial
+from .itm_tracer import TraceEvent
 
 logger = logging.getLogger("ITM Framer")
 
-
-class LoggingFilter(logging.Filter):
-    """ Implement logging filter """
-
-    def filter(self, record):
-        """
-        Test whether to filter out message
-
-        Args:
-          record: message to filter on
-
-        Returns:
-            True: display (don't filter)
-            False: don't display (do filter)
-        """
-        # Only filter debug messages
-        if record.levelname is "DEBUG":
-            # Filter out timestamp logs
-            if verbose_timestamp != 1 and record.getMessage().startswith("TIMESTAMP:"): return False
-            # Filter out all logs other than timestamp
-            if verbose_itm != 1 and not record.getMessage().startswith("TIMESTAMP:"): return False
-            return True
-        else:
-            return True
-
-
 MAX_ITM_FRAME_SIZE = 5
 
 ITM_RESET_TOKEN = bytes([0x63, 0xBB, 0xBB, 0xBB, 0xBB])
 
+# Regular expressions also search memoryviews, which don't support subsequence tests
+_reset_token_re = re.compile(re.escape(ITM_RESET_TOKEN))
+# Synchronization packets are zero bytes up to a byte with bit 7 set, or a 1
+_sync_end_re = re.compile(b"[^\x00]")
+
 HDR_OVERFLOW = 0x70
 
 
@@ -121,346 +100,816 @@ accessDict = {5: "at {}, Write Access, comparator: {}, value : 0x{:X} ",
               2: "at {}, PC value Access, comparator: {}, value : 0x{:X} "}
 
 
+def _partial_token_len(buf):
+    """Length of the longest suffix of buf that could be the start of a reset token"""
+    for n in range(min(len(buf), len(ITM_RESET_TOKEN) - 1), 0, -1):
+        if buf[-n:] == ITM_RESET_TOKEN[:n]:
+            return n
+    return 0
+
+
+class ResetTokenDetector:
+    """
+    Finds reset tokens in a stream that is parsed a buffer at a time, looking at each byte only once
+
+    Each buffer must start with what was left unparsed of the previous one. Only the bytes after those scanned before
+    are scanned, and a token split between two buffers is found from the part of it at the end of the first one.
+
+    Args:
+        offset: position in the stream of the first buffer
+
+    Attributes:
+        held: number of bytes at the end of the last buffer that are the start of a token. They can't be parsed until
+              the rest of the token has been received, or it turns out not to be one
+
+    """
+
+    def __init__(self, offset=0):
+        self.held = 0
+        self._scanned = offset  # Position in the stream of the first byte not scanned yet
+        self._tokens = deque()  # Positions in the stream of the tokens found and not passed yet
+
+    def find(self, buf, offset):
+        """
+        Get the first reset token in a buffer
+
+        Args:
+          buf: bytes-like object to search
+          offset: position of buf in the stream
+
+        Returns:
+            position in buf of the first reset token, or None if there is none
+        """
+        start = self._scanned - offset
+        if start < 0:
+            # Bytes were skipped without being scanned, so the token that was started can't be completed
+            start = 0
+            self.held = 0
+        if start < len(buf):
+            if self.held:
+                # See if the new bytes carry on the token started at the end of the previous buffer
+                missing = ITM_RESET_TOKEN[self.held:]
+                head = bytes(buf[start:start + len(missing)])
+                if len(head) == len(missing) and head == missing:
+                    self._tokens.append(offset + start - self.held)
+                    start += len(missing)
+                    self.held = 0
+                elif missing.startswith(head):
+                    self.held += len(head)
+                    start = len(buf)
+                else:
+                    self.held = 0
+            if start < len(buf):
+                for match in _reset_token_re.finditer(buf, start):
+                    self._tokens.append(offset + match.start())
+                self.held = _partial_token_len(buf[start:])
+            self._scanned = offset + len(buf)
+        # Tokens before the buffer have been parsed already
+        while self._tokens and self._tokens[0] < offset:
+            self._tokens.popleft()
+        return self._tokens[0] - offset if self._tokens else None
+
+
 def build_value(buf):
-    """Turn an iterable into a little-endian integer"""
-    value = 0
-    for idx, val in enumerate(buf): value += val << (idx * 8)
-    return value
+    """Turn an iterable of bytes into a little-endian integer"""
+    return int.from_bytes(bytes(buf), "little")
 
 
-@dataclass
 class ITMFrame:
-    """Base ITM frame that stores common information and should be subclassed by other frames"""
-    header: int
-    ts_counter: float = 0
-    size: int = 0
-    value: int = 0
-    string: str = "Frame has not yet been parsed"
+    """Base ITM frame that stores common information and should be subclassed by other frames
+
+    A frame is created for every packet, so frames only have slots and are described only when printed.
+    """
+    __slots__ = ("header", "ts_counter", "size", "value", "offset")
+    opcode = ITMOpcode.UNPARSED
+
+    def __init__(self, header, ts_counter=0, size=0, value=0, offset=0):
+        self.header = header
+        self.ts_counter = ts_counter
+        self.size = size
+        self.value = value
+        self.offset = offset  # Position of the header in the stream
 
     def __len__(self):
         return self.size
 
+    @property
+    def string(self):
+        """Description of the frame"""
+        return str(self)
 
-@dataclass
-class ITMSyncFrame(ITMFrame):
-    """ Synchronization Frame"""
-    opcode: ITMOpcode = ITMOpcode.SYNCHRONIZATION
-    data: list = field(default_factory=list)
-    size: int = 0
+    def __repr__(self):
+        return "{}(header=0x{:02X}, size={}, offset={})".format(type(self).__name__, self.header, self.size,
+                                                                self.offset)
 
-    """ Synchronization packets are at least 47 bytes of value zero followed by 1 byte of value one """
 
-    def parse(self, buf):
-        """Build ITMSyncFrame from buf"""
-        # Find index of 1 and add 1 since we want to remove the 1
-        idx = buf.index(1) + 1
+class ITMSyncFrame(ITMFrame):
+    """ Synchronization Frame"""
+    __slots__ = ("data",)
+    opcode = ITMOpcode.SYNCHRONIZATION
+
+    """ Synchronization packets are at least 47 bits of value zero followed by a bit of value one, which the ITM sends
+    as 5 zero bytes and 0x80. Older firmware ended them with 0x01 instead, which is still accepted """
+
+    def __init__(self, header, ts_counter=0):
+        super().__init__(header, ts_counter)
+        self.data = b""
+
+    def parse(self, buf, pos):
+        """Build ITMSyncFrame from buf starting at pos, and return the position after it"""
+        length = sync_length(buf, pos - 1)
+        if length == 0:
+            raise _NeedMoreData()
+        if length is None:
+            raise ValueError("Synchronization packet not ended by zero bytes and 0x80")
+        idx = pos - 1 + length
         # Store data
-        self.data = buf[:idx]
+        self.data = bytes(buf[pos:idx])
         self.size = len(self.data)
-        # Remove sync bytes from input data
-        return buf[idx:]
+        return idx
 
     def __str__(self):
         return "ITM Synchronization packet of size {}".format(self.size)
 
 
-@dataclass
 class ITMExtensionFrame(ITMFrame):
     """Extension Frame"""
-    opcode: ITMOpcode = ITMOpcode.EXTENSION
-    data: list = field(default_factory=list)
+    __slots__ = ("data",)
+    opcode = ITMOpcode.EXTENSION
 
     """ Extension packet is continued until most significant bit is 0"""
 
-    def parse(self, buf):
-        """Build ITMExtensionFrame from buf"""
-        for idx, val in enumerate(buf):
-            # Look for most significant bit to be 0
-            if val & 0x80 == 0:
-                self.size = idx
-            else:
-                self.data.append(buf[idx])
-        return buf[self.size:]
+    def __init__(self, header, ts_counter=0):
+        super().__init__(header, ts_counter)
+        self.data = b""
+
+    def parse(self, buf, pos):
+        """Build ITMExtensionFrame from buf starting at pos, and return the position after it"""
+        # The header's most significant bit tells if there is a payload at all
+        idx = pos
+        if self.header & 0x80:
+            # Payload bytes continue until one has its most significant bit at 0
+            while idx < len(buf):
+                idx += 1
+                if buf[idx - 1] & 0x80 == 0:
+                    break
+        self.data = bytes(buf[pos:idx])
+        self.size = idx - pos
+        return idx
 
     def __str__(self):
         return "ITM Extension Frame of size {}".format(self.size)
 
 
-@dataclass
 class ITMOverflowFrame(ITMFrame):
     """Overflow frame"""
-    opcode: ITMOpcode = ITMOpcode.OVERFLOW
+    __slots__ = ()
+    opcode = ITMOpcode.OVERFLOW
 
     """ Overflow packet is only one byte """
 
-    def __post_init__(self):
-        """Send warning that overflow frame occurred"""
+    def __init__(self, header, ts_counter=0):
+        super().__init__(header, ts_counter)
+        # Send warning that overflow frame occurred
         logger.warning("ITM Frame Overflow")
 
     def __str__(self):
         return "ITM Overflow packet"
 
 
-@dataclass
 class ITMTimestampFrame(ITMFrame):
     """Timestamp frame for all timestamp variants"""
-    opcode: ITMOpcode = ITMOpcode.TIMESTAMP
+    __slots__ = ()
+    opcode = ITMOpcode.TIMESTAMP
 
     """Retrieve and parse an ITM timestamp"""
 
-    def parse(self, buf):
-        """Build ITMTimestampFrame from buf"""
+    def parse(self, buf, pos):
+        """Build ITMTimestampFrame from buf starting at pos, and return the position after it"""
         # Find out what type of timestamp this is
-        try:
-            self.string = timestampDict[self.header >> 4]
-        except KeyError:
-            self.string = " TS reserved"
+        if self.header >> 4 not in timestampDict:
             logger.warning("Reserved field used for timestamp")
 
         # Only build a timestamp if there is a continuation bit
-        if (self.header & 0x80) and len(buf) > 0:
-            for idx, val in enumerate(buf):
+        if (self.header & 0x80) and pos < len(buf):
+            # At most 4 payload bytes, continued until one has its most significant bit at 0
+            for idx in range(min(4, len(buf) - pos)):
+                val = buf[pos + idx]
                 # Continue adding value, shifting left each time
                 self.ts_counter += (val & 0x7F) << (7 * idx)
                 if val & 0x80 == 0:
                     # No continuation bit == stop
                     self.size = idx + 1
                     break
-            self.string = "TIMESTAMP {}: + {} cycles".format(self.string, self.ts_counter)
-        else:
-            self.string = "reserved timestamp header {}".format(self.header)
-        return buf[self.size:]
+        return pos + self.size
 
     def __str__(self):
-        return self.string
+        if self.header & 0x80:
+            return "TIMESTAMP {}: + {} cycles".format(timestampDict.get(self.header >> 4, " TS reserved"),
+                                                      self.ts_counter)
+        return "reserved timestamp header {}".format(self.header)
 
 
-@dataclass
 class ITMSourceFrame(ITMFrame):
     """Software or hardware source frame. SW / HW frames should subclass this"""
-    port: ITMStimulusPort = None
-
-    def __post_init__(self):
-        self.port = ITMStimulusPort(self.header >> 3)
-        # Get size
-        var_len = self.header & 0x03
-        if var_len == 3:
-            self.size = 4
-        else:
-            self.size = var_len
+    __slots__ = ("port",)
+
+    def __init__(self, header, ts_counter=0, size=None, port=None):
+        super().__init__(header, ts_counter)
+        # Already known when built from the header table
+        if port is None:
+            port = ITMStimulusPort(header >> 3)
+            size = _source_size(header)
+        self.port = port
+        self.size = size
 
 
-@dataclass
 class ITMSourceHwPcFrame(ITMSourceFrame):
     """Program Counter Hardware Source Frame"""
-    opcode: ITMOpcode = ITMOpcode.PACKET_PC
+    __slots__ = ()
+    opcode = ITMOpcode.PACKET_PC
 
-    def parse(self, buf):
-        """Build ITMSourceHwPcFrame from buf"""
-        self.value = build_value(buf[:self.size])
-        return buf[self.size:]
+    def parse(self, buf, pos):
+        """Build ITMSourceHwPcFrame from buf starting at pos, and return the position after it"""
+        self.value = int.from_bytes(buf[pos:pos + self.size], "little")
+        return pos + self.size
 
     def __str__(self):
         if self.size == 4:
-            self.string = "Received a PC sample @ {} PC: 0x{:X}".format(self.ts_counter, self.value)
-        else:
-            self.string = "Received a IDLE PC sample @ {}".format(self.ts_counter)
-        return self.string
+            return "Received a PC sample @ {} PC: 0x{:X}".format(self.ts_counter, self.value)
+        return "Received a IDLE PC sample @ {}".format(self.ts_counter)
 
 
-@dataclass
 class ITMSourceHwCntWrapFrame(ITMSourceFrame):
     """Hardware Source Frame indicating which counter(s) have wrapped."""
-    opcode: ITMOpcode = ITMOpcode.COUNTER_WRAP
+    __slots__ = ()
+    opcode = ITMOpcode.COUNTER_WRAP
 
-    def parse(self, buf):
-        """Build ITMSourceHwCntWrapFrame from buf"""
+    def parse(self, buf, pos):
+        """Build ITMSourceHwCntWrapFrame from buf starting at pos, and return the position after it"""
         # Payload is only one byte
-        self.value = buf[0]
-        return buf[1:]
+        self.value = buf[pos]
+        return pos + 1
 
     def __str__(self):
         string = "At timestamp {}, the following counter(s) wrapped: ".format(self.ts_counter)
         return string + "".join([counterDict[i] + " " if self.value & (1 << i) else "" for i in counterDict.keys()])
 
 
-@dataclass
 class ITMSourceHwExceptionFrame(ITMSourceFrame):
     """Hardware source frame indicating exceptions such as interrupt entrance / exit"""
-    opcode: ITMOpcode = ITMOpcode.EXCEPTION
-    num_exception: int = 0
-    func_exception: int = 0
+    __slots__ = ("num_exception", "func_exception")
+    opcode = ITMOpcode.EXCEPTION
 
-    def parse(self, buf):
-        """Build ITMSourceHwExceptionFrame from buf"""
-        self.num_exception = buf[0] + ((buf[1] & 0x1) << 8)
-        self.func_exception = (buf[1] & 0x30) >> 4
-        # We used two bytes so discard them now
-        return buf[2:]
+    def __init__(self, header, ts_counter=0, size=None, port=None):
+        super().__init__(header, ts_counter, size, port)
+        self.num_exception = 0
+        self.func_exception = 0
+
+    def parse(self, buf, pos):
+        """Build ITMSourceHwExceptionFrame from buf starting at pos, and return the position after it"""
+        self.num_exception = buf[pos] + ((buf[pos + 1] & 0x1) << 8)
+        self.func_exception = (buf[pos + 1] & 0x30) >> 4
+        # We used two bytes
+        return pos + 2
 
     def __str__(self):
         return "An Exception has occurred @ {}, Exception Number: {}, Function done: {}".format(
-            self.ts_counter, self.num_exception, hwExecfunctDict[self.func_exception])
+            self.ts_counter, self.num_exception, hwExecfunctDict.get(self.func_exception, "Reserved"))
 
 
-@dataclass
 class ITMSourceHwTraceFrame(ITMSourceFrame):
     """Hardware source frame indicating all possibilities: watchpoints, etc"""
-    opcode: ITMOpcode = ITMOpcode.TRACE
-    hwPacketType: int = 0
-    dataTracePacketType: int = 0
-    comparator: int = 0
-    direction: int = 0
-
-    def __post_init__(self):
-        """Extract information from hardware packet type"""
-        self.dataTracePacketType = self.hwPacketType >> 3
-        self.comparator = (self.hwPacketType >> 1) & 0x3
-        self.direction = self.hwPacketType & 0x1
+    __slots__ = ("hwPacketType", "dataTracePacketType", "comparator", "direction", "accessType")
+    opcode = ITMOpcode.TRACE
+
+    def __init__(self, header, ts_counter=0, size=None, port=None, hwPacketType=0):
+        super().__init__(header, ts_counter, size, port)
+        # Extract information from hardware packet type
+        self.hwPacketType = hwPacketType
+        self.dataTracePacketType = hwPacketType >> 3
+        self.comparator = (hwPacketType >> 1) & 0x3
+        self.direction = hwPacketType & 0x1
         self.accessType = self.direction + (self.dataTracePacketType << 1)
-        super().__post_init__()
 
-    def parse(self, buf):
-        """Build ITMSourceHwTraceFrame from buf"""
-        self.value = build_value(buf[:self.size])
-        return buf[self.size:]
+    def parse(self, buf, pos):
+        """Build ITMSourceHwTraceFrame from buf starting at pos, and return the position after it"""
+        self.value = int.from_bytes(buf[pos:pos + self.size], "little")
+        return pos + self.size
 
     def __str__(self):
         return "HW Trace " + accessDict[self.accessType].format(self.ts_counter / 1000, self.comparator, self.value)
 
 
-@dataclass
 class ITMSourceSWFrame(ITMSourceFrame):
     """Software source frame"""
-    opcode: ITMOpcode = ITMOpcode.SOURCE_SW
-    data: list = field(default_factory=list)
+    __slots__ = ("data",)
+    opcode = ITMOpcode.SOURCE_SW
 
-    def parse(self, buf):
-        """Build ITMSourceSWFrame from buf"""
-        # Store data
-        self.data = buf[:self.size]
-        # build string
-        self.string = "SW SWIT at +{}, port {}: {}".format(
-            self.ts_counter, self.port.name, " ".join((("0x{:02X}".format(i)) for i in self.data)))
-        return buf[self.size:]
+    def __init__(self, header, ts_counter=0, size=None, port=None):
+        super().__init__(header, ts_counter, size, port)
+        self.data = b""
+
+    def parse(self, buf, pos):
+        """Build ITMSourceSWFrame from buf starting at pos, and return the position after it"""
+        # Store data. Copy it since buf may be a view of the receive buffer
+        self.data = bytes(buf[pos:pos + self.size])
+        return pos + self.size
 
     def __str__(self):
-        return self.string
+        return "SW SWIT at +{}, port {}: {}".format(
+            self.ts_counter, self.port.name, " ".join((("0x{:02X}".format(i)) for i in self.data)))
+
+
+def _source_size(header):
+    """Payload size of a source packet"""
+    var_len = header & 0x03
+    return 4 if var_len == 3 else var_len
+
+
+def _untimed(frame_class):
+    """Build frames that don't carry the running timestamp"""
+    return lambda header, ts_counter: frame_class(header)
+
+
+# How to handle a header byte. new_frame(header, ts_counter) builds its frame, or is None for headers that can't start a
+# packet. port and size are those of source packets. length is the number of bytes parsed for the packet including the
+# header, or None for packets that go on until a byte that ends them
+ITMHeader = namedtuple("ITMHeader", "opcode new_frame port size length")
+
+
+def _classify_header(header):
+    """
+    Figure out what type of packet a header byte starts
+
+    Args:
+      header: header byte
+
+    Returns:
+        ITMHeader
+    """
+    # Synchronization packet is all zeros
+    if header == 0x00:
+        return ITMHeader(ITMOpcode.SYNCHRONIZATION, _untimed(ITMSyncFrame), None, 0, None)
+    # Everything besides source packets have the 2 least significant bits set to 0
+    if (header & 0x03) == 0x00:
+        # Header == Overflow
+        if header == HDR_OVERFLOW:
+            return ITMHeader(ITMOpcode.OVERFLOW, _untimed(ITMOverflowFrame), None, 0, 1)
+        # Least significant byte of header Header == 0 --> Local timestamp
+        if (header & 0x0F) == 0x00:
+            return ITMHeader(ITMOpcode.TIMESTAMP, _untimed(ITMTimestampFrame), None, 0, None)
+        # Least significant byte of header with S bit masked out == Extension
+        if (header & 0x0B) == 0x08:
+            return ITMHeader(ITMOpcode.EXTENSION, _untimed(ITMExtensionFrame), None, 0, None)
+        # Reserved
+        return ITMHeader(ITMOpcode.UNPARSED, None, None, 0, 1)
+    # Source packets have non-zero least significant bits
+    port = ITMStimulusPort(header >> 3)
+    size = _source_size(header)
+    # 3rd bit == 0 --> Software Source
+    if (header & 0x04) == 0x00:
+        return ITMHeader(ITMOpcode.SOURCE_SW, partial(ITMSourceSWFrame, port=port, size=size), port, size, 1 + size)
+    # 3rd bit == 1 --> Hardware Source. Get packet type discriminator ID
+    hw_packet_type = header >> 3
+    # This is a counter Wrap
+    if hw_packet_type == 0x00:
+        # Counter wrap packets are parsed as 1 byte and exception packets as 2, whatever their size bits
+        return ITMHeader(ITMOpcode.COUNTER_WRAP, partial(ITMSourceHwCntWrapFrame, port=port, size=size), port, size, 2)
+    # This is an exception event
+    if hw_packet_type == 0x01:
+        return ITMHeader(ITMOpcode.EXCEPTION, partial(ITMSourceHwExceptionFrame, port=port, size=size), port, size, 3)
+    # This is a PC sampling event
+    if hw_packet_type == 0x02:
+        return ITMHeader(ITMOpcode.PACKET_PC, partial(ITMSourceHwPcFrame, port=port, size=size), port, size, 1 + size)
+    # This is a hardware trace packet. Discriminators 3 to 7 are reserved
+    if 0x08 <= hw_packet_type <= 0x17:
+        return ITMHeader(ITMOpcode.TRACE, partial(ITMSourceHwTraceFrame, hwPacketType=hw_packet_type, port=port,
+                                                  size=size), port, size, 1 + size)
+    # Anything else is invalid
+    return ITMHeader(ITMOpcode.UNPARSED, None, port, size, 1)
+
+
+# Classification of every header byte, so that it is a single lookup per packet
+ITM_HEADER_TABLE = tuple(_classify_header(header) for header in range(256))
+
+# After a header byte that can't start a packet, or a malformed synchronization packet, parsing carries on at the first
+# position within RESYNC_WINDOW bytes that starts RESYNC_PACKETS packets in a row with valid headers, or a
+# synchronization packet
+RESYNC_WINDOW = 64
+RESYNC_PACKETS = 3
+
+
+class _NeedMoreData(Exception):
+    """Raised by a packet that runs to the end of the buffer, so that it is parsed again once more data arrives"""
+
+
+def sync_length(buf, pos):
+    """
+    Get the length of the synchronization packet at pos
+
+    Args:
+      buf: buffer being parsed
+      pos: position of the synchronization packet header
+
+    Returns:
+        length including the header, None if the first byte after the zero bytes has neither bit 7 set nor is 1, or 0 if
+        the zero bytes run to the end of buf so that the length isn't known yet
+    """
+    end = _sync_end_re.search(buf, pos + 1)
+    if end is None:
+        return 0
+    last = buf[end.start()]
+    if last & 0x80 == 0 and last != 1:
+        return None
+    return end.end() - pos
+
+
+def _variable_length(buf, pos, itm_header):
+    """Length of the timestamp or extension packet at pos, as it is parsed"""
+    if buf[pos] & 0x80 == 0:
+        return 1
+    if itm_header.opcode is ITMOpcode.TIMESTAMP:
+        # At most 4 payload bytes, and no payload at all if none of them ends it
+        for idx in range(min(4, len(buf) - pos - 1)):
+            if buf[pos + 1 + idx] & 0x80 == 0:
+                return idx + 2
+        return 1
+    idx = pos + 1
+    while idx < len(buf):
+        idx += 1
+        if buf[idx - 1] & 0x80 == 0:
+            break
+    return idx - pos
+
+
+def _starts_packets(buf, pos, end):
+    """
+    Check whether RESYNC_PACKETS packets with valid headers, or a synchronization packet, start at pos
+
+    Returns:
+        True or False, or None if that can't be told until more data arrives
+    """
+    for _ in range(RESYNC_PACKETS):
+        if pos >= end:
+            return None
+        itm_header = ITM_HEADER_TABLE[buf[pos]]
+        if itm_header.new_frame is None:
+            return False
+        if itm_header.length is not None:
+            pos += itm_header.length
+        elif itm_header.opcode is ITMOpcode.SYNCHRONIZATION:
+            length = sync_length(buf, pos)
+            return None if length == 0 else length is not None
+        else:
+            pos += _variable_length(buf, pos, itm_header)
+    return True
+
+
+def resync_point(buf, pos, end):
+    """
+    Find where to carry on parsing after a header byte that can't start a packet
+
+    Looks at no more than RESYNC_WINDOW positions, so that corrupt data costs bounded work. A position is only taken
+    once the packets it starts are all before end, so that where parsing carries on doesn't depend on how the stream
+    is split into buffers
+
+    Args:
+      buf: buffer being parsed
+      pos: position of the invalid header byte
+      end: position parsing stops at
+
+    Returns:
+        first position after pos that starts valid packets, the end of the window if there is none, or None if that
+        can't be told until more data arrives
+    """
+    for candidate in range(pos + 1, min(pos + RESYNC_WINDOW, end)):
+        starts = _starts_packets(buf, candidate, end)
+        if starts is not False:
+            return candidate if starts else None
+    return None if pos + RESYNC_WINDOW > end else pos + RESYNC_WINDOW
+
+# Packets that ITMFilter can't skip
+_UNSKIPPABLE = (ITMOpcode.SYNCHRONIZATION, ITMOpcode.TIMESTAMP, ITMOpcode.EXTENSION)
+_KEEP_ALL = (0,) * 256
+
+
+def count_by_kind(header_counts):
+    """
+    Add up packet counts per header byte into counts per kind of packet
+
+    Args:
+      header_counts: list of the number of packets of each header byte
+
+    Returns:
+        dict of counts keyed by ITMOpcode, UNPARSED for headers that can't start a packet
+    """
+    counts = {}
+    for header, count in enumerate(header_counts):
+        if count:
+            opcode = ITM_HEADER_TABLE[header].opcode
+            counts[opcode] = counts.get(opcode, 0) + count
+    return counts
+
+
+class ITMFilter:
+    """
+    Chooses which packets ITMFramer builds frames for
+
+    A packet is kept if its kind is allowed and not denied, and for software source packets if its stimulus port is
+    too. The others are skipped over by their length as soon as their header is read, without building anything. Only
+    source and overflow packets can be skipped: timestamps keep the time base, and synchronization and extension packets
+    have no fixed length. Since SWOFramer doesn't see skipped packets, it can't count their transmission time in the
+    time of the frames that follow before the next timestamp.
+
+    Args:
+        kinds: ITMOpcodes to keep, None for all. Kinds that can't be skipped are always kept
+        ports: ITMStimulusPorts to keep software source packets of, None for all
+        deny_kinds: ITMOpcodes to skip
+        deny_ports: ITMStimulusPorts to skip software source packets of
+    """
+
+    def __init__(self, kinds=None, ports=None, deny_kinds=(), deny_ports=()):
+        for kind in deny_kinds:
+            if kind in _UNSKIPPABLE:
+                raise ValueError("ITM {} packets can't be skipped".format(kind.name))
+        self.kinds = None if kinds is None else set(kinds)
+        self.ports = None if ports is None else set(ports)
+        self.deny_kinds = set(deny_kinds)
+        self.deny_ports = set(deny_ports)
+
+    def keeps(self, itm_header):
+        """
+        Check whether packets of a header are kept
+
+        Args:
+          itm_header: ITMHeader of the header byte
+
+        Returns:
+            True if a frame is built for them
+        """
+        if itm_header.new_frame is None or itm_header.opcode in _UNSKIPPABLE:
+            return True
+        if itm_header.opcode in self.deny_kinds or (self.kinds is not None and itm_header.opcode not in self.kinds):
+            return False
+        if itm_header.opcode is ITMOpcode.SOURCE_SW:
+            return itm_header.port not in self.deny_ports and (self.ports is None or itm_header.port in self.ports)
+        return True
+
+    def skip_lengths(self):
+        """
+        Get how to skip packets of each header byte
+
+        Returns:
+            tuple of the length of the packets of each header byte if they are skipped, 0 if they are kept
+        """
+        return tuple(0 if self.keeps(h) else h.length for h in ITM_HEADER_TABLE)
 
 
 class ITMFramer:
     """
-    Manages parsing serial data into ITMFrames and outputs ITMFrames onto output queue q
+    Manages parsing serial data into ITMFrames
+
+    :method:parse_batch returns the frames of each buffer as a list. For threaded callers, :method:parse puts them on
+    output queue q instead.
 
     Args:
-        q: Output queue
+        q: Output queue for :method:parse, None if only :method:parse_batch is used
+        synced: True if the first buffer starts on a packet boundary, to start parsing without a Reset Frame
+        offset: position in the stream of the first buffer
+        packet_filter: ITMFilter of the packets to build frames for, None for all
+        raw_ports: ITMStimulusPorts whose software packets are skipped without building frames, whatever packet_filter
+            keeps, and recorded in raw_runs instead
+
+    Attributes:
+        offset: position in the stream of the next buffer, counting every byte parsed or discarded
+        header_counts: number of packets parsed or skipped for each header byte, see :method:packet_counts
+        skipped: number of packets skipped by packet_filter
+        raw_runs: list of (start, end, header, ts_counter) of each run of back-to-back packets of raw_ports with the
+            same header in the last buffer passed to :method:parse_batch, as positions in that buffer
+        invalid_headers: number of header bytes that couldn't start a packet and malformed packets, each followed by a
+            resync
+        resync_bytes: number of bytes skipped to resync, including the invalid header bytes
+        longest_resync: most bytes skipped by one resync, which is how long recovering took
+        tracer: itm_tracer.Tracer recording framing events, None to not trace
 
     """
 
-    def __init__(self, q):
-        # Set up logging
-        logger.addFilter(LoggingFilter())
+    # Framing events are recorded when a Tracer is set
+    tracer = None
+
+    def __init__(self, q=None, synced=False, offset=0, packet_filter=None, raw_ports=()):
         # Create the PDU stream thread.
         self._out_q = q
-        self._first_read = True
+        self._first_read = not synced
         self.last_ts_counter = 0
-        logger.critical("ITM Framer initialized. Must receive Reset Frame to start parsing")
+        self.invalid_headers = 0
+        self.resync_bytes = 0
+        self.longest_resync = 0
+        self.offset = offset
+        self._reset_tokens = ResetTokenDetector(offset)
+        self._skip_lengths = _KEEP_ALL if packet_filter is None else packet_filter.skip_lengths()
+        # Packets of the raw ports are skipped too, and only where they are is kept
+        raw_ports = set(raw_ports)
+        self._raw = tuple(h.opcode is ITMOpcode.SOURCE_SW and h.port in raw_ports for h in ITM_HEADER_TABLE)
+        if raw_ports:
+            self._skip_lengths = tuple(h.length if raw else skip
+                                       for h, raw, skip in zip(ITM_HEADER_TABLE, self._raw, self._skip_lengths))
+        self.raw_runs = []
+        self.header_counts = [0] * 256
+        self.skipped = 0
+        if synced:
+            logger.critical("ITM Framer initialized at offset {}".format(offset))
+        else:
+            logger.critical("ITM Framer initialized. Must receive Reset Frame to start parsing")
+
+    def packet_counts(self):
+        """
+        Get the number of packets parsed or skipped so far
+
+        Returns:
+            dict of counts keyed by ITMOpcode, UNPARSED for invalid headers
+        """
+        return count_by_kind(self.header_counts)
+
+    def _resync(self, header, buf, pos, end):
+        """
+        Handle a header byte that can't start a packet or a malformed packet, which means the stream is corrupt or out
+        of step
+
+        Parsing carries on at the next position that starts valid packets, see :func:resync_point
+
+        Args:
+          header: the header byte
+          buf: buffer being parsed
+          pos: position after the header byte
+          end: position parsing stops at
+
+        Returns:
+            position to carry on parsing from, or None to parse the header again once more data arrives
+        """
+        start = pos - 1
+        pos = resync_point(buf, start, end)
+        if pos is None:
+            return None
+        skipped = pos - start
+        self.invalid_headers += 1
+        self.resync_bytes += skipped
+        self.longest_resync = max(self.longest_resync, skipped)
+        if self.tracer is not None:
+            self.tracer.record(TraceEvent.ITM_INVALID_HEADER, self.offset + start, header)
+            self.tracer.record(TraceEvent.ITM_RESYNC, self.offset + pos, skipped)
+        logger.warning("Invalid ITM packet 0x{:02X}, skipping {} bytes to resync".format(header, skipped))
+        return pos
+
+    def _hold(self, header, header_offset):
+        """
+        Leave a header unparsed until more data arrives, as what follows it runs past the end of the buffer
+
+        Args:
+          header: the header byte, which is counted again when it is parsed
+          header_offset: position in the stream of the header byte
+
+        Returns:
+            position in the buffer to stop parsing at
+        """
+        self.header_counts[header] -= 1
+        return header_offset - self.offset
+
+    def discard(self, n):
+        """
+        Drop bytes left unparsed instead of passing them again with the next buffer, such as those before a gap
+
+        Args:
+          n: number of bytes at the start of the unparsed portion of the last buffer that are dropped
+        """
+        if self.tracer is not None: self.tracer.record(TraceEvent.ITM_DISCARD, self.offset, n)
+        self.offset += n
+        self._reset_tokens = ResetTokenDetector(self.offset)
 
     def parse(self, buf=None):
+        """
+        Parse all of an input byte buffer into ITMFrames, and put them on the output queue
+
+        See :method:parse_batch
+
+        Args:
+          buf: input buffer to parse (Default value = None). Any bytes-like object; it is not copied or modified
+
+        Returns:
+            Unparsed portion of the input buffer, as a memoryview
+
+        """
+        frames, rest = self.parse_batch(buf)
+        for frame in frames:
+            self._out_q.put(frame)
+        return rest
+
+    def parse_batch(self, buf):
         """
         Parse all of an input byte buffer into ITMFrames until the buffer size is <= MAX_ITM_FRAME_SIZE
 
         There is special funcionality to handle the reset frame (indentified by ITM_RESET_TOKEN). Initially,
         parsing of other frames will not start until the reset frame is found. After this, the buffer received for
         parsing will be searched for the reset frame. If the reset frame is found, all preceding data will be discarded
-        and parsing will continue at the  software source frame containing the rest
+        and parsing will continue at the  software source frame containing the rest. The buffer must start with the
+        unparsed portion of the previous one
 
         Args:
-          buf: input buffer to parse (Default value = None)
+          buf: input buffer to parse. Any bytes-like object; it is not copied or modified
 
         Returns:
-            Unparsed portion of the input buffer
+            frames: list of parsed ITMFrames, in order
+            rest: unparsed portion of the input buffer, as a memoryview
 
         """
-        if len(buf) is 0: return buf
-
-        # Return full buffer in case any part of the rest token was at the end, in
-        # which case only part of the token may have been received. Then reparse
-        # the next time data is added to the buffer
-        if buf[-1] is 0xBB or buf[-1] is 0xC0:
-            return buf
+        frames = []
+        self.raw_runs = runs = []
+        data = memoryview(buf)
+        if len(data) == 0: return frames, data
+
+        # Only the new bytes are scanned for reset tokens. The last bytes are held back if they are the start of a reset
+        # token of which only part has been received, and reparsed the next time data is added to the buffer
+        token = self._reset_tokens.find(data, self.offset)
+        buf = data[:len(data) - self._reset_tokens.held]
+        # The buffer is walked with a cursor, so that nothing is copied or resliced per packet
+        pos = 0
+        tracer = self.tracer
         # If the reset token is found
-        elif ITM_RESET_TOKEN in buf:
+        if token is not None:
             # Discard anything before the reset token
-            buf = buf[buf.index(ITM_RESET_TOKEN):]
+            pos = token
+            if tracer is not None: tracer.record(TraceEvent.ITM_RESET, self.offset + pos)
         # If first run and no reset found yet, don't parse anything
         elif self._first_read is True:
-            logger.debug("Waiting for a reset frame to begin parsing.")
-            return bytearray()
+            if tracer is not None: tracer.record(TraceEvent.ITM_WAIT_RESET, self.offset, len(buf))
+            self.offset += len(buf)
+            return frames, data[len(buf):]
 
         # While there is a full packet to parse...
-        while len(buf) > MAX_ITM_FRAME_SIZE:
+        end = len(buf) - MAX_ITM_FRAME_SIZE
+        raw = self._raw
+        run_start = run_end = run_header = run_ts = -1
+        while pos < end:
             # If this was the first time, clear this flag
             if self._first_read: self._first_read = False
             # Read the header byte
-            header = buf.pop(0)
+            header_offset = self.offset + pos
+            header = buf[pos]
+            self.header_counts[header] += 1
+            # Skip unwanted packets without building them
+            skip = self._skip_lengths[header]
+            if skip:
+                if raw[header]:
+                    # Raw port packets right after one with the same header carry on its run
+                    if pos != run_end or header != run_header:
+                        if run_end > run_start: runs.append((run_start, run_end, run_header, run_ts))
+                        run_start, run_header, run_ts = pos, header, self.last_ts_counter
+                    run_end = pos + skip
+                else:
+                    self.skipped += 1
+                pos += skip
+                continue
+            pos += 1
 
             # Figure out what type of packet this is
-            # Synchronization packet is all zeros
-            if header == 0x00:
-                frame = ITMSyncFrame(0)
-            else:
-                # Everything besides source packets have the 2 least significant bits set to 0
-                if (header & 0x03) == 0x00:
-                    # Header == Overflow
-                    if header == HDR_OVERFLOW:
-                        frame = ITMOverflowFrame(header)
-                    # Least significant byte of header Header == 0 --> Local timestamp
-                    elif (header & 0x0F) == 0x00:
-                        frame = ITMTimestampFrame(header)
-                    # Least significant byte of header with S bit masked out == Extension
-                    elif (header & 0x0B) == 0x08:
-                        frame = ITMExtensionFrame(header)
-                # Source packets have non-zero least significant bits
-                else:
-                    # 3rd bit == 0 --> Software Source
-                    if (header & 0x04) == 0x00:
-                        frame = ITMSourceSWFrame(header, ts_counter=self.last_ts_counter)
-                    # 3rd bit == 1 --> Hardware Source
-                    else:
-                        # Get packet type discriminator ID
-                        hw_packet_type = header >> 3
-                        # This is a counter Wrap
-                        if hw_packet_type == 0x00:
-                            frame = ITMSourceHwCntWrapFrame(header, ts_counter=self.last_ts_counter)
-                        # This is an exception event
-                        elif hw_packet_type == 0x01:
-                            frame = ITMSourceHwExceptionFrame(header, ts_counter=self.last_ts_counter)
-                        # This is a PC sampling event
-                        elif hw_packet_type == 0x02:
-                            frame = ITMSourceHwPcFrame(header, ts_counter=self.last_ts_counter)
-                        # This is a hardware trace packet
-                        elif hw_packet_type <= 0x17:
-                            frame = ITMSourceHwTraceFrame(header, hwPacketType=hw_packet_type,
-                                                          ts_counter=self.last_ts_counter)
-                        # Anything else is invalid
-                        else:
-                            logger.error("Invalid ITM Hardware Source Packet")
+            new_frame = ITM_HEADER_TABLE[header].new_frame
+            if new_frame is None:
+                pos = self._resync(header, buf, pos, end)
+                if pos is None:
+                    pos = self._hold(header, header_offset)
+                    break
+                continue
+            frame = new_frame(header, ts_counter=self.last_ts_counter)
 
             # Parse packet based on packet type
             try:
+                frame.offset = header_offset
                 if frame.opcode is not ITMOpcode.OVERFLOW:
                     # Parse buffer
-                    buf = frame.parse(buf)
+                    pos = frame.parse(buf, pos)
                     # Update timestamp if needed
                     if frame.opcode == ITMOpcode.TIMESTAMP: self.last_ts_counter = frame.ts_counter
-                    # Log packet that was just parsed
-                    logger.debug("%s" % frame)
-                    # queue packet for output
-                    self._out_q.put(frame)
+                    # Trace packet that was just parsed
+                    if tracer is not None:
+                        if frame.opcode == ITMOpcode.TIMESTAMP:
+                            tracer.record(TraceEvent.ITM_TIMESTAMP, header_offset, frame.ts_counter)
+                        else:
+                            tracer.record(TraceEvent.ITM_PACKET, header_offset, header)
+                    # Add packet to the output batch
+                    frames.append(frame)
+            except _NeedMoreData:
+                pos = self._hold(header, header_offset)
+                break
             except Exception as e:
-                logger.error("Invalid ITM Packet")
-                logger.debug(e)
+                if tracer is not None: tracer.record(TraceEvent.ITM_PACKET_ERROR, header_offset, e)
+                pos = self._resync(header, buf, header_offset - self.offset + 1, end)
+                if pos is None:
+                    pos = self._hold(header, header_offset)
+                    break
+
+        if run_end > run_start: runs.append((run_start, run_end, run_header, run_ts))
 
-        # Return unparsed data
-        return buf
+        # Return unparsed data, including any bytes held back
+        self.offset += pos
+        return frames, data[pos:]
@@ -0,0 +1,589 @@
+"""
+Split ITM data into packets in bulk with NumPy, for offline decoding of large captures
+
+Gives the same packets as ITMFramer.parse_batch for the same buffers, but without a Python loop per packet:
+
+1. The length of the packet a header at each position would start is looked up from the header byte, and for variable
+   length packets from the position of the next byte that can end them
+2. The positions that parsing from the first reset token actually goes through are found by walking the packets of
+   short segments of the buffer all at once, each from its first byte. Starting from the wrong byte mostly runs into the
+   real packet boundaries within a few packets, so only where parsing enters a segment off its walk is walked again,
+   which keeps this linear in the buffer size. Resyncs are only looked for after the invalid headers that are reached
+3. Ports, sizes, payload values and running timestamps of those packets are gathered into arrays
+
+Needs numpy.
+"""
+
+import sys
+import time
+import logging
+import argparse
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .itm_framer import ITMFramer, ITMOpcode, ITM_HEADER_TABLE, MAX_ITM_FRAME_SIZE, ResetTokenDetector, count_by_kind
+from .itm_framer import RESYNC_WINDOW, RESYNC_PACKETS
+
+logger = logging.getLogger("ITM Tokenizer")
+
+# Packets of a buffer, one array element per packet:
+#   offset: position of the header in the stream
+#   opcode: ITMOpcode value
+#   header: header byte
+#   port: ITMStimulusPort value of source packets, -1 for other packets
+#   size: payload size, as in the size of the matching ITMFrame
+#   value: little-endian payload of source packets, 0 for other packets
+#   ts_counter: timestamp, as in the ts_counter of the matching ITMFrame
+ITMPackets = namedtuple("ITMPackets", "offset opcode header port size value ts_counter")
+
+NO_OPCODE = -1  # Headers that can't start a packet
+UNRESOLVED = -1  # End of an invalid header whose resync point isn't known yet
+HELD = 1 << 62  # End of a packet that runs past the end of the buffer, which is parsed again once more data arrives
+
+# Number of segments _chain walks at once, bytes in each segment, and most times a changed exit may carry on into the
+# next segment before the stream is left to pointer doubling
+_LANES = 4096
+_MIN_SEGMENT = 64
+_MAX_SEGMENT = 1024
+_MAX_ROUNDS = 64
+# Positions other packets don't end on are dropped until a pass keeps more than this share of them, and pointer doubling
+# finishes the job
+_SETTLE_RATIO = 0.9
+
+
+def _header_tables():
+    """Opcode, payload size and length of fixed length packets of every header byte"""
+    opcode = numpy.full(256, NO_OPCODE, numpy.int8)
+    size = numpy.zeros(256, numpy.uint8)
+    length = numpy.ones(256, numpy.int64)
+    for header, itm_header in enumerate(ITM_HEADER_TABLE):
+        if itm_header.length is not None:
+            length[header] = itm_header.length
+        if itm_header.new_frame is not None:
+            opcode[header] = itm_header.opcode.value
+            size[header] = itm_header.size
+    return opcode, size, length
+
+
+if numpy is not None:
+    _OPCODE, _SIZE, _LENGTH = _header_tables()
+    _PAYLOAD_MASK = numpy.array([0, 0xFF, 0xFFFF, 0xFFFFFF, 0xFFFFFFFF], numpy.uint32)
+
+
+def _empty_packets():
+    """ITMPackets without any packet"""
+    return ITMPackets(numpy.empty(0, numpy.int64), numpy.empty(0, numpy.int8), numpy.empty(0, numpy.uint8),
+                      numpy.empty(0, numpy.int8), numpy.empty(0, numpy.int64), numpy.empty(0, numpy.uint32),
+                      numpy.empty(0, numpy.int64))
+
+
+def _run_ends(inside):
+    """
+    Find where runs of bytes end
+
+    Args:
+      inside: numpy bool array of the bytes that are in a run
+
+    Returns:
+        sorted numpy array of the positions right after the last byte of each run, at which the run ends
+    """
+    return numpy.flatnonzero(inside[:-1] & ~inside[1:]) + 1
+
+
+def _next_match(matches, positions, none):
+    """For each position, the first element of the sorted array matches at or after it, or none if there is none"""
+    i = numpy.searchsorted(matches, positions)
+    return numpy.append(matches, none)[i]
+
+
+def _resync_points(opcodes, ends, invalid):
+    """
+    Where parsing carries on after each invalid header, as with :func:itm_framer.resync_point
+
+    Args:
+      opcodes: opcode of the header at each position
+      ends: where the packet at each position ends
+      invalid: positions of invalid headers
+
+    Returns:
+        array of the position to carry on from for each invalid header, HELD where that can't be told until more data
+        arrives
+    """
+    n = len(ends)
+    # The positions of the window after each header, one row per header, followed for RESYNC_PACKETS packets. Each
+    # position is found to start packets, not to, or to need more data
+    p = invalid[:, None] + numpy.arange(1, RESYNC_WINDOW)
+    starts = numpy.ones(p.shape, bool)
+    held = numpy.zeros(p.shape, bool)
+    done = numpy.zeros(p.shape, bool)
+    for _ in range(RESYNC_PACKETS):
+        here = numpy.minimum(p, n - 1)
+        opcode = opcodes[here]
+        following = ends[here]
+        # Running into the end before all packets are seen needs more data
+        held |= ~done & (p >= n)
+        done |= p >= n
+        starts &= done | (opcode != NO_OPCODE)
+        # A synchronization packet ends the check, unless it runs to the end too
+        sync = ~done & (opcode == ITMOpcode.SYNCHRONIZATION.value)
+        held |= sync & (following == HELD)
+        done |= ~starts | sync
+        p = numpy.where(done, n, following)
+    # The first position that isn't ruled out is taken, unless it needs more data
+    decided = starts & ~held
+    candidate = (starts | held).argmax(axis=1)
+    rows = numpy.arange(len(invalid))
+    found = numpy.where(decided[rows, candidate], invalid + 1 + candidate, HELD)
+    # Without any, parsing carries on after the window, if all of it is before the end
+    none = ~(starts | held).any(axis=1)
+    return numpy.where(none, numpy.where(invalid + RESYNC_WINDOW > n, HELD, invalid + RESYNC_WINDOW), found)
+
+
+def _walk(ends, opcodes, positions, limits, stops=None, marks=None):
+    """
+    Follow packets from several positions at once, one packet per step, until each walk passes its limit
+
+    Args:
+      ends: numpy array of where the packet at each position ends. Those still UNRESOLVED are resolved when reached
+      opcodes: opcode of the header at each position
+      positions: numpy array of where each walk starts
+      limits: numpy array of the position each walk stops at or after
+      stops: numpy bool array of positions each walk also stops at, None for none
+      marks: numpy bool array to set at each position passed, None to not mark them
+
+    Returns:
+        numpy array of where each walk stopped
+    """
+    p = positions.copy()
+    lanes = numpy.flatnonzero(p < limits)
+    while len(lanes):
+        here = p[lanes]
+        if stops is not None:
+            going = ~stops[here]
+            lanes = lanes[going]
+            here = here[going]
+        if marks is not None:
+            marks[here] = True
+        following = ends[here]
+        unresolved = here[following == UNRESOLVED]
+        if len(unresolved):
+            ends[unresolved] = _resync_points(opcodes, ends, unresolved)
+            following = ends[here]
+        p[lanes] = following
+        lanes = lanes[p[lanes] < limits[lanes]]
+    return p
+
+
+def _chain(ends, opcodes):
+    """
+    Find the packets that parsing goes through
+
+    The buffer is cut into segments that are each walked from their start at once, which mostly falls into step with
+    the real packet boundaries within a few packets. Where parsing actually enters a segment off the walk, it is walked
+    again from there until it joins it, and a changed exit carries on into the next segment until nothing changes.
+
+    Args:
+      ends: numpy array of where the packet at each position ends, in positions relative to the first one. Those still
+        UNRESOLVED are resolved when reached
+      opcodes: opcode of the header at each position
+
+    Returns:
+        sorted numpy array of the positions of the packets reached from position 0
+    """
+    count = len(ends)
+    segment = min(max(count // _LANES, _MIN_SEGMENT), _MAX_SEGMENT)
+    starts = numpy.arange(0, count, segment)
+    limits = numpy.minimum(starts + segment, count)
+    walked = numpy.zeros(count, bool)
+    guessed = _walk(ends, opcodes, starts, limits, marks=walked)
+    # Where parsing leaves each segment, which is also where it enters the next one
+    exits = guessed.copy()
+    segments = numpy.arange(1, len(starts))
+    for _ in range(_MAX_ROUNDS):
+        if not len(segments):
+            break
+        entries = exits[segments - 1]
+        inside = entries < limits[segments]
+        # Entering a segment on its walk leaves it where the walk does, and past it skips the segment
+        leaving = numpy.where(inside, guessed[segments], entries)
+        off = numpy.flatnonzero(inside & ~walked[numpy.minimum(entries, count - 1)])
+        if len(off):
+            stopped = _walk(ends, opcodes, entries[off], limits[segments[off]], walked)
+            leaving[off] = numpy.where(stopped < limits[segments[off]], leaving[off], stopped)
+        changed = leaving != exits[segments]
+        exits[segments] = leaving
+        segments = segments[changed] + 1
+        segments = segments[segments < len(starts)]
+    else:
+        if len(segments):
+            return _double(ends, opcodes)
+    # Packets on each walk from where parsing joins it, and those of the walks joining them
+    entries = numpy.append(0, exits[:-1])
+    joins = numpy.full(len(starts), count)
+    inside = entries < limits
+    on = inside & walked[numpy.minimum(entries, count - 1)]
+    joins[on] = entries[on]
+    off = numpy.flatnonzero(inside & ~on)
+    reached = numpy.zeros(count, bool)
+    if len(off):
+        stopped = _walk(ends, opcodes, entries[off], limits[off], walked, reached)
+        joins[off] = numpy.where(stopped < limits[off], stopped, count)
+    positions = numpy.flatnonzero(walked)
+    reached[positions[positions >= joins[positions // segment]]] = True
+    return numpy.flatnonzero(reached)
+
+
+def _double(ends, opcodes):
+    """
+    Find the packets that parsing goes through by pointer doubling, for streams the walks of :func:_chain can't settle
+
+    Args:
+      ends: numpy array of where the packet at each position ends, in positions relative to the first one. Those still
+        UNRESOLVED are resolved first
+      opcodes: opcode of the header at each position
+
+    Returns:
+        sorted numpy array of the positions of the packets reached from position 0
+    """
+    unresolved = numpy.flatnonzero(ends == UNRESOLVED)
+    ends[unresolved] = _resync_points(opcodes, ends, unresolved)
+    count = len(ends)
+    # Every position that is reached is where a reached packet ends, so keep only those while that drops many
+    candidates = numpy.arange(count)
+    while True:
+        successors = ends[candidates]
+        reached = numpy.zeros(count, bool)
+        reached[successors[successors < count]] = True
+        reached[0] = True
+        remaining = numpy.flatnonzero(reached)
+        if len(remaining) == len(candidates):
+            return candidates
+        settling = len(remaining) < _SETTLE_RATIO * len(candidates)
+        candidates = remaining
+        if not settling:
+            break
+    # The sequences of packets that are still out of step, which can be as long as the buffer such as for a repeated
+    # byte, are resolved by pointer doubling: after each step, reached holds the candidates twice as many packets away
+    # from position 0 as before
+    jump = numpy.append(numpy.searchsorted(candidates, ends[candidates]), len(candidates))
+    reached = numpy.zeros(len(candidates) + 1, bool)
+    reached[0] = True
+    span = 1
+    while span <= len(candidates):
+        reached[jump[reached]] = True
+        jump = jump[jump]
+        span *= 2
+    return candidates[reached[:-1]]
+
+
+class ITMTokenizer:
+    """
+    Splits buffers of ITM data into arrays of packets, taking the same state from one buffer to the next as ITMFramer
+
+    Args:
+        synced: True if the first buffer starts on a packet boundary, to start parsing without a Reset Frame
+        offset: position in the stream of the first buffer
+        packet_filter: ITMFilter of the packets to output, None for all
+
+    Attributes:
+        offset: position in the stream of the next buffer, counting every byte parsed or discarded
+        invalid_headers: reserved or invalid header bytes and malformed packets skipped, each followed by a resync
+        resync_bytes: number of bytes skipped to resync, including the invalid header bytes
+        longest_resync: most bytes skipped by one resync
+        overflows: overflow packets, which ITMFramer drops
+        header_counts: numpy array of the number of packets split or skipped for each header byte
+        skipped: number of packets skipped by packet_filter
+
+    """
+
+    def __init__(self, synced=False, offset=0, packet_filter=None):
+        if numpy is None:
+            raise ImportError("ITMTokenizer needs numpy")
+        self._first_read = not synced
+        self.last_ts_counter = 0
+        self.invalid_headers = 0
+        self.resync_bytes = 0
+        self.longest_resync = 0
+        self.overflows = 0
+        self.offset = offset
+        self._reset_tokens = ResetTokenDetector(offset)
+        self._skipped = None if packet_filter is None else numpy.array(packet_filter.skip_lengths()) > 0
+        self.header_counts = numpy.zeros(256, numpy.int64)
+        self.skipped = 0
+
+    def packet_counts(self):
+        """
+        Get the number of packets split or skipped so far
+
+        Returns:
+            dict of counts keyed by ITMOpcode, UNPARSED for invalid headers
+        """
+        return count_by_kind(self.header_counts.tolist())
+
+    def discard(self, n):
+        """
+        Drop bytes left unparsed instead of passing them again with the next buffer, as :method:ITMFramer.discard
+
+        Args:
+          n: number of bytes at the start of the unparsed portion of the last buffer that are dropped
+        """
+        self.offset += n
+        self._reset_tokens = ResetTokenDetector(self.offset)
+
+    def tokenize(self, buf):
+        """
+        Split all of an input buffer into packets until the buffer size is <= MAX_ITM_FRAME_SIZE
+
+        Handles the reset frame and the bytes held back at the end in the same way as :method:ITMFramer.parse_batch
+
+        Args:
+          buf: input buffer to split. Any bytes-like object, or a numpy uint8 array; it is not copied or modified
+
+        Returns:
+            packets: ITMPackets of the packets ITMFramer would have output, in order
+            rest: unparsed portion of the input buffer, as a memoryview
+
+        """
+        data = memoryview(buf).cast("B")
+        if len(data) == 0: return _empty_packets(), data
+
+        # Same as ITMFramer: bytes that could be the start of a reset token are held back, and parsing starts at the
+        # first reset token, or at the start of the buffer once a reset token was found
+        token = self._reset_tokens.find(data, self.offset)
+        size = len(data) - self._reset_tokens.held
+        if token is not None:
+            start = token
+        elif self._first_read is True:
+            self.offset += size
+            return _empty_packets(), data[size:]
+        else:
+            start = 0
+        end = size - MAX_ITM_FRAME_SIZE
+        if start >= end:
+            self.offset += start
+            return _empty_packets(), data[start:]
+        self._first_read = False
+        a = numpy.frombuffer(data, numpy.uint8, size)
+
+        # Length of the packet each position would start
+        headers = a[start:end]
+        opcodes = _OPCODE[headers]
+        ends = _LENGTH[headers].astype(numpy.int64)
+        # Timestamp and extension packets go on until a byte without a continuation bit, and synchronization packets
+        # are zero bytes up to a 1. Their headers are in the run of bytes that the byte ending them ends
+        continued = headers >= 0x80
+        clear = _run_ends(a >= 0x80)
+        stamps = numpy.flatnonzero((opcodes == ITMOpcode.TIMESTAMP.value) & continued)
+        last = _next_match(clear, stamps + start + 1, size) - (stamps + start + 1)
+        # Timestamps have at most 4 payload bytes, and no payload at all if there is no end within them
+        ends[stamps] = numpy.where(last < 4, last + 2, 1)
+        extensions = numpy.flatnonzero((opcodes == ITMOpcode.EXTENSION.value) & continued)
+        ends[extensions] = numpy.minimum(_next_match(clear, extensions + start + 1, size) + 1, size) - \
+                           (extensions + start)
+        syncs = numpy.flatnonzero(opcodes == ITMOpcode.SYNCHRONIZATION.value)
+        sync_ends = _next_match(_run_ends(a == 0), syncs + start + 1, size)
+        ends[syncs] = sync_ends + 1 - (syncs + start)
+        # A synchronization packet that isn't ended by a byte with bit 7 set or a 1 is malformed, and handled like an
+        # invalid header. One whose zero bytes run to the end of the buffer is parsed again with more data
+        last = a[numpy.minimum(sync_ends, size - 1)]
+        incomplete = sync_ends >= size
+        malformed = ~incomplete & (last < 0x80) & (last != 1)
+        opcodes[syncs[malformed]] = NO_OPCODE
+        ends += numpy.arange(end - start)
+        ends[syncs[incomplete]] = HELD
+
+        # Invalid headers and malformed packets are followed by a resync, which skips to the next position that starts
+        # valid packets. It is only looked for from the headers that parsing goes through
+        ends[opcodes == NO_OPCODE] = UNRESOLVED
+
+        # Packets that parsing goes through, and where the last one ends. Parsing stops before a packet that needs more
+        # data
+        reached = _chain(ends, opcodes)
+        if ends[reached[-1]] == HELD:
+            reached = reached[:-1]
+            stop = start + (int(ends[reached[-1]]) if len(reached) else 0)
+        else:
+            stop = start + int(ends[reached[-1]])
+        positions = reached + start
+        opcodes = opcodes[reached]
+        lengths = ends[reached] - reached
+        self.header_counts += numpy.bincount(a[positions], minlength=256)
+
+        # Drop what ITMFramer doesn't output
+        if self._skipped is not None:
+            wanted = ~self._skipped[a[positions]]
+            self.skipped += len(positions) - int(wanted.sum())
+            positions = positions[wanted]
+            opcodes = opcodes[wanted]
+            lengths = lengths[wanted]
+        invalid = opcodes == NO_OPCODE
+        overflow = opcodes == ITMOpcode.OVERFLOW.value
+        if invalid.any():
+            self.invalid_headers += int(invalid.sum())
+            self.resync_bytes += int(lengths[invalid].sum())
+            self.longest_resync = max(self.longest_resync, int(lengths[invalid].max()))
+            logger.warning("Skipped {} invalid ITM packet(s), and {} bytes to resync".format(int(invalid.sum()),
+                                                                                          int(lengths[invalid].sum())))
+        if overflow.any():
+            self.overflows += int(overflow.sum())
+            logger.warning("ITM Frame Overflow x {}".format(int(overflow.sum())))
+        keep = ~(invalid | overflow)
+        positions = positions[keep]
+        opcodes = opcodes[keep]
+        lengths = lengths[keep]
+        headers = a[positions]
+
+        source = opcodes >= ITMOpcode.PACKET_PC.value
+        port = numpy.where(source, headers >> 3, -1).astype(numpy.int8)
+        sizes = numpy.where(source, _SIZE[headers], lengths - 1)
+        # Payloads are read as a little-endian word after the header, of which only the payload bytes are kept
+        words = numpy.ndarray((size - MAX_ITM_FRAME_SIZE + 2,), "<u4", a, strides=(1,))
+        value = numpy.where(source, words[positions + 1] & _PAYLOAD_MASK[numpy.minimum(lengths - 1, 4)], 0)
+        value = value.astype(numpy.uint32)
+        stamp = numpy.zeros(len(positions), numpy.int64)
+        # Timestamp bytes are summed up to the one without a continuation bit, or 4 of them
+        stamping = numpy.flatnonzero((opcodes == ITMOpcode.TIMESTAMP.value) & (headers >= 0x80))
+        going = numpy.ones(len(stamping), bool)
+        for i in range(MAX_ITM_FRAME_SIZE - 1):
+            payload = a[positions[stamping] + 1 + i]
+            stamp[stamping] += numpy.where(going, (payload & 0x7F).astype(numpy.int64) << (7 * i), 0)
+            going &= payload >= 0x80
+
+        # Source packets carry the timestamp of the last timestamp packet before them
+        stamps = opcodes == ITMOpcode.TIMESTAMP.value
+        latest = numpy.maximum.accumulate(numpy.where(stamps, numpy.arange(len(positions)), -1))
+        running = numpy.where(latest >= 0, stamp[latest], self.last_ts_counter)
+        ts_counter = numpy.where(stamps, stamp, numpy.where(source, running, 0))
+        if stamps.any():
+            self.last_ts_counter = int(running[-1])
+
+        packets = ITMPackets(self.offset + positions, opcodes, headers, port, sizes.astype(numpy.int64), value,
+                             ts_counter)
+        self.offset += stop
+        return packets, data[stop:]
+
+
+def tokenize_capture(path, chunk_size=1 << 24, synced=False):
+    """
+    Split a capture into packets, a chunk at a time
+
+    Args:
+      path: capture path prefix as recorded with CaptureWriter, or a single raw file
+      chunk_size: number of bytes split at a time
+      synced: see :class:ITMTokenizer
+
+    Returns:
+        generator of ITMPackets
+    """
+    from serial_rx import FileRx
+    source = FileRx(path, chunk_size=chunk_size)
+    tokenizer = ITMTokenizer(synced)
+    try:
+        while source.occupancy > MAX_ITM_FRAME_SIZE:
+            buf = source.peek()
+            packets, rest = tokenizer.tokenize(buf)
+            gap = source.next_loss()
+            if gap is not None and gap <= len(buf):
+                # A packet split by a gap the recorder left can never be completed
+                tokenizer.discard(len(rest))
+                source.consume(len(buf))
+                source.pop_lost()
+            elif len(rest) == len(buf):
+                break  # Only a partial packet is left
+            else:
+                source.consume(len(buf) - len(rest))
+            del buf, rest
+            yield packets
+    finally:
+        source.close()
+
+
+def compare(packets, frames):
+    """
+    Check that packets of ITMTokenizer match the frames ITMFramer output for the same buffer
+
+    Args:
+      packets: ITMPackets
+      frames: list of ITMFrames
+
+    Returns:
+        index of the first packet that doesn't match, or None if they all do
+    """
+    for i, frame in enumerate(frames):
+        if i >= len(packets.offset):
+            return i
+        expected = (frame.offset, frame.opcode.value, frame.header, frame.size, frame.ts_counter)
+        found = (packets.offset[i], packets.opcode[i], packets.header[i], packets.size[i], packets.ts_counter[i])
+        if tuple(int(x) for x in found) != expected:
+            return i
+        if hasattr(frame, "port"):
+            if int(packets.port[i]) != frame.port.value:
+                return i
+            if frame.opcode is ITMOpcode.EXCEPTION:
+                payload = int(packets.value[i])
+                if (payload & 0x1FF, (payload >> 12) & 0x3) != (frame.num_exception, frame.func_exception):
+                    return i
+            elif int(packets.value[i]) != (frame.value or int.from_bytes(getattr(frame, "data", b""), "little")):
+                return i
+    return None if len(frames) == len(packets.offset) else len(frames)
+
+
+######################################################
+###  MAIN  ##################
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 7)
+    parser = argparse.ArgumentParser(description='Split a capture into ITM packets with ITMTokenizer. With --verify, '
+                                                 'also parse it with ITMFramer and check that both agree.')
+    parser.add_argument('capture',
+                        help='Capture path prefix as recorded with CaptureWriter, or a single raw file')
+    parser.add_argument('--chunk_size',
+                        default=1 << 24,
+                        help='Number of bytes split at a time, default is 16 MiB')
+    parser.add_argument('--verify',
+                        action='store_true',
+                        help='Compare every packet with the ITMFrame ITMFramer outputs, and time both')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    from serial_rx import FileRx
+    source = FileRx(args.capture, chunk_size=int(args.chunk_size))
+    tokenizer = ITMTokenizer()
+    framer = ITMFramer()
+    count = 0
+    tokenize_time = 0
+    parse_time = 0
+    while source.occupancy > MAX_ITM_FRAME_SIZE:
+        buf = source.peek()
+        start = time.perf_counter()
+        packets, rest = tokenizer.tokenize(buf)
+        tokenize_time += time.perf_counter() - start
+        if args.verify:
+            start = time.perf_counter()
+            frames, framer_rest = framer.parse_batch(buf)
+            parse_time += time.perf_counter() - start
+            mismatch = compare(packets, frames)
+            if mismatch is not None or len(framer_rest) != len(rest):
+                offset = frames[mismatch].offset if mismatch is not None and mismatch < len(frames) else None
+                print("Mismatch at packet {}, offset {}".format(count + (mismatch or 0), offset))
+                sys.exit(1)
+            del frames, framer_rest
+        count += len(packets.offset)
+        gap = source.next_loss()
+        if gap is not None and gap <= len(buf):
+            tokenizer.discard(len(rest))
+            framer.discard(len(rest))
+            source.consume(len(buf))
+            source.pop_lost()
+        elif len(rest) == len(buf):
+            break
+        else:
+            source.consume(len(buf) - len(rest))
+        del buf, rest
+    source.close()
+    print("{} packets in {} bytes, tokenized in {:.2f} s".format(count, tokenizer.offset, tokenize_time))
+    if args.verify:
+        print("ITMFramer agrees, and took {:.2f} s ({:.1f}x)".format(parse_time, parse_time / max(tokenize_time, 1e-9)))
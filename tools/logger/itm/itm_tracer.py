@@ -0,0 +1,120 @@
+"""
+Record framing diagnostics as compact events in a ring buffer
+
+Framers have a tracer attribute that is None by default, so that tracing costs a single attribute check when it is
+off. When a Tracer is set, each framing step appends a tuple of its TraceEvent and up to two values, such as a stream
+offset and a header byte. Nothing is formatted until the events are read with :method:Tracer.lines, so tracing can stay
+on during long captures and the last events can be looked at after a problem.
+"""
+
+import enum
+from collections import deque
+
+
+class TraceEvent(enum.IntEnum):
+    """Framing steps that are traced, with the values recorded for each"""
+    ITM_PACKET = 0  # offset, header byte
+    ITM_TIMESTAMP = 1  # offset, timestamp counter
+    ITM_RESET = 2  # offset of the reset token
+    ITM_WAIT_RESET = 3  # offset, bytes dropped while waiting for a reset token
+    ITM_INVALID_HEADER = 4  # offset, header byte
+    ITM_PACKET_ERROR = 5  # offset, exception
+    ITM_DISCARD = 6  # offset, bytes dropped
+    SWO_NEW_FRAME = 7  # SWOOpcode, remaining length
+    SWO_CONTINUE = 8  # SWOOpcode, remaining length
+    SWO_NO_DB_ENTRY = 9  # header
+    SWO_UNKNOWN_OPCODE = 10  # opcode value
+    SWO_SYNC_TIME = 11  # RTC seconds
+    SWO_RAW_DATA = 12  # ITMStimulusPort, data
+    SWO_EVENT_SET_START = 13  # handle
+    SWO_EVENT_SET_RECORD = 14  # handle, record
+    SWO_DELETE = 15  # SWOOpcode
+    SWO_FRAME = 16  # SWO frame
+    MODULE_FRAME = 17  # framer, module frame
+    MODULE_TASK_INIT = 18  # task number, task name
+    ITM_RESYNC = 19  # offset parsing carries on at, bytes skipped
+    SWO_CORRUPT_HEADER = 20  # header outside the trace section
+    SWO_STALE_FRAME = 21  # SWOOpcode of a partial frame that is dropped
+
+
+TRACE_FORMATS = {
+    TraceEvent.ITM_PACKET: "ITM packet 0x{1:02X} at {0}",
+    TraceEvent.ITM_TIMESTAMP: "ITM timestamp {1} at {0}",
+    TraceEvent.ITM_RESET: "ITM reset token at {0}",
+    TraceEvent.ITM_WAIT_RESET: "ITM waiting for a reset token, {1} bytes dropped at {0}",
+    TraceEvent.ITM_INVALID_HEADER: "ITM invalid header 0x{1:02X} at {0}",
+    TraceEvent.ITM_PACKET_ERROR: "ITM invalid packet at {0}: {1}",
+    TraceEvent.ITM_DISCARD: "ITM {1} unparsed bytes discarded at {0}",
+    TraceEvent.SWO_NEW_FRAME: "SWO new frame of opcode {0.name}, len {1}",
+    TraceEvent.SWO_CONTINUE: "SWO {0.name} continue, remaining length {1}",
+    TraceEvent.SWO_NO_DB_ENTRY: "SWO corruption: no trace database information at 0x{0:X}",
+    TraceEvent.SWO_UNKNOWN_OPCODE: "SWO corruption: unknown opcode 0x{0:x}",
+    TraceEvent.SWO_SYNC_TIME: "SWO sync time, RTC: {0:.7f} s",
+    TraceEvent.SWO_RAW_DATA: "SWO raw ITM data on {0.name}: {1}",
+    TraceEvent.SWO_EVENT_SET_START: "SWO create event set {0}",
+    TraceEvent.SWO_EVENT_SET_RECORD: "SWO store record {1} of event set {0}",
+    TraceEvent.SWO_DELETE: "SWO deleting frame of opcode {0.name}",
+    TraceEvent.SWO_FRAME: "SWO frame: {0}",
+    TraceEvent.MODULE_FRAME: "{0.__class__.__name__} frame: {1}",
+    TraceEvent.MODULE_TASK_INIT: "Module task {0} set to {1}",
+    TraceEvent.ITM_RESYNC: "ITM resync at {0} after skipping {1} bytes",
+    TraceEvent.SWO_CORRUPT_HEADER: "SWO corruption: header 0x{0:X} outside the trace section",
+    TraceEvent.SWO_STALE_FRAME: "SWO dropping stale partial frame of opcode {0.name}",
+}
+
+
+class Tracer:
+    """
+    Ring buffer of the last framing events
+
+    Args:
+        capacity: number of events kept, older ones are overwritten
+
+    Attributes:
+        events: deque of (TraceEvent, value, value) tuples, oldest first
+        count: number of events recorded since the tracer was created or cleared, including overwritten ones
+
+    """
+
+    def __init__(self, capacity=4096):
+        self.events = deque(maxlen=capacity)
+        self.count = 0
+
+    def record(self, event, a=None, b=None):
+        """
+        Record an event without formatting it
+
+        Args:
+          event: TraceEvent
+          a: first value of the event, see TraceEvent
+          b: second value of the event
+        """
+        self.count += 1
+        self.events.append((event, a, b))
+
+    @property
+    def overwritten(self):
+        """Number of events that no longer fit in the ring buffer"""
+        return self.count - len(self.events)
+
+    def clear(self):
+        """Drop all events"""
+        self.events.clear()
+        self.count = 0
+
+    def lines(self):
+        """
+        Describe the events in the ring buffer, oldest first
+
+        Returns:
+            list of strings
+        """
+        out = []
+        if self.overwritten:
+            out.append("{} earlier events overwritten".format(self.overwritten))
+        for event, a, b in self.events:
+            try:
+                out.append(TRACE_FORMATS[event].format(a, b))
+            except (KeyError, ValueError, TypeError, AttributeError):
+                out.append("{} {} {}".format(TraceEvent(event).name, a, b))
+        return out
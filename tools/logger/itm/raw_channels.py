@@ -0,0 +1,326 @@
+"""
+Stream the payloads of the raw stimulus ports into typed arrays or files, for sensor and ADC samples
+
+The ports STIM_RAW0 to STIM_RAW15 carry no SWO framing: every software packet on them is a sample. Offline, RawChannels
+splits the ITM data with ITMTokenizer and appends the payloads of each port to its channel with NumPy, without a Python
+object per sample. In a Pipeline, the framer skips the packets of the raw ports without building frames and records where
+they are, and the samples are gathered from the same buffer with NumPy instead, so the data isn't split twice. Channels either grow an array in memory, or append to a raw little-endian file that can be
+memory-mapped with numpy.memmap. Subscribers get the samples of each buffer as they arrive.
+
+Needs numpy.
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .itm_framer import ITMOpcode, ITMStimulusPort, ITMFilter, ITM_HEADER_TABLE, MAX_ITM_FRAME_SIZE
+from .itm_tokenizer import ITMTokenizer
+
+logger = logging.getLogger("Raw Channels")
+
+RAW_PORTS = tuple(port for port in ITMStimulusPort if port.name.startswith("STIM_RAW"))
+
+
+class ArrayChannel:
+    """
+    Samples of one port in a numpy array, which doubles in size when full
+
+    Args:
+        dtype: numpy type of the samples
+        capacity: initial number of samples
+    """
+
+    def __init__(self, dtype="u4", capacity=1 << 16):
+        self._data = numpy.empty(capacity, dtype)
+        self.count = 0
+
+    def append(self, values):
+        """
+        Add samples at the end
+
+        Args:
+          values: numpy array of samples, cast to the type of the channel
+        """
+        count = self.count + len(values)
+        if count > len(self._data):
+            grown = numpy.empty(max(count, 2 * len(self._data)), self._data.dtype)
+            grown[:self.count] = self._data[:self.count]
+            self._data = grown
+        self._data[self.count:count] = values
+        self.count = count
+
+    @property
+    def values(self):
+        """numpy array of the samples so far. It is a view, which the next append may or may not change"""
+        return self._data[:self.count]
+
+    def flush(self):
+        """Nothing to write out for samples in memory"""
+        return
+
+    def close(self):
+        """Nothing to close for samples in memory"""
+        return
+
+
+class FileChannel:
+    """
+    Samples of one port appended to a raw file, in little-endian order
+
+    Args:
+        path: file to write, replaced if it exists
+        dtype: numpy type of the samples
+    """
+
+    def __init__(self, path, dtype="u4"):
+        self.path = path
+        self.dtype = numpy.dtype(dtype).newbyteorder("<")
+        self._file = open(path, "wb")
+        self.count = 0
+
+    def append(self, values):
+        """
+        Add samples at the end of the file. They are written out on the next flush at the latest
+
+        Args:
+          values: numpy array of samples, cast to the type of the channel
+        """
+        self._file.write(numpy.ascontiguousarray(values, self.dtype))
+        self.count += len(values)
+
+    @property
+    def values(self):
+        """Read-only numpy.memmap of the samples so far"""
+        self.flush()
+        if self.count == 0:
+            return numpy.empty(0, self.dtype)
+        return numpy.memmap(self.path, self.dtype, mode="r", shape=(self.count,))
+
+    def flush(self):
+        """Write out buffered samples"""
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        """Write out buffered samples and close the file"""
+        self._file.close()
+
+
+class RawChannels:
+    """
+    Splits ITM data into the samples of the raw stimulus ports
+
+    Args:
+        ports: ITMStimulusPorts to capture, default is STIM_RAW0 to STIM_RAW15
+        dtype: numpy type of the samples. Payloads are cast to it, so "i2" reads 2-byte payloads as signed samples
+        directory: directory to write a file per port to, named after the prefix and port, None to keep samples in
+            memory
+        prefix: start of the file names
+        flush_interval: maximum time in seconds samples stay buffered before they are written to the files, as long as
+            :method:flush_due is called, which :method:extend and Pipeline do
+        synced: True if the first buffer starts on a packet boundary, to start splitting without a Reset Frame
+        offset: position in the stream of the first buffer
+
+    Attributes:
+        ports: ITMStimulusPorts captured
+        channels: ArrayChannel or FileChannel of each port, keyed by ITMStimulusPort
+        tokenizer: ITMTokenizer splitting the data passed to :method:feed
+
+    """
+
+    def __init__(self, ports=RAW_PORTS, dtype="u4", directory=None, prefix="", flush_interval=1.0, synced=False,
+                 offset=0):
+        if numpy is None:
+            raise ImportError("RawChannels needs numpy")
+        self.ports = tuple(ports)
+        if directory is None:
+            self.channels = {port: ArrayChannel(dtype) for port in self.ports}
+        else:
+            self.channels = {port: FileChannel(os.path.join(directory, "{}{}.bin".format(prefix, port.name)), dtype)
+                             for port in self.ports}
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._subscribers = []
+        # Software packets of other ports are skipped by their length without being split
+        self._filter = ITMFilter(kinds=[ITMOpcode.SOURCE_SW], ports=self.ports)
+        self._wanted = numpy.zeros(32, bool)
+        self._wanted[[port.value for port in self.ports]] = True
+        self.tokenizer = ITMTokenizer(synced, offset, self._filter)
+
+    def subscribe(self, callback, ports=None):
+        """
+        Get new samples as they are split
+
+        Args:
+          callback: function called with (port, values, ts_counter) for each port that has new samples in a buffer.
+            values and ts_counter are numpy arrays of the payloads and ITM timestamps of the samples
+          ports: ITMStimulusPorts to get samples of, None for all captured ports
+        """
+        self._subscribers.append((callback, None if ports is None else set(ports)))
+
+    def unsubscribe(self, callback):
+        """
+        Stop calling a callback given to :method:subscribe
+
+        Args:
+          callback: function to stop calling
+        """
+        self._subscribers = [x for x in self._subscribers if x[0] is not callback]
+
+    def feed(self, buf):
+        """
+        Split a buffer and add the samples of the raw ports to their channels
+
+        Args:
+          buf: input buffer, which must start with the unparsed portion of the previous one. Any bytes-like object
+
+        Returns:
+            unparsed portion of the input buffer, as a memoryview
+        """
+        packets, rest = self.tokenizer.tokenize(buf)
+        self.extend(packets)
+        return rest
+
+    def extend(self, packets):
+        """
+        Add the samples of the raw ports in split packets to their channels
+
+        Args:
+          packets: ITMPackets, such as from ITMTokenizer.tokenize
+        """
+        raw = numpy.flatnonzero((packets.opcode == ITMOpcode.SOURCE_SW.value) & self._wanted[packets.port & 0x1F])
+        if len(raw):
+            ports = packets.port[raw]
+            values = packets.value[raw]
+            ts_counter = packets.ts_counter[raw]
+            for value in numpy.unique(ports).tolist():
+                mine = ports == value
+                self._add(ITMStimulusPort(value), values[mine], ts_counter[mine])
+        self.flush_due()
+
+    def extend_runs(self, buf, runs):
+        """
+        Add the samples of the raw ports in runs of packets of a buffer to their channels
+
+        Args:
+          buf: buffer the runs are in. Any bytes-like object
+          runs: (start, end, header, ts_counter) of each run of back-to-back packets with the same header, such as
+            ITMFramer.raw_runs after parsing buf
+        """
+        if runs:
+            data = numpy.frombuffer(buf, numpy.uint8)
+            starts, ends, headers, ts_counters = (numpy.array(x, numpy.int64) for x in zip(*runs))
+            sizes = numpy.array([ITM_HEADER_TABLE[header].size for header in headers.tolist()], numpy.int64)
+            counts = (ends - starts) // (sizes + 1)
+            # Position of the header of every packet, and what its run says about it
+            run = numpy.repeat(numpy.arange(len(runs)), counts)
+            first = numpy.cumsum(counts) - counts
+            positions = starts[run] + (numpy.arange(len(run)) - first[run]) * (sizes[run] + 1)
+            size = sizes[run]
+            # Payloads are 1, 2 or 4 bytes, little-endian
+            values = numpy.zeros(len(run), numpy.uint32)
+            for i in range(4):
+                has = numpy.flatnonzero(size > i)
+                if len(has) == 0: break
+                values[has] |= data[positions[has] + 1 + i].astype(numpy.uint32) << (8 * i)
+            ports = headers[run] >> 3
+            ts_counter = ts_counters[run]
+            for value in numpy.unique(ports).tolist():
+                mine = ports == value
+                self._add(ITMStimulusPort(value), values[mine], ts_counter[mine])
+        self.flush_due()
+
+    def _add(self, port, values, ts_counter):
+        """Append samples of a port to its channel, and pass them to its subscribers"""
+        self.channels[port].append(values)
+        for callback, subscribed in self._subscribers:
+            if subscribed is None or port in subscribed:
+                callback(port, values, ts_counter)
+
+    def discard(self, n):
+        """
+        Drop bytes left unparsed instead of passing them again with the next buffer, see :method:ITMTokenizer.discard
+
+        Args:
+          n: number of bytes dropped
+        """
+        self.tokenizer.discard(n)
+
+    def resume(self, offset):
+        """
+        Continue splitting from a packet boundary elsewhere in the stream
+
+        Args:
+          offset: position in the stream of an ITM packet header
+        """
+        self.tokenizer = ITMTokenizer(True, offset, self._filter)
+
+    def flush_due(self):
+        """Write out the samples buffered for the files if flush_interval has passed since they last were"""
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write out the samples buffered for the files"""
+        for channel in self.channels.values():
+            channel.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Write out buffered samples and close the files"""
+        for channel in self.channels.values():
+            channel.close()
+
+
+######################################################
+###  MAIN  ##################
+if __name__ == '__main__':
+    assert sys.version_info >= (3, 7)
+    parser = argparse.ArgumentParser(description='Extract the samples of the raw stimulus ports STIM_RAW0 to '
+                                                 'STIM_RAW15 of a capture into one file per port.')
+    parser.add_argument('capture',
+                        help='Capture path prefix as recorded with CaptureWriter, or a single raw file')
+    parser.add_argument('directory',
+                        help='Directory to write the <port>.bin files to')
+    parser.add_argument('--dtype',
+                        default="u4",
+                        help='numpy type of the samples, such as u2 or i2, default is u4 (unsigned 32-bit)')
+    parser.add_argument('--chunk_size',
+                        default=1 << 24,
+                        help='Number of bytes split at a time, default is 16 MiB')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    from serial_rx import FileRx
+    source = FileRx(args.capture, chunk_size=int(args.chunk_size))
+    channels = RawChannels(dtype=args.dtype, directory=args.directory)
+    start = time.perf_counter()
+    while source.occupancy > MAX_ITM_FRAME_SIZE:
+        buf = source.peek()
+        rest = channels.feed(buf)
+        gap = source.next_loss()
+        if gap is not None and gap <= len(buf):
+            # A packet split by a gap the recorder left can never be completed
+            channels.discard(len(rest))
+            source.consume(len(buf))
+            source.pop_lost()
+        elif len(rest) == len(buf):
+            break  # Only a partial packet is left
+        else:
+            source.consume(len(buf) - len(rest))
+        del buf, rest
+    source.close()
+    channels.close()
+    elapsed = time.perf_counter() - start
+    for port, channel in channels.channels.items():
+        if channel.count:
+            print("{}: {} samples".format(port.name, channel.count))
+    print("{} bytes in {:.2f} s".format(channels.tokenizer.offset, elapsed))
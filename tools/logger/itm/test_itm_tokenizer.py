@@ -0,0 +1,234 @@
+"""Tests that ITMTokenizer splits streams into the same packets as ITMFramer parses"""
+
+import random
+import unittest
+
+from itm.itm_framer import ITMFramer, ITMFilter, ITMOpcode, ITMStimulusPort, ITM_RESET_TOKEN, HDR_OVERFLOW
+from itm.itm_tokenizer import ITMTokenizer, compare
+
+SYNC = bytes(5) + b"\x80"
+OLD_SYNC = bytes(5) + b"\x01"  # Ended by 0x01, as older firmware did
+
+
+def _continued(rng, count):
+    """Payload of a variable length packet: count bytes, all but the last with the continuation bit set"""
+    return bytes([0x80 | rng.randrange(0x80) for _ in range(count - 1)] + [rng.randrange(0x80)])
+
+
+def _payload(rng, count):
+    return bytes(rng.randrange(256) for _ in range(count))
+
+
+def _software(rng):
+    size_code = rng.choice([1, 2, 3])
+    port = rng.randrange(32)
+    return bytes([(port << 3) | size_code]) + _payload(rng, {1: 1, 2: 2, 3: 4}[size_code])
+
+
+def _counter_wrap(rng):
+    return bytes([0x04 | rng.choice([1, 2, 3]), rng.randrange(256)])
+
+
+def _exception(rng):
+    return bytes([0x0C | rng.choice([1, 2, 3])]) + _payload(rng, 2)
+
+
+def _pc(rng):
+    # Full program counter, or the 1-byte sleep packet
+    if rng.random() < 0.5:
+        return bytes([0x17]) + _payload(rng, 4)
+    return bytes([0x15, 0x00])
+
+
+def _trace(rng):
+    size_code = rng.choice([1, 2, 3])
+    return bytes([(rng.randrange(0x08, 0x18) << 3) | 0x04 | size_code]) + _payload(rng, {1: 1, 2: 2, 3: 4}[size_code])
+
+
+def _local_timestamp(rng):
+    # Mostly continued timestamps of 1 to 4 bytes, sometimes the 1-byte form
+    if rng.random() < 0.2:
+        return bytes([rng.randrange(1, 7) << 4])
+    return bytes([rng.choice([0xC0, 0xD0, 0xE0, 0xF0])]) + _continued(rng, rng.randrange(1, 5))
+
+
+def _extension(rng):
+    header = (rng.randrange(8) << 4) | 0x08 | (rng.randrange(2) << 2)
+    if header & 0x80:
+        return bytes([header]) + _continued(rng, rng.randrange(1, 5))
+    return bytes([header])
+
+
+def _overflow(rng):
+    return bytes([HDR_OVERFLOW])
+
+
+def _sync(rng):
+    return SYNC if rng.random() < 0.7 else OLD_SYNC
+
+
+# Packets of every header class, and how often they come up
+PACKETS = [(_software, 50), (_counter_wrap, 3), (_exception, 5), (_pc, 5), (_trace, 10), (_local_timestamp, 15),
+           (_extension, 3), (_overflow, 2), (_sync, 2)]
+
+
+def synthetic_stream(count, seed, garbage=b"\x11\x22"):
+    """
+    Build an ITM stream of packets of every header class
+
+    Args:
+      count: number of packets
+      seed: random seed
+      garbage: bytes before the reset token, which are never parsed
+
+    Returns:
+        bytes
+    """
+    rng = random.Random(seed)
+    makers = rng.choices([x for x, _ in PACKETS], [x for _, x in PACKETS], k=count)
+    return garbage + ITM_RESET_TOKEN + b"".join(make(rng) for make in makers)
+
+
+def corrupt(data, count, seed):
+    """
+    Overwrite random bytes after the reset token, with reserved headers, sync and reset token bytes among others
+
+    Args:
+      data: stream from :func:synthetic_stream
+      count: number of bytes overwritten
+      seed: random seed
+
+    Returns:
+        bytes
+    """
+    rng = random.Random(seed)
+    start = data.index(ITM_RESET_TOKEN) + len(ITM_RESET_TOKEN)
+    out = bytearray(data)
+    for _ in range(count):
+        out[rng.randrange(start, len(out))] = rng.choice([0x00, 0x04, 0x63, 0x70, 0x80, 0xBB, 0xFF, rng.randrange(256)])
+    return bytes(out)
+
+
+def chunk_sizes(data, seed, sizes=(1, 2, 3, 5, 6, 9, 17, 64, 300, 1000)):
+    """Random chunk sizes adding up to at least the length of data"""
+    rng = random.Random(seed)
+    out = []
+    while sum(out) < len(data):
+        out.append(rng.choice(sizes))
+    return out
+
+
+class TokenizerMatchesFramerTest(unittest.TestCase):
+    """ITMTokenizer.tokenize and ITMFramer.parse_batch fed the same buffers"""
+
+    def check(self, data, chunks=None, packet_filter=None):
+        """
+        Feed data to both in chunks, each passed with the unparsed rest of the last, and check that they agree
+
+        Args:
+          data: stream
+          chunks: chunk sizes, None to pass all of data at once
+          packet_filter: ITMFilter given to both
+
+        Returns:
+            ITMFramer and list of all its ITMFrames
+        """
+        framer = ITMFramer(packet_filter=packet_filter)
+        tokenizer = ITMTokenizer(packet_filter=packet_filter)
+        frames = []
+        framer_rest = tokenizer_rest = b""
+        pos = 0
+        for size in chunks or [len(data)]:
+            piece = data[pos:pos + size]
+            pos += size
+            itm_frames, framer_rest = framer.parse_batch(bytes(framer_rest) + piece)
+            packets, tokenizer_rest = tokenizer.tokenize(bytes(tokenizer_rest) + piece)
+            self.assertIsNone(compare(packets, itm_frames), "packets differ at stream position {}".format(pos))
+            self.assertEqual(len(framer_rest), len(tokenizer_rest))
+            frames += itm_frames
+        self.assertEqual(framer.offset, tokenizer.offset)
+        self.assertEqual(framer.invalid_headers, tokenizer.invalid_headers)
+        self.assertEqual(framer.resync_bytes, tokenizer.resync_bytes)
+        self.assertEqual(framer.longest_resync, tokenizer.longest_resync)
+        self.assertEqual(framer.header_counts, tokenizer.header_counts.tolist())
+        self.assertEqual(framer.skipped, tokenizer.skipped)
+        return framer, frames
+
+    def test_every_header_class(self):
+        data = synthetic_stream(20000, 1)
+        framer, frames = self.check(data)
+        self.assertEqual(framer.invalid_headers, 0)
+        counts = framer.packet_counts()
+        for opcode in ITMOpcode:
+            if opcode is not ITMOpcode.UNPARSED:
+                self.assertGreater(counts.get(opcode, 0), 0, opcode)
+
+    def test_timestamps(self):
+        data = synthetic_stream(5000, 2)
+        _, frames = self.check(data)
+        # Packets after a timestamp carry it
+        stamped = [x for x in frames if x.opcode is ITMOpcode.SOURCE_SW and x.ts_counter]
+        self.assertGreater(len(stamped), 1000)
+
+    def test_overflow(self):
+        packets = bytes([HDR_OVERFLOW, 0x09, 0x01, HDR_OVERFLOW, HDR_OVERFLOW, 0x0B]) + bytes(4)
+        data = ITM_RESET_TOKEN + packets + SYNC * 2
+        tokenizer = ITMTokenizer()
+        tokenizer.tokenize(data)
+        self.assertEqual(tokenizer.overflows, 3)
+        framer, frames = self.check(data)
+        # The framer counts overflow packets but doesn't output them
+        self.assertEqual(framer.packet_counts()[ITMOpcode.OVERFLOW], 3)
+        self.assertNotIn(ITMOpcode.OVERFLOW, [x.opcode for x in frames])
+
+    def test_sync_packets(self):
+        body = b"".join(bytes([0x0B]) + i.to_bytes(4, "little") + (SYNC if i % 7 == 0 else b"") +
+                        (OLD_SYNC if i % 11 == 0 else b"") for i in range(2000))
+        data = ITM_RESET_TOKEN + body
+        syncs = sum(1 for i in range(2000) if i % 7 == 0) + sum(1 for i in range(2000) if i % 11 == 0)
+        framer, frames = self.check(data)
+        self.assertEqual(sum(1 for x in frames if x.opcode is ITMOpcode.SYNCHRONIZATION), syncs)
+        for seed in range(10):
+            framer, frames = self.check(data, chunk_sizes(data, seed))
+            self.assertEqual(framer.invalid_headers, 0)
+            self.assertEqual(sum(1 for x in frames if x.opcode is ITMOpcode.SYNCHRONIZATION), syncs)
+
+    def test_waits_for_reset_token(self):
+        data = synthetic_stream(1000, 3, garbage=bytes(range(256)))
+        _, frames = self.check(data)
+        # Parsing starts at the reset token, which is a software packet itself
+        self.assertEqual(frames[0].offset, 256)
+
+    def test_random_corruption(self):
+        for seed in range(10):
+            data = corrupt(synthetic_stream(10000, seed), 200, seed)
+            framer, _ = self.check(data)
+            self.assertGreater(framer.invalid_headers, 0)
+
+    def test_chunked_feeding(self):
+        data = synthetic_stream(5000, 4)
+        _, whole = self.check(data)
+        for seed in range(20):
+            _, frames = self.check(data, chunk_sizes(data, seed))
+            self.assertEqual([x.offset for x in frames], [x.offset for x in whole])
+
+    def test_chunked_corruption(self):
+        for seed in range(20):
+            data = corrupt(synthetic_stream(3000, seed), 60, seed)
+            _, whole = self.check(data)
+            _, frames = self.check(data, chunk_sizes(data, seed))
+            # Resyncs land on the same packets wherever the buffers end
+            self.assertEqual([x.offset for x in frames], [x.offset for x in whole][:len(frames)])
+
+    def test_packet_filter(self):
+        data = corrupt(synthetic_stream(5000, 5), 50, 5)
+        raw = [port for port in ITMStimulusPort if port.name.startswith("STIM_RAW")]
+        for packet_filter in (ITMFilter(kinds=[ITMOpcode.SOURCE_SW], ports=raw), ITMFilter(deny_ports=raw),
+                              ITMFilter(deny_kinds=[ITMOpcode.TRACE, ITMOpcode.EXCEPTION])):
+            framer, _ = self.check(data, packet_filter=packet_filter)
+            self.assertGreater(framer.skipped, 0)
+            self.check(data, chunk_sizes(data, 5), packet_filter)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+Remove TPIU formatter framing, as described in the Formatter and Flush Control section of the ARM CoreSight
+Architecture Specification, and demultiplex the trace of each source ID
+
+Formatter frames are 16 bytes. Bytes 0 to 14 alternate between an even byte, which holds either a new source ID (bit 0
+set, ID in bits 7:1) or data bits 7:1, and an odd byte of data. Byte 15 holds bit 0 of the data in each even byte, or
+for an ID change, whether it takes effect after the odd byte that follows it. Frames are aligned by full
+synchronization packets 0xFF 0xFF 0xFF 0x7F sent between them.
+"""
+
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Frames are deframed one at a time instead
+
+logger = logging.getLogger("TPIU Deframer")
+
+TPIU_FRAME_SIZE = 16
+TPIU_PAYLOAD_SIZE = 15
+TPIU_FSYNC = bytes([0xFF, 0xFF, 0xFF, 0x7F])
+TPIU_HSYNC = bytes([0xFF, 0x7F])
+TPIU_NULL_ID = 0x00  # Source ID of filler data
+
+
+class TPIUDeframer:
+    """
+    Turns a stream of TPIU formatter frames into the byte stream of each trace source ID
+
+    Runs of frames without an ID change are deframed in bulk with numpy when it is installed.
+
+    Args:
+        synced: True if the stream starts on a frame boundary, False to wait for a synchronization packet
+        trace_id: source ID of the data before the first ID change
+
+    Attributes:
+        lost_sync: number of times frame alignment was lost, and data was discarded until the next synchronization
+        discarded: number of bytes discarded while not aligned, not counting those before the first synchronization
+
+    """
+
+    def __init__(self, synced=False, trace_id=TPIU_NULL_ID):
+        self.synced = synced
+        self.trace_id = trace_id
+        self._started = synced
+        self.lost_sync = 0
+        self.discarded = 0
+
+    def reset(self):
+        """Wait for the next synchronization packet, such as after a gap in the stream"""
+        self.synced = False
+        self.trace_id = TPIU_NULL_ID
+
+    def deframe(self, buf):
+        """
+        Deframe all of the whole frames at the start of buf
+
+        Args:
+          buf: bytes-like object of received data. It is not copied or modified
+
+        Returns:
+            out: dict of bytearray of data keyed by source ID
+            consumed: number of bytes of buf used. The rest is an incomplete frame or synchronization packet
+
+        """
+        buf = memoryview(buf)
+        out = {}
+        pos = 0
+        while True:
+            if not self.synced:
+                # Discard everything up to the end of the next synchronization packet
+                start = bytes(buf[pos:]).find(TPIU_FSYNC)
+                if start < 0:
+                    keep = min(len(buf) - pos, len(TPIU_FSYNC) - 1)
+                    if self._started:
+                        self.discarded += len(buf) - pos - keep
+                    return out, len(buf) - keep
+                if self._started:
+                    self.discarded += start
+                pos += start + len(TPIU_FSYNC)
+                self.synced = self._started = True
+            # Skip synchronization packets between frames. No frame starts with 0xFF, an ID change to reserved ID 0x7F
+            while pos < len(buf) and buf[pos] == 0xFF:
+                if buf[pos:pos + len(TPIU_FSYNC)] == TPIU_FSYNC:
+                    pos += len(TPIU_FSYNC)
+                elif buf[pos:pos + len(TPIU_HSYNC)] == TPIU_HSYNC:
+                    pos += len(TPIU_HSYNC)
+                elif len(buf) - pos < len(TPIU_FSYNC):
+                    return out, pos  # Wait for the rest of the synchronization packet
+                else:
+                    logger.warning("TPIU frame alignment lost")
+                    self.lost_sync += 1
+                    self.reset()
+                    break
+            if not self.synced:
+                continue
+            if len(buf) - pos < TPIU_FRAME_SIZE:
+                return out, pos
+            pos = self._deframe_frames(buf, pos, out)
+
+    def _deframe_frames(self, buf, pos, out):
+        """Deframe the frames from pos up to the next synchronization packet, and return where they end"""
+        if numpy is None:
+            self._deframe_frame(buf[pos:pos + TPIU_FRAME_SIZE], out)
+            return pos + TPIU_FRAME_SIZE
+        frames = numpy.frombuffer(buf, numpy.uint8, (len(buf) - pos) // TPIU_FRAME_SIZE * TPIU_FRAME_SIZE, pos)
+        frames = frames.reshape(-1, TPIU_FRAME_SIZE)
+        # Stop at the next synchronization packet
+        sync = numpy.flatnonzero(frames[:, 0] == 0xFF)
+        if len(sync):
+            frames = frames[:sync[0]]
+        # Frames with an ID change are deframed one at a time, and the runs of frames between them in bulk
+        id_changes = numpy.flatnonzero((frames[:, 0:TPIU_PAYLOAD_SIZE:2] & 1).any(axis=1))
+        start = 0
+        for i in id_changes.tolist() + [len(frames)]:
+            if i > start:
+                data = out.setdefault(self.trace_id, bytearray())
+                data += _deframe_run(frames[start:i])
+            if i < len(frames):
+                self._deframe_frame(frames[i].tobytes(), out)
+            start = i + 1
+        return pos + len(frames) * TPIU_FRAME_SIZE
+
+    def _deframe_frame(self, frame, out):
+        """Deframe one frame, following its ID changes"""
+        aux = frame[15]
+        data = out.setdefault(self.trace_id, bytearray())
+        for i in range(8):
+            even = frame[2 * i]
+            if even & 1:
+                new_id = even >> 1
+                if i < 7 and aux & (1 << i):
+                    # The change takes effect after the next byte
+                    data.append(frame[2 * i + 1])
+                    self.trace_id = new_id
+                    data = out.setdefault(self.trace_id, bytearray())
+                else:
+                    self.trace_id = new_id
+                    data = out.setdefault(self.trace_id, bytearray())
+                    if i < 7:
+                        data.append(frame[2 * i + 1])
+            else:
+                data.append((even & 0xFE) | ((aux >> i) & 1))
+                if i < 7:
+                    data.append(frame[2 * i + 1])
+
+
+def _deframe_run(frames):
+    """Deframe an (n, 16) numpy array of frames without ID changes into bytes"""
+    payload = numpy.empty((len(frames), TPIU_PAYLOAD_SIZE), numpy.uint8)
+    # Even bytes get bit 0 back from the auxiliary byte, odd bytes are data as is
+    lsb = (frames[:, 15:16] >> numpy.arange(8, dtype=numpy.uint8)) & 1
+    payload[:, 0::2] = (frames[:, 0:TPIU_PAYLOAD_SIZE:2] & 0xFE) | lsb
+    payload[:, 1::2] = frames[:, 1:TPIU_PAYLOAD_SIZE:2]
+    return payload.tobytes()
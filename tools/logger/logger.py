@@ -8,22 +8,19 @@
 
 import sys
 import os
+import re
 import logging
 import argparse
-import time
-import queue
+import asyncio
 import uuid
 
-from serial_rx import SerialRx
-from swo import SWOFramer, SWOOpcode
-from itm import ITMFramer, MAX_ITM_FRAME_SIZE
-from trace_db import TraceDB
-from wireshark_output import gandelf_send_data, gandelf_send_message, pipe_open, pipe_close
-
-# Module Parsers
-from modules import BLEFramer
-from modules import DriverFramer
-#from modules import TIRTOSFramer
+from serial_rx import CaptureWriter, OVERFLOW_POLICIES, CAPTURE_OVERFLOW_POLICIES, open_source, open_async_source
+from pipeline import Pipeline, AsyncPipeline, run_pipelines, run_async_pipelines, seek_time
+from serial_rx.source import FILE_PREFIX
+from itm import ITMFilter, ITMOpcode, ITMStimulusPort, Tracer, RawChannels
+from trace_db import load_trace_db
+from wireshark_output import gandelf_send_data, gandelf_send_message, wlogger_send_data, pipe_open, pipe_close
+from wireshark_output import AsyncGandelfSink, AsyncWloggerSink
 
 ######################################################
 # MAIN  ##################
@@ -33,9 +30,30 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Used to log serial port and parse received ITM frames into SWO frames.')
     parser.add_argument("port",
-                        help="Com port to open. for win: COM54, for mac: /dev/tty.usbmodemXXX")
+                        nargs="+",
+                        help="Com port(s) to open. for win: COM54, for mac: /dev/tty.usbmodemXXX. "
+                             "Use file:PATH to decode a raw capture recorded with --record instead, "
+                             "or tcp:HOST:PORT / unix:PATH to receive from a stream socket. "
+                             "Several ports are captured and decoded concurrently")
+    parser.add_argument('--replay_speed',
+                        default=None,
+                        help='Replay a file:PATH capture at this multiple of its recorded pace (e.g. 1, 10, 0.1) '
+                             'instead of at maximum speed. Captures without an index are paced at the baud rate')
+    parser.add_argument('--start',
+                        default=None,
+                        help='Only decode a file:PATH capture from this many seconds after its start. The capture is '
+                             'indexed once to find where decoding can resume, and the index is kept next to it')
+    parser.add_argument('--end',
+                        default=None,
+                        help='Stop decoding a file:PATH capture this many seconds after its start')
     parser.add_argument("elf",
                         help="Elf file where the trace strings need to be extracted from")
+    parser.add_argument('-e', '--port_elf',
+                        nargs=2,
+                        action='append',
+                        default=[],
+                        metavar=('PORT', 'ELF'),
+                        help='Use a different elf file for one of the ports. Can be given several times')
     parser.add_argument("-s", "--sdk_path",
                         default="",
                         help="Path to the SDK. Used to pick up ROM symbols. Example: C:\ti\simplelink_cc13x2_26x2_sdk_2_00_00_00")
@@ -49,15 +67,93 @@ if __name__ == '__main__':
                         default=30,
                         help=' default is 30 (WARNING), other possible values: 10 (DEBUG), 20 (INFO)')
     parser.add_argument('-id', '--streamId',
-                        default="default",
-                        help='Set id for wlogger purpose')
+                        nargs='+',
+                        default=["default"],
+                        help='Set id for wlogger purpose. Give one per port, or one that is suffixed with the port '
+                             'when capturing several ports')
     parser.add_argument('-l', '--log',
                         default=".",
                         help='Log Path')
     parser.add_argument('-p', '--pipe',
                         default=None,
                         help='Name of GUI pipe to send data to')
+    parser.add_argument('-w', '--wlogger',
+                        action='store_true',
+                        help='Send frames to the Wireshark dissector over UDP')
+    parser.add_argument('--buffer',
+                        default=1 << 22,
+                        help='Size of the serial receive buffer in bytes, default is 4 MiB. It also holds what is '
+                             'received while the trace database is built, which can take tens of seconds')
+    parser.add_argument('--overflow',
+                        default="drop_newest",
+                        choices=OVERFLOW_POLICIES,
+                        help='What to do when the receive buffer is full: block the receiver, or drop the oldest or '
+                             'the newest data. Dropped data is reported with a DATA_LOST frame. Default is drop_newest')
+    parser.add_argument('--tpiu',
+                        default=None,
+                        help='The probe delivers SWO in TPIU formatter frames: decode the ITM data of this trace '
+                             'source ID, usually 1. Default is raw ITM data')
+    parser.add_argument('--skip',
+                        nargs='+',
+                        default=[],
+                        help='ITM packets to skip without decoding: kinds such as PACKET_PC, COUNTER_WRAP or '
+                             'EXCEPTION, and stimulus ports of software packets such as STIM_RAW0. Default is none')
+    parser.add_argument('--raw',
+                        default=None,
+                        help='Stream the samples of the raw stimulus ports STIM_RAW0 to STIM_RAW15 to one file per '
+                             'port in this directory, as little-endian 32-bit words, instead of decoding them as '
+                             'frames. Needs numpy')
+    parser.add_argument('--trace',
+                        default=0,
+                        help='Keep the last this many ITM, SWO and module framing events of each port in memory, and '
+                             'write them to the log at exit. Default is 0, no tracing')
+    parser.add_argument('--min_batch',
+                        default=256,
+                        help='Number of new bytes to wait for before parsing, default is 256. Lower for latency')
+    parser.add_argument('--max_wait',
+                        default=0.01,
+                        help='Maximum time in seconds to wait for min_batch bytes before parsing what has arrived, '
+                             'default is 0.01')
+    parser.add_argument('--quantum',
+                        default=1 << 16,
+                        help='Maximum number of bytes parsed from one port before moving on to the next, '
+                             'default is 65536')
+    parser.add_argument('--asyncio',
+                        action='store_true',
+                        help='Run the receive, framing and output stages as asyncio tasks on one event loop')
+    parser.add_argument('-r', '--record',
+                        default=None,
+                        help='Record the raw received bytes to segment files starting with this path prefix. '
+                             'With several ports, the port name is appended to the prefix')
+    parser.add_argument('--record_size',
+                        default=256,
+                        help='Start a new record segment after this many MiB, default is 256')
+    parser.add_argument('--record_compression',
+                        default=None,
+                        choices=['zlib', 'lzma'],
+                        help='Compress record segments in independent blocks, default is raw segments')
+    parser.add_argument('--record_time',
+                        default=None,
+                        help='Start a new record segment after this many seconds, default is no limit')
+    parser.add_argument('--record_overflow',
+                        default="drop_newest",
+                        choices=CAPTURE_OVERFLOW_POLICIES,
+                        help='What to do when the disk falls 64 MiB behind the link: block the receiver, or drop the '
+                             'newest data and mark the gap in the record. Default is drop_newest')
     args = parser.parse_args()
+    if args.tpiu is not None and (args.start is not None or args.end is not None):
+        parser.error("--start and --end need a raw ITM capture, not TPIU frames")
+    packet_filter = None
+    if args.skip:
+        unknown = [x for x in args.skip if x not in ITMOpcode.__members__ and x not in ITMStimulusPort.__members__]
+        if unknown:
+            parser.error("Unknown ITM packet kind or stimulus port: " + " ".join(unknown))
+        try:
+            packet_filter = ITMFilter(deny_kinds=[ITMOpcode[x] for x in args.skip if x in ITMOpcode.__members__],
+                                      deny_ports=[ITMStimulusPort[x] for x in args.skip
+                                                  if x in ITMStimulusPort.__members__])
+        except ValueError as e:
+            parser.error(str(e))
 
     # Setup Python logging
     if args.pipe is None:
@@ -73,83 +169,177 @@ if __name__ == '__main__':
     print("\nWriting to log at {}\n".format(os.path.abspath(filename)))
     logger.critical("Logger Started")
 
-    ser = None
+    sources = []
+    captures = []
+    # Pipelines built so far, whose counts are logged however decoding ends
+    pipelines = []
+    # Frame ids for each port
+    if len(args.streamId) == len(args.port):
+        stream_ids = args.streamId
+    elif len(args.streamId) == 1:
+        stream_ids = [args.streamId[0]] if len(args.port) == 1 else \
+            ["{}:{}".format(args.streamId[0], port) for port in args.port]
+    else:
+        parser.error("Give one stream id, or one per port")
+    port_elfs = dict(args.port_elf)
+    # Raw port samples of each stream id
+    raw_channels = {}
+    if args.raw is not None:
+        try:
+            for stream_id in stream_ids:
+                raw_channels[stream_id] = RawChannels(directory=args.raw,
+                                                      prefix=re.sub(r"[^\w.-]", "_", stream_id) + "_")
+        except (ImportError, OSError) as e:
+            parser.error(str(e))
+    # Framing event ring buffers for each stream id
+    tracers = {stream_id: Tracer(int(args.trace)) for stream_id in stream_ids} if int(args.trace) > 0 else {}
 
-    try:
+    def output(pipeline, out_frame):
         if args.pipe is not None:
+            gandelf_send_data(pipeline.stream_id, out_frame.wireshark_out)
+        elif args.wlogger:
+            wlogger_send_data(pipeline.stream_id, out_frame.wireshark_out)
+        else:
+            logging.critical(out_frame)
+
+    def source_kwargs(capture):
+        return dict(speed=None if args.replay_speed is None else float(args.replay_speed), baud=int(args.baud),
+                    buffer_size=int(args.buffer), capture=capture, overflow=args.overflow,
+                    tpiu=None if args.tpiu is None else int(args.tpiu))
+
+    def wait_for_db(db, port, ser):
+        """Wait for a database being built by load_trace_db"""
+        if not db.done():
+            logger.critical("Buffering {} until the trace database is ready".format(port))
+        db = db.result()
+        logger.critical("Decoding {}, starting with {} buffered bytes".format(port, ser.occupancy))
+        return db
+
+    def seek_window(pipeline, port):
+        """Only decode the requested time range of a capture"""
+        if port.startswith(FILE_PREFIX) and (args.start is not None or args.end is not None):
+            seek_time(pipeline, None if args.start is None else float(args.start),
+                      None if args.end is None else float(args.end))
+        return pipeline
+
+    def log_packet_counts():
+        """Log how many ITM packets of each kind every stream had, and how much corrupt data there was"""
+        for pipeline in pipelines:
+            counts = ", ".join("{} {}".format(kind.name, count) for kind, count in pipeline.itm.packet_counts().items())
+            logger.critical("{}: ITM packets {}, {} skipped".format(pipeline.stream_id, counts, pipeline.itm.skipped))
+            logger.critical("{}: {}".format(pipeline.stream_id, pipeline.error_counts()))
+
+    def log_raw_samples():
+        """Log how many raw port samples every stream had"""
+        for stream_id, channels in raw_channels.items():
+            counts = ", ".join("{} {}".format(port.name, channel.count)
+                               for port, channel in channels.channels.items() if channel.count)
+            logger.critical("{}: raw samples {}".format(stream_id, counts or "none"))
+
+    def log_traces():
+        """Write the framing events kept for every stream to the log"""
+        for stream_id, tracer in tracers.items():
+            logger.critical("{}: last framing events\n   {}".format(stream_id, "\n   ".join(tracer.lines())))
+
+    async def run_async(streams):
+        """Open the sources and decode them with asyncio pipelines, sending output without blocking the loop"""
+        sink = AsyncGandelfSink(args.pipe) if args.pipe is not None else AsyncWloggerSink() if args.wlogger else None
+        async_sources = []
+
+        async def async_output(pipeline, out_frame):
+            if sink is None:
+                logging.critical(out_frame)
+            else:
+                await sink.send_data(pipeline.stream_id, out_frame.wireshark_out)
+
+        try:
+            if sink is not None:
+                await sink.open()
+                await sink.send_message(stream_ids[0], "See python log at {}".format(os.path.abspath(args.log)))
+            for port, stream_id, db, capture in streams:
+                async_sources.append(await open_async_source(port, **source_kwargs(capture)))
+                if sink is not None:
+                    await sink.send_message(stream_id, "Successfully connected to {} ..... ".format(port))
+            for source, (port, stream_id, db, capture) in zip(async_sources, streams):
+                if not db.done():
+                    logger.critical("Buffering {} until the trace database is ready".format(port))
+                db = await asyncio.wrap_future(db)
+                logger.critical("Decoding {}, starting with {} buffered bytes".format(port, source.occupancy))
+                pipelines.append(seek_window(AsyncPipeline(source, db, int(args.clock), stream_id,
+                                                           packet_filter=packet_filter,
+                                                           tracer=tracers.get(stream_id),
+                                                           raw_channels=raw_channels.get(stream_id)), port))
+            logger.info("Starting asyncio pipelines")
+            await run_async_pipelines(pipelines, async_output, min_batch=int(args.min_batch),
+                                      max_wait=float(args.max_wait), quantum=int(args.quantum))
+        finally:
+            for source in async_sources:
+                await source.close()
+            if sink is not None:
+                await sink.close()
+
+    try:
+        if args.pipe is not None and not args.asyncio:
             # Open Wireshark output module
             pipe_open(args.pipe)
-            gandelf_send_message(args.streamId, "See python log at {}".format(os.path.abspath(args.log)))
-        # Parse the elf file and initialize databases
-        db = TraceDB(args.elf, args.sdk_path)
-        # Create ITM parser
-        itm_q = queue.Queue()
-        itm = ITMFramer(itm_q)
-        # Create SWO parser
-        swo = SWOFramer(db, int(args.clock))
-        # Create and start serial receiver
-        ser = SerialRx(args.port, baud=int(args.baud))
-        if args.pipe is not None:
-            gandelf_send_message(args.streamId, "Successfully connected to {} ..... ".format(args.port))
-        # Add in module parsers
-        module_map = {
-            "SWO_LogModule_BLEStack": BLEFramer(),
-            #"SWO_LogModule_Driver": DriverFramer(db),
-            # "SWO_LogModule_KernelLog" : TIRTOSFramer(db)
-        }
-
-        # Main processing loop
-        logger.info("Starting main logger loop")
-        buf = bytearray()
-        while True:
-            # Get data from serial and append to buffer
-            buf += ser.receive()
-            # Sleep for serial read period if not enough data to parse
-            if len(buf) <= MAX_ITM_FRAME_SIZE:
-                time.sleep(ser.timeout)
-            else:
-                # Pass buffer to ITM framer. This will parse the entire buffer until it is empty, placing on its queue,
-                # returning any unparsed data
-                buf = itm.parse(buf)
-                # Get all parsed ITM frames
-                while True:
-                    # Receive, forward, and output all parsed ITM frames
-                    try:
-                        itm_frame = itm_q.get(block=False)
-                        if itm_frame is not None:
-                            # Try to build SWO frame from ITM frame
-                            swo_frame = swo.parse(itm_frame)
-                            if swo_frame is not None and swo_frame.output is True:
-                                out_frame = None
-                                if swo_frame.opcode == SWOOpcode.RESET:
-                                    # Reset each module
-                                    for x in module_map.values():
-                                        x.reset()
-                                # Forward parsed swo_frame to the module if it exists
-                                try:
-                                    out_frame = module_map[swo_frame.module].parse(swo_frame)
-                                # If no module, continue with swo frame
-                                except KeyError:
-                                    out_frame = swo_frame
-                                finally:
-                                    # Check again since the SWO frame might have been consumed by a parsing module
-                                    if out_frame is not None:
-                                        if args.pipe is None:
-                                            logging.critical(out_frame)
-                                        else:
-                                            gandelf_send_data(args.streamId, out_frame.wireshark_out)
-                    except queue.Empty:
-                        break  # No more parsed ITM frames
+            gandelf_send_message(stream_ids[0], "See python log at {}".format(os.path.abspath(args.log)))
+        # Start parsing each elf file once, in the background, to initialize databases shared by all ports running the
+        # same elf. Ports are opened meanwhile so that what the device sends while booting is buffered, not lost
+        dbs = {}
+        streams = []
+        for port, stream_id in zip(args.port, stream_ids):
+            elf = port_elfs.get(port, args.elf)
+            if elf not in dbs:
+                dbs[elf] = load_trace_db(elf, args.sdk_path)
+            # Create raw capture recorder
+            capture = None
+            if args.record is not None:
+                prefix = args.record if len(args.port) == 1 else \
+                    "{}_{}".format(args.record, re.sub(r"[^\w.-]", "_", port))
+                capture = CaptureWriter(prefix, max_size=int(args.record_size) << 20,
+                                        max_time=None if args.record_time is None else float(args.record_time),
+                                        compression=args.record_compression, policy=args.record_overflow)
+                captures.append(capture)
+            streams.append((port, stream_id, dbs[elf], capture))
+
+        if args.asyncio:
+            asyncio.run(run_async(streams))
+        else:
+            for port, stream_id, db, capture in streams:
+                # Create and start serial receiver, or open capture file
+                sources.append(open_source(port, **source_kwargs(capture)))
+                if args.pipe is not None:
+                    gandelf_send_message(stream_id, "Successfully connected to {} ..... ".format(port))
+            for ser, (port, stream_id, db, capture) in zip(sources, streams):
+                # Create ITM, SWO and module parsers once the database is ready. They start with the buffered data
+                pipelines.append(seek_window(Pipeline(ser, wait_for_db(db, port, ser), int(args.clock), stream_id,
+                                                      packet_filter=packet_filter, tracer=tracers.get(stream_id),
+                                                      raw_channels=raw_channels.get(stream_id)), port))
+
+            # Main processing loop
+            logger.info("Starting main logger loop")
+            run_pipelines(pipelines, output, min_batch=int(args.min_batch), max_wait=float(args.max_wait),
+                          quantum=int(args.quantum))
+        logger.critical("End of input")
     except KeyboardInterrupt:
         logger.error("Keyboard interrupt received.")
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
         fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
         logger.error("{} @ {} {}: ".format(exc_type, fname, exc_tb.tb_lineno) + str(e))
-        gandelf_send_message(args.streamId, "Exception occurred :(  See python log.")
+        if not args.asyncio:
+            gandelf_send_message(stream_ids[0], "Exception occurred :(  See python log.")
     finally:
-        # Close RX thread
-        if ser is not None:
+        log_packet_counts()
+        log_traces()
+        log_raw_samples()
+        for channels in raw_channels.values():
+            channels.close()
+        # Close RX threads
+        for ser in sources:
             ser.close()
-        pipe_close()
+        for capture in captures:
+            capture.close()
+        if not args.asyncio:
+            pipe_close()
         sys.exit("exiting Python...")
@@ -508,7 +508,8 @@ class BLEFramer(FramerBase):
                 for x in swo_frame.events:
                     val, name = x.string.split(" ")
                     self.layer_int_to_str.update({int(val): name})
-                    logger.debug("Task init: Task {} set to {}".format(val, name))
+                    logger.debug("Task init: Task %s set to %s", val, name)
+                    if self.tracer is not None: self.tracer.record(TraceEvent.MODULE_TASK_INIT, int(val), name)
                 # This is not for output. It has been consumed by the BLE parser
                 ble_frame = None
             else:
@@ -518,7 +519,8 @@ class BLEFramer(FramerBase):
                 return ble_frame
             # Output now
             if ble_frame is not None:
-                logger.info(str(ble_frame))
+                logger.info("%s", ble_frame)
+                if self.tracer is not None: self.tracer.record(TraceEvent.MODULE_FRAME, self, ble_frame)
                 # Add info and close tree
                 ble_frame.wireshark_out += [WSOutputElement(Protofields.COMMON_INFO, str(ble_frame)),
                                             WSOutputElement(Protofields.COMMON_CLOSE_TREE)]
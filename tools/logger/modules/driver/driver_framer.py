@@ -180,6 +180,7 @@ class DriverFramer(FramerBase):
         finally:
             if driver_frame is not None:
                 self.completed(driver_frame)
+                if self.tracer is not None: self.tracer.record(TraceEvent.MODULE_FRAME, self, driver_frame)
             # This frame was not parsed. The same input SWO frame will be returned
             else:
                 return swo_frame
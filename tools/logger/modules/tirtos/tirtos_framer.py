@@ -190,6 +190,9 @@ class TIRTOSHeapTrack(TIRTOSBase):
 
 
 class TIRTOSFramer:
+    # Framing events are recorded when a Tracer is set
+    tracer = None
+
     def __init__(self, db):
         self._traceDB = db
         self._heapTrack = {}
@@ -212,7 +215,9 @@ class TIRTOSFramer:
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             logger.error(exc_type, fname, exc_tb.tb_lineno)
         finally:
-            if tirtos_frame is not None: self.completed(tirtos_frame)
+            if tirtos_frame is not None:
+                self.completed(tirtos_frame)
+                if self.tracer is not None: self.tracer.record(TraceEvent.MODULE_FRAME, self, tirtos_frame)
             return tirtos_frame
 
     def completed(self, frame=None):
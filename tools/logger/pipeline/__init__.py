@@ -0,0 +1,10 @@
+from .pipeline import Pipeline
+from .pipeline import DataLost
+from .pipeline import default_modules
+from .pipeline import run_pipelines
+from .async_pipeline import AsyncPipeline
+from .async_pipeline import run_async_pipelines
+from .resume_index import ResumePoint
+from .resume_index import build_resume_index
+from .resume_index import load_resume_index
+from .resume_index import seek_time
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""Decode chain from one byte source to output frames, run as asyncio stages"""
+
+import asyncio
+import logging
+from .pipeline import Pipeline
+
+logger = logging.getLogger("Pipeline")
+
+
+class AsyncPipeline(Pipeline):
+    """Parse the data of one async byte source in three asyncio stages
+
+    ITM framing, SWO and module framing, and output each run as their own task, connected by bounded asyncio.Queues.
+    When the output is backed up, the queues fill up and framing waits for room instead of buffering without limit,
+    leaving the data in the receive buffer where its overflow policy applies. Any number of pipelines can share one
+    event loop.
+
+    Args:
+        source: async byte source, such as one returned by serial_rx.open_async_source
+        db: TraceDB of the elf file running on the device
+        clock: clock speed of the embedded processor in Hz
+        stream_id: id output frames are tagged with
+        modules: dict of module parsers keyed by SWO module name, defaults to :func:default_modules
+        queue_size: maximum number of frames waiting between two stages
+        packet_filter: ITMFilter of the ITM packets to decode, None for all
+        tracer: itm.Tracer recording the framing events of the ITM, SWO and module framers, None to not trace
+        raw_channels: itm.RawChannels to stream the samples of raw stimulus ports to, None to decode them as frames
+    """
+
+    def __init__(self, source, db, clock=48000000, stream_id="default", modules=None, queue_size=1024,
+                 packet_filter=None, tracer=None, raw_channels=None):
+        super().__init__(source, db, clock, stream_id, modules, packet_filter, tracer, raw_channels)
+        self.queue_size = queue_size
+
+    async def run(self, output, min_batch=256, max_wait=0.01, quantum=1 << 16):
+        """Decode the stream until its source is done
+
+        Args:
+          output: coroutine function called with (pipeline, out_frame) for every output frame
+          min_batch: number of new bytes to wait for before parsing. Lower for latency
+          max_wait: maximum time in seconds to wait for min_batch bytes before parsing what has arrived
+          quantum: maximum number of bytes parsed before letting other tasks run
+        """
+        itm_q = asyncio.Queue(self.queue_size)
+        out_q = asyncio.Queue(self.queue_size)
+        tasks = [asyncio.ensure_future(self._itm_stage(itm_q, min_batch, max_wait, quantum)),
+                 asyncio.ensure_future(self._swo_stage(itm_q, out_q)),
+                 asyncio.ensure_future(self._output_stage(out_q, output))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Stop the other stages if one of them failed
+            for task in tasks:
+                task.cancel()
+
+    async def _itm_stage(self, itm_q, min_batch, max_wait, quantum):
+        """Parse received data into ITM frames"""
+        while not self.done:
+            # Wake up as soon as a batch of new data arrives, or after max_wait with whatever has arrived
+            await self.source.wait(self.unparsed + min_batch, max_wait)
+            for itm_frame in self._parse(quantum):
+                await itm_q.put(itm_frame)
+            # Let the other stages and streams run, even if the queue never filled up
+            await asyncio.sleep(0)
+        logger.critical("End of input for stream {}".format(self.stream_id))
+        await itm_q.put(None)
+
+    async def _swo_stage(self, itm_q, out_q):
+        """Build SWO and module frames from ITM frames"""
+        while True:
+            itm_frame = await itm_q.get()
+            if itm_frame is None:
+                break
+            out_frame = self._decode(itm_frame)
+            if out_frame is not None:
+                await out_q.put(out_frame)
+        await out_q.put(None)
+
+    async def _output_stage(self, out_q, output):
+        """Send output frames"""
+        while True:
+            out_frame = await out_q.get()
+            if out_frame is None:
+                break
+            await output(self, out_frame)
+
+
+async def run_async_pipelines(pipelines, output, min_batch=256, max_wait=0.01, quantum=1 << 16):
+    """Decode several streams concurrently on the running event loop until all of their sources are done
+
+    Args:
+      pipelines: list of AsyncPipeline
+      output: coroutine function called with (pipeline, out_frame) for every output frame
+      min_batch: number of new bytes to wait for before parsing a stream. Lower for latency
+      max_wait: maximum time in seconds to wait for min_batch bytes before parsing what has arrived
+      quantum: maximum number of bytes parsed from one stream before letting the others run
+    """
+    await asyncio.gather(*(p.run(output, min_batch, max_wait, quantum) for p in pipelines))
@@ -0,0 +1,246 @@
+"""Decode chain from one byte source to output frames, and a scheduler to run several of them in one process"""
+
+import threading
+import time
+import logging
+from collections import namedtuple
+from itm import ITMFramer, MAX_ITM_FRAME_SIZE
+from swo import SWOFramer, SWOOpcode
+from modules import BLEFramer
+
+logger = logging.getLogger("Pipeline")
+
+# Stands in for the ITM frames of data dropped by the receive buffer
+DataLost = namedtuple("DataLost", "lost_bytes")
+
+
+def default_modules(db):
+    """Create the module parsers used by the logger
+
+    Module parsers keep state between frames, so every pipeline needs its own set.
+
+    Args:
+      db: TraceDB of the stream
+
+    Returns:
+        dict of module parsers keyed by SWO module name
+    """
+    return {
+        "SWO_LogModule_BLEStack": BLEFramer(),
+        # "SWO_LogModule_Driver": DriverFramer(db),
+        # "SWO_LogModule_KernelLog" : TIRTOSFramer(db)
+    }
+
+
+class Pipeline(object):
+    """Parse the data of one byte source into ITM frames, SWO frames and then module frames
+
+    Each pipeline has its own framers and module parsers, so several streams can be decoded in one process. The TraceDB
+    is only read while framing and can be shared by all pipelines decoding the same elf file.
+
+    Args:
+        source: byte source such as SerialRx, FileRx, ReplayRx or SocketRx
+        db: TraceDB of the elf file running on the device
+        clock: clock speed of the embedded processor in Hz
+        stream_id: id output frames are tagged with
+        modules: dict of module parsers keyed by SWO module name, defaults to :func:default_modules
+        packet_filter: ITMFilter of the ITM packets to decode, None for all
+        tracer: itm.Tracer recording the framing events of the ITM, SWO and module framers, None to not trace
+        raw_channels: itm.RawChannels to stream the samples of raw stimulus ports to. The ITM framer skips their packets
+            without building frames, whatever packet_filter keeps, None to decode all ports as frames
+    """
+
+    def __init__(self, source, db, clock=48000000, stream_id="default", modules=None, packet_filter=None,
+                 tracer=None, raw_channels=None):
+        self.source = source
+        self.stream_id = stream_id
+        self.packet_filter = packet_filter
+        self.raw_channels = raw_channels
+        self.itm = ITMFramer(packet_filter=packet_filter, raw_ports=self._raw_ports())
+        self.swo = SWOFramer(db, clock)
+        self.modules = default_modules(db) if modules is None else modules
+        self.set_tracer(tracer)
+        self.unparsed = 0  # Bytes peeked but left in the source for next time
+        self._last_parse = 0
+        self._gap_offset = None  # Stream offset after the last gap, until ITM packets are parsed again after it
+
+    def resume(self, offset, rtc_s, swo_offset=0):
+        """Continue decoding from a packet boundary elsewhere in the source, without waiting for a reset
+
+        Args:
+          offset: position in the source of an ITM packet header, such as a resume point of a capture
+          rtc_s: SWO real-time clock of the last timestamp before that point, in seconds
+          swo_offset: SWO offset from rtc_s in effect at that point, in seconds
+        """
+        self.source.seek(offset)
+        self.itm = ITMFramer(synced=True, offset=offset, packet_filter=self.packet_filter, raw_ports=self._raw_ports())
+        self.itm.tracer = self.tracer
+        self.swo.resume(rtc_s, swo_offset)
+        for x in self.modules.values():
+            x.reset()
+        self.unparsed = 0
+        self._gap_offset = None
+
+    def _raw_ports(self):
+        """Get the stimulus ports the ITM framer leaves to the raw channels"""
+        return () if self.raw_channels is None else self.raw_channels.ports
+
+    def set_tracer(self, tracer):
+        """Record the framing events of all framers of the pipeline
+
+        Args:
+          tracer: itm.Tracer, None to stop tracing
+        """
+        self.tracer = tracer
+        for x in [self.itm, self.swo] + list(self.modules.values()):
+            x.tracer = tracer
+
+    def error_counts(self):
+        """Describe the corrupt data skipped so far, in one line"""
+        itm, swo = self.itm, self.swo
+        return ("{} ITM resyncs skipped {} bytes, the longest {} bytes; {} corrupt and {} unknown SWO headers; {} "
+                "partial SWO frames discarded".format(itm.invalid_headers, itm.resync_bytes, itm.longest_resync,
+                                                     swo.corrupt_headers, swo.unknown_headers, swo.frames_discarded))
+
+    def tick(self):
+        """Do what is due with time rather than data, which is writing out the samples the raw channels buffer. Called
+        on every parse, and by schedulers while the source is idle"""
+        if self.raw_channels is not None:
+            self.raw_channels.flush_due()
+
+    def ready(self, min_batch, max_wait):
+        """Check if enough new data has arrived to be worth parsing
+
+        Args:
+          min_batch: number of new bytes that are always worth parsing
+          max_wait: time in seconds after the last parse at which any new data is worth parsing
+
+        Returns:
+            True if :method:process should be called
+        """
+        new = self.source.occupancy - self.unparsed
+        return new >= min_batch or (new > 0 and time.monotonic() - self._last_parse >= max_wait)
+
+    @property
+    def done(self):
+        """True once the source receives no more data and everything it received has been parsed"""
+        return self.source.eof and self.source.occupancy == self.unparsed
+
+    def process(self, max_size=None):
+        """Parse the data received so far
+
+        Args:
+          max_size: maximum number of bytes to parse, None for everything that can be peeked at once
+
+        Returns:
+            list of output frames, in order
+        """
+        out_frames = []
+        for itm_frame in self._parse(max_size):
+            out_frame = self._decode(itm_frame)
+            if out_frame is not None:
+                out_frames.append(out_frame)
+        return out_frames
+
+    def _parse(self, max_size=None):
+        """Parse the data received so far into ITM frames
+
+        Args:
+          max_size: maximum number of bytes to parse, None for everything that can be peeked at once
+
+        Returns:
+            list of ITM frames, and DataLost where the receive buffer dropped data
+        """
+        self._last_parse = time.monotonic()
+        # Get a view of the received data, straight from the receive buffer
+        buf = self.source.peek()
+        if max_size is not None:
+            buf = buf[:max_size]
+        self.unparsed = len(buf)
+        itm_frames = []
+        if len(buf) > MAX_ITM_FRAME_SIZE:
+            # Pass buffer to ITM framer. This will parse the entire buffer until it is empty, returning the ITM frames
+            # and any unparsed data, which is left in the receive buffer for next time
+            itm_frames, rest = self.itm.parse_batch(buf)
+            self.unparsed = len(rest)
+            if self._gap_offset is not None and itm_frames:
+                # Show how long the framer took to get back in step after the gap while the stream is still running
+                logger.warning("Stream {}: ITM back in step {} bytes after a gap; {}".format(
+                    self.stream_id, itm_frames[0].offset - self._gap_offset, self.error_counts()))
+                self._gap_offset = None
+            # Samples of the raw ports are gathered from the buffer where the framer found them, instead of SWO framed
+            if self.raw_channels is not None:
+                self.raw_channels.extend_runs(buf, self.itm.raw_runs)
+        # The peeked view ends at a gap where the receive buffer dropped data
+        gap = self.source.next_loss()
+        if gap is not None and gap <= len(buf):
+            # A packet split by the gap can never be completed, so drop what is left before it too
+            self.itm.discard(self.unparsed)
+            self.unparsed = 0
+            self._gap_offset = self.itm.offset
+        self.source.consume(len(buf) - self.unparsed)
+        # Report the gap in place of the dropped data
+        lost = self.source.pop_lost()
+        if lost:
+            logger.warning("Stream {}: {} bytes dropped by the receive buffer".format(self.stream_id, lost))
+            itm_frames.append(DataLost(lost))
+        self.tick()
+        return itm_frames
+
+    def _decode(self, itm_frame):
+        """Build the output frame of an ITM frame, if it completes one"""
+        if isinstance(itm_frame, DataLost):
+            return self.swo.data_lost(itm_frame.lost_bytes)
+        # Try to build SWO frame from ITM frame
+        swo_frame = self.swo.parse(itm_frame)
+        if swo_frame is None or swo_frame.output is not True:
+            return None
+        if swo_frame.opcode == SWOOpcode.RESET:
+            # Reset each module
+            for x in self.modules.values():
+                x.reset()
+        # Forward parsed swo_frame to the module if it exists. It might be consumed by the module
+        try:
+            return self.modules[swo_frame.module].parse(swo_frame)
+        # If no module, continue with swo frame
+        except KeyError:
+            return swo_frame
+
+
+def run_pipelines(pipelines, output, min_batch=256, max_wait=0.01, quantum=1 << 16):
+    """Decode several streams round-robin until all of their sources are done
+
+    Each turn, a pipeline with enough new data parses at most quantum bytes, so that a fast stream can't starve the
+    others. When no pipeline has anything to do, wait until any source receives data, or max_wait at most.
+
+    Args:
+      pipelines: list of Pipeline
+      output: called with (pipeline, out_frame) for every output frame
+      min_batch: number of new bytes to wait for before parsing a stream. Lower for latency
+      max_wait: maximum time in seconds to wait for min_batch bytes before parsing what has arrived
+      quantum: maximum number of bytes parsed from one stream per turn
+    """
+    data_event = threading.Event()
+    for p in pipelines:
+        p.source.notify(data_event)
+    active = list(pipelines)
+    try:
+        while active:
+            # Clear before checking so that data arriving meanwhile still wakes us up
+            data_event.clear()
+            busy = False
+            for p in active:
+                if p.ready(min_batch, max_wait):
+                    busy = True
+                    for out_frame in p.process(quantum):
+                        output(p, out_frame)
+                else:
+                    p.tick()
+            for p in [p for p in active if p.done]:
+                logger.critical("End of input for stream {}".format(p.stream_id))
+                active.remove(p)
+            if not busy and active:
+                data_event.wait(max_wait)
+    finally:
+        for p in pipelines:
+            p.source.unnotify(data_event)
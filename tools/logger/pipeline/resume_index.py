@@ -0,0 +1,244 @@
+"""Index of the points in a capture where decoding can start, to decode a time range without reading from the start
+
+Decoding normally starts at the first ITM reset token, and the SWO time base is only known after the time sync packets
+and timestamps that came before. An indexing pass reads the whole capture once and records resume points: the position
+of every reset token, and of ITM synchronization and time sync packets every spacing bytes, along with the host time
+the data was received and the SWO time base in effect there: the real-time clock of the last timestamp, and the offset
+the packets since then add to it. A time range is then decoded by seeking straight to the last resume point before its
+start, with frames timed the same as when decoding from the start.
+
+The index is stored next to the capture as <path>.resume: an 8-byte magic and the clock it was built with, followed by
+one RESUME_RECORD per resume point.
+"""
+
+import os
+import struct
+import logging
+from bisect import bisect_right
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from itm import ITMTokenizer, ITMOpcode, ITMStimulusPort, MAX_ITM_FRAME_SIZE
+from serial_rx import FileRx
+from serial_rx.capture import capture_segments
+
+logger = logging.getLogger("Resume Index")
+
+RESUME_INDEX_EXT = ".resume"
+RESUME_INDEX_MAGIC = b"SWOLRES2"
+RESUME_INDEX_HEADER = struct.Struct("<8sd")  # Magic, clock in Hz
+# Byte offset of the packet header, kind, arrival time, SWO real-time clock, SWO offset from it
+RESUME_RECORD = struct.Struct("<QBddd")
+
+# Kinds of resume point
+RESUME_RESET = 0  # ITM reset token
+RESUME_SYNC = 1  # ITM synchronization packet
+RESUME_TIME = 2  # SWO time sync packet
+
+ResumePoint = namedtuple("ResumePoint", "offset kind time rtc_s swo_offset")
+
+_RESET_VALUE = 0xBBBBBBBB  # Payload of the software packet an ITM reset token is made of
+
+
+def build_resume_index(source, clock=48000000, spacing=1 << 20, baud=12000000):
+    """Find the resume points of a capture
+
+    The capture is split with ITMTokenizer, and only the SWO time base is followed, the same way SWOFramer does, so no
+    trace database is needed. Needs numpy.
+
+    Args:
+      source: FileRx of the capture, read from its current position to its end
+      clock: clock speed of the embedded processor in Hz
+      spacing: minimum number of bytes between two resume points other than reset tokens
+      baud: baud rate SWOFramer times packets with
+
+    Returns:
+        list of ResumePoint in stream order
+    """
+    if numpy is None:
+        raise ImportError("Indexing resume points needs numpy")
+    if source.arrival_time(0) is None:
+        raise ValueError("No capture index next to {}. Give a byte rate to index it".format(source.path))
+    tokenizer = ITMTokenizer(offset=source.bytes_consumed)
+    points = []
+    last = -spacing
+    # SWO time base: real-time clock of the last timestamp, and offset the packets since add to it
+    rtc_s = 0
+    swo_offset = 0.0
+    time_synced = True
+    while source.occupancy > MAX_ITM_FRAME_SIZE:
+        buf = source.peek()
+        packets, rest = tokenizer.tokenize(buf)
+        gap = source.next_loss()
+        if gap is not None and gap <= len(buf):
+            # A packet split by a gap the recorder left can never be completed
+            tokenizer.discard(len(rest))
+            source.consume(len(buf))
+            source.pop_lost()
+        elif len(rest) == len(buf):
+            break  # Only a partial packet is left
+        else:
+            source.consume(len(buf) - len(rest))
+        del buf, rest
+        opcode = packets.opcode
+        software = opcode == ITMOpcode.SOURCE_SW.value
+        stamps = opcode == ITMOpcode.TIMESTAMP.value
+        sync_times = software & (packets.port == ITMStimulusPort.STIM_SYNC_TIME.value)
+        candidates = sync_times | (opcode == ITMOpcode.SYNCHRONIZATION.value) | (
+            software & (packets.port == ITMStimulusPort.STIM_DRIVER.value) & (packets.size == 4) &
+            (packets.value == _RESET_VALUE))
+        # SWOFramer adds the time each software, trace and PC packet takes on the wire to the offset, and a timestamp
+        # starts it over. Summing from the last timestamp in the same order gives the same offset
+        timed = software | (opcode == ITMOpcode.TRACE.value) | (opcode == ITMOpcode.PACKET_PC.value)
+        duration = numpy.where(timed, (packets.size + 1) * 1 / baud, 0.0)
+        latest = numpy.maximum.accumulate(numpy.where(stamps, numpy.arange(len(opcode)), -1))
+        offsets = packets.offset.tolist()
+        ts_counter = packets.ts_counter.tolist()
+        values = packets.value.tolist()
+        for i in numpy.flatnonzero(stamps | candidates).tolist():
+            if stamps[i]:
+                rtc_s += ts_counter[i] / clock
+                continue
+            # Halfway through a time sync, the time base isn't known yet
+            if time_synced:
+                kind = None
+                if software[i] and not sync_times[i]:
+                    kind = RESUME_RESET
+                elif offsets[i] - last >= spacing:
+                    kind = RESUME_SYNC if opcode[i] == ITMOpcode.SYNCHRONIZATION.value else RESUME_TIME
+                if kind is not None:
+                    points.append(ResumePoint(offsets[i], kind, source.arrival_time(offsets[i]), rtc_s,
+                                              _offset_before(duration, latest, i, swo_offset)))
+                    last = offsets[i]
+            if sync_times[i]:
+                # Seconds, then subseconds
+                rtc_s = values[i] if time_synced else values[i] / (2 ** 32) + rtc_s
+                time_synced = not time_synced
+        swo_offset = _offset_before(duration, latest, len(opcode), swo_offset)
+    return points
+
+
+def _offset_before(duration, latest, i, carried):
+    """
+    Get the SWO offset in effect before a packet of a batch
+
+    Args:
+      duration: numpy array of the time each packet of the batch adds to the offset
+      latest: numpy array of the position of the last timestamp up to each packet, -1 if there is none
+      i: position of the packet
+      carried: offset at the start of the batch
+
+    Returns:
+        offset in seconds
+    """
+    if i and latest[i - 1] >= 0:
+        return float(numpy.cumsum(duration[latest[i - 1] + 1:i])[-1]) if i - 1 > latest[i - 1] else 0.0
+    return float(numpy.cumsum(numpy.append(carried, duration[:i]))[-1])
+
+
+def write_resume_index(path, points, clock):
+    """Write resume points to an index file
+
+    Args:
+      path: path of the index file
+      points: list of ResumePoint
+      clock: clock speed of the embedded processor in Hz the points were found with
+    """
+    with open(path, "wb") as f:
+        f.write(RESUME_INDEX_HEADER.pack(RESUME_INDEX_MAGIC, clock))
+        f.write(b"".join(RESUME_RECORD.pack(*p) for p in points))
+
+
+def read_resume_index(path):
+    """Read the resume points of an index file
+
+    Args:
+      path: path of the index file
+
+    Returns:
+        clock: clock speed of the embedded processor in Hz the points were found with
+        points: list of ResumePoint
+    """
+    with open(path, "rb") as f:
+        magic, clock = RESUME_INDEX_HEADER.unpack(f.read(RESUME_INDEX_HEADER.size))
+        if magic != RESUME_INDEX_MAGIC:
+            raise ValueError("Not a resume index, or one of an older version: " + path)
+        return clock, [ResumePoint(*p) for p in RESUME_RECORD.iter_unpack(f.read())]
+
+
+def load_resume_index(path, clock=48000000, rate=None, spacing=1 << 20):
+    """Get the resume points of a capture, indexing it first if it has no up to date index
+
+    Args:
+      path: capture path prefix as recorded with CaptureWriter, or a single raw file
+      clock: clock speed of the embedded processor in Hz
+      rate: bytes per second at which captures without a capture index were received
+      spacing: see :func:build_resume_index
+
+    Returns:
+        list of ResumePoint in stream order
+    """
+    index_path = path + RESUME_INDEX_EXT
+    if os.path.isfile(index_path):
+        # Rebuild if the capture was written to since
+        modified = max(os.path.getmtime(p) for p in capture_segments(path))
+        if os.path.getmtime(index_path) >= modified:
+            try:
+                index_clock, points = read_resume_index(index_path)
+            except (ValueError, struct.error):
+                index_clock = None  # Older version
+            if index_clock == clock:
+                return points
+    logger.critical("Indexing {}".format(path))
+    source = FileRx(path, rate=rate)
+    try:
+        points = build_resume_index(source, clock, spacing)
+    finally:
+        source.close()
+    write_resume_index(index_path, points, clock)
+    logger.critical("Found {} resume points in {}".format(len(points), path))
+    return points
+
+
+def find_resume_point(points, seconds):
+    """Get the last resume point received no later than a time
+
+    Args:
+      points: list of ResumePoint in stream order
+      seconds: time since the start of the capture
+
+    Returns:
+        ResumePoint, or None if there is none that early
+    """
+    i = bisect_right([p.time for p in points], seconds)
+    return points[i - 1] if i else None
+
+
+def seek_time(pipeline, start=None, end=None, spacing=1 << 20):
+    """Decode only the part of a capture received in a time range
+
+    Decoding resumes at the last resume point before start, so frames from up to spacing bytes earlier may be output
+    too. A frame that was only partly sent at the resume point is lost.
+
+    Args:
+      pipeline: Pipeline reading a capture with FileRx or ReplayRx, before anything was decoded
+      start: seconds since the start of the capture, None to decode from the start
+      end: seconds since the start of the capture, None to decode to the end
+      spacing: see :func:build_resume_index
+    """
+    source = pipeline.source
+    if end is not None:
+        source.limit(source.arrival_offset(end))
+    if start:
+        points = load_resume_index(source.path, pipeline.swo.clock, source.rate, spacing)
+        point = find_resume_point(points, start)
+        if point is None:
+            logger.critical("No resume point before {} s, decoding {} from the start".format(start, source.path))
+        else:
+            logger.critical("Resuming {} at offset {}, received at {:.3f} s".format(source.path, point.offset,
+                                                                                   point.time))
+            pipeline.resume(point.offset, point.rtc_s, point.swo_offset)
@@ -1 +1,15 @@
-from .serial_rx import SerialRx
\ No newline at end of file
+from .serial_rx import SerialRx
+from .ring_buffer import RingBuffer
+from .ring_buffer import OVERFLOW_POLICIES
+from .capture import CaptureWriter
+from .capture import CAPTURE_OVERFLOW_POLICIES
+from .compressed_capture import CompressedSegmentReader
+from .file_rx import FileRx
+from .replay_rx import ReplayRx
+from .socket_rx import SocketRx
+from .source import open_source
+from .async_rx import AsyncRx
+from .async_rx import AsyncSocketRx
+from .async_rx import open_async_source
+from .tpiu_rx import TPIURx
+from .async_rx import AsyncTPIURx
\ No newline at end of file
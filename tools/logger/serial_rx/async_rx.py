@@ -0,0 +1,253 @@
+"""Read byte sources from an asyncio event loop"""
+
+import socket
+import asyncio
+import time
+import logging
+from .ring_buffer import RingBuffer, RingRx, OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST
+from .source import open_source, TCP_PREFIX, UNIX_PREFIX
+from .tpiu_rx import TPIURx
+
+logger = logging.getLogger("Async Rx")
+
+
+class _LoopEvent(object):
+    """Set an asyncio.Event from another thread, so it can be used as a RingBuffer listener"""
+
+    def __init__(self, loop, event):
+        self._loop = loop
+        self._event = event
+
+    def set(self):
+        self._loop.call_soon_threadsafe(self._event.set)
+
+
+async def _wait_for_data(source, event, min_size, timeout):
+    """Wait until source has min_size bytes, is at its end, or timeout expires
+
+    Args:
+      source: byte source
+      event: asyncio.Event set whenever source receives data
+      min_size: number of bytes to wait for
+      timeout: maximum time to wait in seconds, None to wait forever
+
+    Returns:
+        True if min_size bytes are available, False otherwise
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    while source.occupancy < min_size and not source.eof:
+        event.clear()
+        remaining = None if deadline is None else deadline - loop.time()
+        if remaining is not None and remaining <= 0:
+            break
+        # Sources paced by time rather than by a receiver say when the data is due instead
+        due = source.due(min_size)
+        if due is not None:
+            remaining = due if remaining is None else min(due, remaining)
+        try:
+            await asyncio.wait_for(event.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+    return source.occupancy >= min_size
+
+
+class AsyncRx(object):
+    """Wrap any byte source so that waiting for data doesn't block the event loop
+
+    The receive thread of SerialRx or SocketRx wakes the event loop up when data arrives, so nothing is polled. peek and
+    consume never block and are used as is.
+
+    Must be created from a coroutine.
+
+    Args:
+        source: SerialRx, SocketRx, FileRx or ReplayRx
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._data_event = asyncio.Event()
+        source.notify(_LoopEvent(asyncio.get_running_loop(), self._data_event))
+
+    def __getattr__(self, name):
+        # peek, consume, next_loss, pop_lost, receive, occupancy, eof...
+        return getattr(self.source, name)
+
+    async def wait(self, min_size=1, timeout=None):
+        """Wait until at least min_size bytes have been received and not consumed, or timeout expires
+
+        Args:
+          min_size: number of bytes to wait for
+          timeout: maximum time to wait in seconds, None to wait forever
+
+        Returns:
+            True if min_size bytes are available, False on timeout or at the end of the input
+        """
+        return await _wait_for_data(self.source, self._data_event, min_size, timeout)
+
+    async def close(self):
+        """Close the source from a worker thread, since joining its receive thread can take up to its timeout"""
+        await asyncio.get_running_loop().run_in_executor(None, self.source.close)
+
+
+class AsyncSocketRx(RingRx):
+    """Receive from a TCP or UNIX domain stream socket on the event loop, without a receive thread
+
+    Works like SocketRx, reading straight into the ring buffer with the event loop's sock_recv_into. With
+    OVERFLOW_BLOCK, the socket isn't read until the ring buffer has room, so TCP flow control slows down the sender.
+
+    Call :method:open from a coroutine before use.
+
+    Args:
+        address: (host, port) for TCP or a path for a UNIX domain socket
+        family: socket.AF_INET, socket.AF_INET6 or socket.AF_UNIX
+        chunk_size: maximum bytes to read at once
+        buffer_size: size of the receive ring buffer in bytes
+        capture: optional CaptureWriter that all received bytes are recorded to. It is not closed by close()
+        overflow: what to do when the receive buffer is full, one of OVERFLOW_POLICIES
+    """
+
+    timeout = 0
+
+    def __init__(self, address, family=socket.AF_INET, chunk_size=1 << 18, buffer_size=1 << 22, capture=None,
+                 overflow=OVERFLOW_DROP_NEWEST):
+        self.address = address
+        self.family = family
+        self.chunk_size = chunk_size
+        self.capture = capture
+        self.ring = RingBuffer(buffer_size, policy=overflow)
+        self._sock = None
+        self._task = None
+        self._eof = False
+        self._data_event = asyncio.Event()
+        self._space_event = asyncio.Event()
+        # Commits happen on the event loop, so the event can be set directly
+        self.ring.add_listener(self._data_event)
+
+    async def open(self):
+        """Connect and start receiving"""
+        loop = asyncio.get_running_loop()
+        self._sock = socket.socket(self.family, socket.SOCK_STREAM)
+        self._sock.setblocking(False)
+        await loop.sock_connect(self._sock, self.address)
+        logger.critical("Connected to {}".format(self.address))
+        self._task = loop.create_task(self._receive())
+
+    async def _receive(self):
+        """Receive task"""
+        loop = asyncio.get_running_loop()
+        # Used to keep draining the socket when the ring buffer is full
+        scratch = memoryview(bytearray(self.chunk_size))
+        try:
+            while True:
+                view = self.ring.reserve(self.chunk_size, 0)
+                buffered = len(view) > 0
+                if not buffered:
+                    if self.ring.policy == OVERFLOW_BLOCK:
+                        self._space_event.clear()
+                        await self._space_event.wait()
+                        continue
+                    view = scratch
+                n = await loop.sock_recv_into(self._sock, view)
+                if n == 0:
+                    logger.critical("Connection closed by peer")
+                    break
+                if self.capture is not None:
+                    self.capture.write(view[:n].tobytes(), time.time())
+                if not buffered:
+                    self.ring.overrun(n)
+                else:
+                    self.ring.commit(n)
+        except OSError as e:
+            logger.error("Socket receive failed: " + str(e))
+        finally:
+            self._eof = True
+            self._data_event.set()
+
+    @property
+    def eof(self):
+        """True once the peer has closed the connection"""
+        return self._eof
+
+    def consume(self, n):
+        """Release n bytes returned by :method:peek once they have been parsed"""
+        self.ring.consume(n)
+        self._space_event.set()
+
+    async def wait(self, min_size=1, timeout=None):
+        """Wait until at least min_size bytes have been received and not consumed, or timeout expires
+
+        Args:
+          min_size: number of bytes to wait for
+          timeout: maximum time to wait in seconds, None to wait forever
+
+        Returns:
+            True if min_size bytes are available, False on timeout or once the connection is closed
+        """
+        return await _wait_for_data(self, self._data_event, min_size, timeout)
+
+    async def close(self):
+        """Stop receiving and close the socket"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._sock is not None:
+            logger.critical("Closing socket")
+            self._sock.close()
+        logger.critical(self.stats())
+
+
+class AsyncTPIURx(TPIURx):
+    """Deframe the data of one trace source ID from an AsyncSocketRx, see TPIURx
+
+    Args:
+        source: AsyncSocketRx delivering TPIU formatter frames
+        trace_id: source ID of the ITM data
+        synced: True if the source starts on a frame boundary, False to wait for a synchronization packet
+    """
+
+    async def wait(self, min_size=1, timeout=None):
+        """Wait until at least min_size deframed bytes are available, or timeout expires
+
+        Returns:
+            True if min_size bytes are available, False otherwise
+        """
+        if self.occupancy < min_size:
+            await self.source.wait(self._raw_size(min_size), timeout)
+        return self.occupancy >= min_size
+
+    async def close(self):
+        """Close the socket"""
+        await self.source.close()
+        logger.critical("TPIU source ID {}: {} bytes of other IDs dropped".format(self.trace_id, self.other_bytes))
+
+
+async def open_async_source(port, speed=None, **kwargs):
+    """Open the byte source named by port for use from an event loop
+
+    Sockets are read on the event loop itself. Other sources keep their receive thread, if any, and are wrapped in
+    AsyncRx.
+
+    Args:
+      port: see :func:open_source
+      speed: see :func:open_source
+      kwargs: see :func:open_source
+
+    Returns:
+        AsyncSocketRx or AsyncRx, or AsyncTPIURx wrapping an AsyncSocketRx with tpiu
+    """
+    socket_kwargs = {k: v for k, v in kwargs.items() if k in ("buffer_size", "capture", "overflow")}
+    rx = None
+    if port.startswith(TCP_PREFIX):
+        host, _, tcp_port = port[len(TCP_PREFIX):].rpartition(":")
+        rx = AsyncSocketRx((host or "localhost", int(tcp_port)), socket.AF_INET, **socket_kwargs)
+    elif port.startswith(UNIX_PREFIX):
+        rx = AsyncSocketRx(port[len(UNIX_PREFIX):], socket.AF_UNIX, **socket_kwargs)
+    if rx is None:
+        return AsyncRx(open_source(port, speed, **kwargs))
+    await rx.open()
+    tpiu = kwargs.get("tpiu")
+    return rx if tpiu is None else AsyncTPIURx(rx, tpiu)
@@ -0,0 +1,303 @@
+"""Record the raw received byte stream to rotating segment files
+
+A capture is a numbered series of segments, <prefix>_0000.bin, <prefix>_0001.bin, ... Each .bin file holds the raw
+bytes exactly as received so that it can be memory-mapped and decoded again later. Next to it, an .idx file holds the
+host arrival time of every received chunk: an 8-byte magic followed by one CAPTURE_INDEX_RECORD per chunk, giving the
+chunk's byte offset into the .bin file and the time.time() at which it was received. Chunks the recorder had to drop
+are recorded as a gap instead: a CAPTURE_INDEX_RECORD with CAPTURE_GAP set in place of the offset, along with the number
+of bytes dropped. The gap is in front of the chunk recorded next, or at the end of the segment.
+
+Segments can also be compressed, in which case they are .swz files instead of .bin files. See compressed_capture.
+"""
+
+import os
+import sys
+import struct
+import threading
+import time
+import logging
+from array import array
+from collections import deque
+from .compressed_capture import CompressedSegmentWriter, COMPRESSED_SEGMENT_EXT, CODECS
+from .ring_buffer import OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST
+
+logger = logging.getLogger("Capture")
+
+CAPTURE_INDEX_MAGIC = b"SWOLIDX1"
+CAPTURE_INDEX_RECORD = struct.Struct("<Qd")  # Byte offset into segment, host arrival time in seconds
+CAPTURE_GAP = 1 << 63  # Set in the offset of a record of dropped bytes, along with their number
+
+# What the recorder does when the disk falls behind, see CaptureWriter
+CAPTURE_OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST)
+
+
+def _read_index_records(path):
+    """Read all records of a capture index, chunks and gaps alike"""
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_INDEX_MAGIC)) != CAPTURE_INDEX_MAGIC:
+            raise ValueError("Not a capture index: " + path)
+        records = array("Q")
+        records.frombytes(f.read())
+    if sys.byteorder != "little":
+        records.byteswap()
+    times = array("d")
+    times.frombytes(records[1::2].tobytes())
+    return records[0::2], times
+
+
+def read_capture_index(path):
+    """Read the chunk index of a capture segment
+
+    Args:
+      path: path to the .idx file
+
+    Returns:
+        offsets: array of byte offsets of each chunk into the segment
+        times: array of host arrival times of each chunk
+    """
+    offsets, times = _read_index_records(path)
+    chunks = [i for i, offset in enumerate(offsets) if not offset & CAPTURE_GAP]
+    if len(chunks) == len(offsets):
+        return offsets, times
+    return array("Q", (offsets[i] for i in chunks)), array("d", (times[i] for i in chunks))
+
+
+def read_capture_gaps(path, size):
+    """Read where the recorder dropped data in a capture segment
+
+    Args:
+      path: path to the .idx file
+      size: size of the segment in bytes, where gaps after the last chunk are
+
+    Returns:
+        list of [byte offset into the segment, bytes dropped there], in order
+    """
+    offsets, times = _read_index_records(path)
+    gaps = []
+    position = size
+    # A gap is in front of the chunk that follows it
+    for offset in reversed(offsets):
+        if not offset & CAPTURE_GAP:
+            position = offset
+        elif gaps and gaps[-1][0] == position:
+            gaps[-1][1] += offset & ~CAPTURE_GAP
+        else:
+            gaps.append([position, offset & ~CAPTURE_GAP])
+    gaps.reverse()
+    return gaps
+
+
+def capture_segment_path(prefix, number, ext=".bin"):
+    """Path of segment `number` of the capture at `prefix`"""
+    return "{}_{:04d}{}".format(prefix, number, ext)
+
+
+def capture_segments(path):
+    """List the segment files of a capture
+
+    Args:
+      path: capture path prefix, or a single raw file
+
+    Returns:
+        list of paths to the raw segment files, in order
+    """
+    if os.path.isfile(path):
+        return [path]
+    segments = []
+    while True:
+        for ext in (".bin", COMPRESSED_SEGMENT_EXT):
+            if os.path.isfile(capture_segment_path(path, len(segments), ext)):
+                segments.append(capture_segment_path(path, len(segments), ext))
+                break
+        else:
+            return segments
+
+
+class CaptureWriter(object):
+    """Tee received bytes to rotating capture segments from a background thread
+
+    :method:write only queues the chunk, so it can be called from the receive thread at full baud rate. The writer
+    thread wakes up every flush_interval, or as soon as batch_size bytes are queued, and writes everything that is
+    queued with one write per file. Compression also runs on the writer thread, so it never holds up receiving.
+
+    At most max_pending bytes are queued or being written. If the disk falls behind the link for longer than that, the
+    policy decides: OVERFLOW_BLOCK makes :method:write wait for the writer thread, which pushes back on the receive
+    thread and so on the receive buffer, where its own overflow policy applies. OVERFLOW_DROP_NEWEST drops the chunk
+    and records a gap in the .idx file in its place, so that decoding the capture reports the missing data.
+
+    Args:
+        prefix: path prefix of the segment files
+        max_size: start a new segment once the current one would exceed this many bytes, before compression
+        max_time: start a new segment once the current one spans this many seconds, None for no limit
+        batch_size: queued bytes that wake the writer thread before flush_interval
+        flush_interval: maximum time in seconds that received data waits before being written. Compressed data waits
+          until a whole block is received
+        compression: None for raw segments, or "zlib" or "lzma" for compressed ones
+        block_size: size of each compressed block before compression
+        max_pending: maximum number of bytes queued or being written
+        policy: what write does once max_pending bytes are queued, one of CAPTURE_OVERFLOW_POLICIES
+    """
+
+    def __init__(self, prefix, max_size=256 << 20, max_time=None, batch_size=1 << 20, flush_interval=0.5,
+                 compression=None, block_size=1 << 20, max_pending=64 << 20, policy=OVERFLOW_DROP_NEWEST):
+        if compression is not None and compression not in CODECS:
+            raise ValueError("Unknown compression {}, expected one of {}".format(compression, list(CODECS)))
+        if policy not in CAPTURE_OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {}, expected one of {}".format(policy,
+                                                                                      CAPTURE_OVERFLOW_POLICIES))
+        self.prefix = prefix
+        self.compression = compression
+        self.block_size = block_size
+        self.max_size = int(max_size)
+        self.max_time = max_time
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = int(max_pending)
+        self.policy = policy
+        self.segment = -1
+        self.bytes_written = 0
+        self.drops = 0
+        self.dropped_bytes = 0
+        self.blocked_time = 0
+        self._pending = deque()
+        # Each counter has a single writing thread so no lock is needed, except to wait for room
+        self._queued = 0
+        self._flushed = 0
+        self._room = threading.Condition()
+        self._bin = None
+        self._idx = None
+        self._segment_size = 0
+        self._segment_start = 0
+        directory = os.path.dirname(os.path.abspath(prefix))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.critical("Recording raw capture to {}".format(capture_segment_path(
+            prefix, 0, ".bin" if compression is None else COMPRESSED_SEGMENT_EXT)))
+
+    def write(self, data, timestamp=None):
+        """Queue a received chunk for recording
+
+        Args:
+          data: received bytes. Must not be modified afterwards
+          timestamp: host arrival time, defaults to now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if self._queued - self._flushed + len(data) > self.max_pending and self._queued > self._flushed:
+            self._wake.set()
+            if self.policy == OVERFLOW_BLOCK:
+                start = time.monotonic()
+                with self._room:
+                    self._room.wait_for(lambda: self._queued - self._flushed + len(data) <= self.max_pending or
+                                        self._queued == self._flushed)
+                self.blocked_time += time.monotonic() - start
+            else:
+                if not self.drops:
+                    logger.warning("Capture write is falling behind, dropping received data")
+                self.drops += 1
+                self.dropped_bytes += len(data)
+                # The writer thread records the gap in order with the chunks
+                self._pending.append((timestamp, len(data)))
+                return
+        self._pending.append((timestamp, data))
+        self._queued += len(data)
+        if self._queued - self._flushed >= self.batch_size:
+            self._wake.set()
+
+    def _rotate(self, timestamp):
+        """Close the current segment and open the next one"""
+        self._close_segment()
+        self.segment += 1
+        if self.compression is None:
+            self._bin = open(capture_segment_path(self.prefix, self.segment), "wb")
+        else:
+            self._bin = CompressedSegmentWriter(capture_segment_path(self.prefix, self.segment, COMPRESSED_SEGMENT_EXT),
+                                                self.compression, self.block_size)
+        self._idx = open(capture_segment_path(self.prefix, self.segment, ".idx"), "wb")
+        self._idx.write(CAPTURE_INDEX_MAGIC)
+        self._segment_size = 0
+        self._segment_start = timestamp
+
+    def _close_segment(self):
+        if self._bin is not None:
+            self._bin.close()
+            self._idx.close()
+            self._bin = self._idx = None
+
+    def _flush(self):
+        """Write everything that is queued"""
+        data = []
+        index = bytearray()
+        size = 0  # Bytes taken off the queue and not yet written
+        try:
+            while self._pending:
+                timestamp, chunk = self._pending.popleft()
+                if self._bin is None:
+                    self._rotate(timestamp)
+                if isinstance(chunk, int):
+                    # Dropped chunk
+                    index += CAPTURE_INDEX_RECORD.pack(CAPTURE_GAP | chunk, timestamp)
+                    continue
+                # Never split a chunk across segments
+                if self._segment_size and (self._segment_size + len(chunk) > self.max_size or (
+                        self.max_time is not None and timestamp - self._segment_start >= self.max_time)):
+                    if index:
+                        self._write(data, index)
+                        data = []
+                        index = bytearray()
+                        self._written(size)
+                        size = 0
+                    self._rotate(timestamp)
+                size += len(chunk)
+                index += CAPTURE_INDEX_RECORD.pack(self._segment_size, timestamp)
+                if self.compression is None:
+                    data.append(chunk)
+                else:
+                    self._bin.write(chunk, timestamp)
+                self._segment_size += len(chunk)
+                self.bytes_written += len(chunk)
+            if index:
+                self._write(data, index)
+        finally:
+            # Make room even if writing failed, the data is lost either way
+            self._written(size)
+
+    def _write(self, data, index):
+        """Write raw chunks and their index records to the current segment"""
+        if data:
+            self._bin.write(b"".join(data))
+        self._idx.write(index)
+
+    def _written(self, size):
+        """Release the room of bytes taken off the queue, waking up a blocked write"""
+        if size:
+            with self._room:
+                self._flushed += size
+                self._room.notify_all()
+
+    def _run(self):
+        """Target thread for CaptureWriter"""
+        while not self._stop_event.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self._flush()
+            except Exception as e:
+                logger.error("Capture write failed: " + str(e))
+
+    def close(self):
+        """Write out anything still queued and close the current segment"""
+        self._stop_event.set()
+        self._wake.set()
+        self._thread.join()
+        self._flush()
+        self._close_segment()
+        logger.critical("Raw capture closed: {} bytes in {} segment(s)".format(self.bytes_written, self.segment + 1))
+        if self.drops or self.blocked_time:
+            logger.critical("Raw capture fell behind: {} chunks ({} bytes) dropped, {:.3f} s blocked".format(
+                self.drops, self.dropped_bytes, self.blocked_time))
@@ -0,0 +1,151 @@
+"""Capture segments stored as independently compressed blocks
+
+A compressed segment (<prefix>_NNNN.swz) holds the same bytes as a raw .bin segment, and the .idx file next to it is
+unchanged, so offsets in it are still into the uncompressed data. The file is laid out as:
+
+    SEGMENT_HEADER                   magic and codec
+    BLOCK_HEADER + compressed data   for each block
+    BLOCK_INDEX_RECORD               for each block
+    SEGMENT_FOOTER                   offset of the first index record and magic
+
+Each block can be decompressed on its own, so a segment can be read one block at a time with bounded memory, and the
+index in the footer gives the position and time of every block without reading them. If the footer is missing because
+the capture was cut short, the blocks are found by following their headers instead.
+"""
+
+import os
+import zlib
+import lzma
+import struct
+import logging
+
+logger = logging.getLogger("Capture")
+
+COMPRESSED_SEGMENT_EXT = ".swz"
+SEGMENT_MAGIC = b"SWOLZ001"
+SEGMENT_HEADER = struct.Struct("<8sB7x")  # Magic, codec id
+BLOCK_HEADER = struct.Struct("<IId")  # Compressed size, uncompressed size, host arrival time of the first byte
+BLOCK_INDEX_RECORD = struct.Struct("<QQQd")  # File offset of block header, uncompressed offset and size, arrival time
+INDEX_MAGIC = b"SWOLZIDX"
+SEGMENT_FOOTER = struct.Struct("<Q8s")  # File offset of the first index record, magic
+
+# Codec name: (id, compress, decompress). lzma uses a low preset to keep up with the full baud rate
+CODECS = {
+    "zlib": (1, lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (2, lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+_CODEC_IDS = {codec[0]: name for name, codec in CODECS.items()}
+
+
+class CompressedSegmentWriter(object):
+    """Write a compressed capture segment
+
+    Data is gathered until block_size bytes are pending, which are then compressed as one block. Must be closed to
+    write the last block and the index.
+
+    Args:
+        path: path of the segment file
+        codec: one of CODECS
+        block_size: uncompressed size of each block
+    """
+
+    def __init__(self, path, codec="zlib", block_size=1 << 20):
+        self.path = path
+        self.block_size = block_size
+        self._codec_id, self._compress, _ = CODECS[codec]
+        self._file = open(path, "wb")
+        self._file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, self._codec_id))
+        self._index = bytearray()
+        self._pending = []
+        self._pending_size = 0
+        self._pending_time = 0
+        self.size = 0  # Uncompressed bytes written
+        self.compressed_size = SEGMENT_HEADER.size
+
+    def write(self, data, timestamp):
+        """Add data received at timestamp"""
+        if not self._pending:
+            self._pending_time = timestamp
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.block_size:
+            self._write_block()
+
+    def _write_block(self):
+        """Compress and write the pending data as one block"""
+        if not self._pending_size:
+            return
+        data = self._compress(b"".join(self._pending))
+        self._index += BLOCK_INDEX_RECORD.pack(self.compressed_size, self.size, self._pending_size, self._pending_time)
+        self._file.write(BLOCK_HEADER.pack(len(data), self._pending_size, self._pending_time))
+        self._file.write(data)
+        self.compressed_size += BLOCK_HEADER.size + len(data)
+        self.size += self._pending_size
+        self._pending = []
+        self._pending_size = 0
+
+    def close(self):
+        """Write the last block and the index, and close the file"""
+        self._write_block()
+        self._file.write(self._index)
+        self._file.write(SEGMENT_FOOTER.pack(self.compressed_size, INDEX_MAGIC))
+        self._file.close()
+
+
+class CompressedSegmentReader(object):
+    """Read a compressed capture segment one block at a time
+
+    Args:
+        path: path of the segment file
+
+    Attributes:
+        blocks: list of (file offset, uncompressed offset, uncompressed size, host arrival time) of each block
+        size: total uncompressed size
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        magic, codec_id = SEGMENT_HEADER.unpack(self._file.read(SEGMENT_HEADER.size))
+        if magic != SEGMENT_MAGIC or codec_id not in _CODEC_IDS:
+            raise ValueError("Not a compressed capture segment: " + path)
+        self._decompress = CODECS[_CODEC_IDS[codec_id]][2]
+        self.blocks = self._read_index()
+        self.size = self.blocks[-1][1] + self.blocks[-1][2] if self.blocks else 0
+
+    def _read_index(self):
+        """Read the block index from the footer, or by following the block headers if there is none"""
+        file_size = os.fstat(self._file.fileno()).st_size
+        if file_size >= SEGMENT_HEADER.size + SEGMENT_FOOTER.size:
+            self._file.seek(file_size - SEGMENT_FOOTER.size)
+            index_offset, magic = SEGMENT_FOOTER.unpack(self._file.read(SEGMENT_FOOTER.size))
+            if magic == INDEX_MAGIC:
+                self._file.seek(index_offset)
+                index = self._file.read(file_size - SEGMENT_FOOTER.size - index_offset)
+                return list(BLOCK_INDEX_RECORD.iter_unpack(index))
+        logger.warning("No block index in {}, scanning blocks".format(self.path))
+        blocks = []
+        offset = SEGMENT_HEADER.size
+        raw_offset = 0
+        while offset + BLOCK_HEADER.size <= file_size:
+            self._file.seek(offset)
+            compressed_size, size, timestamp = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+            if offset + BLOCK_HEADER.size + compressed_size > file_size:
+                break  # Block was cut short
+            blocks.append((offset, raw_offset, size, timestamp))
+            offset += BLOCK_HEADER.size + compressed_size
+            raw_offset += size
+        return blocks
+
+    def read_block(self, i):
+        """Decompress block i
+
+        Returns:
+            bytes of the block
+        """
+        self._file.seek(self.blocks[i][0])
+        compressed_size, _, _ = BLOCK_HEADER.unpack(self._file.read(BLOCK_HEADER.size))
+        return self._decompress(self._file.read(compressed_size))
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,261 @@
+"""Class to read a recorded capture in place of a serial port"""
+
+import os
+import mmap
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import partial
+from .capture import capture_segments, read_capture_index, read_capture_gaps
+from .compressed_capture import CompressedSegmentReader, COMPRESSED_SEGMENT_EXT
+
+logger = logging.getLogger("File Rx")
+
+
+def _map_file(path):
+    """Memory-map a file read-only. Empty files can't be mapped so return empty bytes for them"""
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return bytes()
+
+
+class FileRx(object):
+    """Read a raw capture as if it was being received, as fast as it is consumed.
+
+    Has the same peek / consume / receive / wait / close interface as SerialRx, so it can stand in for it anywhere.
+    Each segment of the capture is memory-mapped and peek returns large views straight into the mapping, so nothing is
+    copied or read ahead and wait never sleeps. Compressed segments are decompressed one block at a time instead, as
+    they are reached. The only copy is of the few bytes around a boundary between segments or blocks, so that a packet
+    split across two of them can still be read contiguously.
+
+    Where the capture index records data the recorder dropped, the data is reported as lost the same way a receive
+    buffer reports an overrun, see :method:next_loss.
+
+    Args:
+        path: capture path prefix as recorded with CaptureWriter, or a single raw file
+        chunk_size: maximum size of the view returned by peek
+        join_size: number of bytes from the next segment or block joined to the end of the current one
+        rate: bytes per second at which captures without an index were received, None if unknown
+    """
+
+    timeout = 0
+    eof = True  # All data is available from the start
+
+    def __init__(self, path, chunk_size=1 << 20, join_size=64, rate=None):
+        self.path = path
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.join_size = join_size
+        self._paths = capture_segments(path)
+        if not self._paths:
+            raise FileNotFoundError("No capture found at " + path)
+        # Split the capture into pieces that are loaded one at a time: whole raw segments, or compressed blocks
+        self._pieces = []
+        self._piece_sizes = []
+        self._readers = []
+        self._segment_sizes = []
+        for p in self._paths:
+            if p.endswith(COMPRESSED_SEGMENT_EXT):
+                reader = CompressedSegmentReader(p)
+                self._readers.append(reader)
+                self._pieces.extend(partial(reader.read_block, i) for i in range(len(reader.blocks)))
+                self._piece_sizes.extend(block[2] for block in reader.blocks)
+                self._segment_sizes.append(reader.size)
+            else:
+                self._pieces.append(partial(_map_file, p))
+                self._piece_sizes.append(os.path.getsize(p))
+                self._segment_sizes.append(os.path.getsize(p))
+        if not self._pieces:
+            self._pieces.append(bytes)  # Only empty compressed segments
+            self._piece_sizes.append(0)
+        self._total = sum(self._segment_sizes)
+        self._end = self._total
+        self._ends = None
+        self._times = None
+        self._gaps = []  # [stream offset, bytes dropped] of each gap the recorder left
+        self._gap = 0  # First gap not reached yet
+        index_paths = [os.path.splitext(p)[0] + ".idx" for p in self._paths]
+        if all(os.path.isfile(p) for p in index_paths):
+            self._load_index(index_paths)
+        self._maps = {}
+        self._piece = 0
+        self._pos = 0
+        self.bytes_consumed = 0
+        logger.critical("Reading capture {}: {} segment(s), {} bytes".format(path, len(self._paths), self._total))
+
+    def _load_index(self, index_paths):
+        """Build the cumulative byte count received at each arrival time"""
+        self._ends = array("Q")
+        self._times = array("d")
+        base = 0
+        for segment_size, idx_path in zip(self._segment_sizes, index_paths):
+            offsets, times = read_capture_index(idx_path)
+            self._gaps.extend([base + offset, lost] for offset, lost in read_capture_gaps(idx_path, segment_size))
+            # Each chunk ends where the next one starts, the last one at the end of the segment
+            self._ends.extend(base + o for o in offsets[1:])
+            base += segment_size
+            if len(offsets):
+                self._ends.append(base)
+            self._times.extend(times)
+        # Make times relative to the first chunk, and never go back in case the host clock was adjusted
+        relative = array("d")
+        latest = self._times[0] if len(self._times) else 0
+        first = latest
+        for t in self._times:
+            latest = max(latest, t)
+            relative.append(latest - first)
+        self._times = relative
+
+    def arrival_time(self, offset):
+        """Time since the start of the capture at which offset bytes had been received
+
+        Returns:
+            seconds, from the capture index or else the byte rate. None if there is neither
+        """
+        if self._times is None:
+            return None if self.rate is None else offset / self.rate
+        if not len(self._times):
+            return 0
+        return self._times[min(bisect_left(self._ends, offset), len(self._times) - 1)]
+
+    def arrival_offset(self, seconds):
+        """Number of bytes that had been received a time after the start of the capture
+
+        Returns:
+            bytes from the start of the capture. All of them if there is neither an index nor a byte rate
+        """
+        if self._times is None:
+            return self._total if self.rate is None else min(self._total, int(seconds * self.rate))
+        i = bisect_right(self._times, seconds)
+        return self._ends[i - 1] if i else 0
+
+    def _mapping(self, piece):
+        """Get the data of a piece, mapping or decompressing it if needed"""
+        if piece not in self._maps:
+            self._maps[piece] = self._pieces[piece]()
+        return self._maps[piece]
+
+    @property
+    def occupancy(self):
+        """Bytes not yet consumed"""
+        return self._end - self.bytes_consumed
+
+    def seek(self, offset):
+        """Skip to a byte offset into the capture, without reading what is skipped
+
+        Args:
+          offset: number of bytes from the start of the capture
+        """
+        offset = min(offset, self._end)
+        self._maps = {}
+        self._piece = 0
+        self._pos = offset
+        while self._piece + 1 < len(self._pieces) and self._pos >= self._piece_sizes[self._piece]:
+            self._pos -= self._piece_sizes[self._piece]
+            self._piece += 1
+        self.bytes_consumed = offset
+        self._gap = bisect_right([gap[0] for gap in self._gaps], offset)
+
+    def limit(self, end):
+        """Stop reading at a byte offset into the capture instead of at its end
+
+        Args:
+          end: number of bytes from the start of the capture
+        """
+        self._end = max(min(end, self._total), self.bytes_consumed)
+
+    def wait(self, min_size=1, timeout=None):
+        """Never blocks since all data is available
+
+        Returns:
+            True if min_size bytes are left, False otherwise
+        """
+        return self.occupancy >= min_size
+
+    def due(self, min_size=1):
+        """All data is available, so it is always due now
+
+        Returns:
+            0
+        """
+        return 0
+
+    def notify(self, event):
+        """Nothing is ever received so the event is never set. Waiting on several sources times out instead"""
+
+    def unnotify(self, event):
+        """Nothing to undo, as :method:notify keeps no reference to the event"""
+
+    def peek(self):
+        """Get a contiguous view of the data without copying or consuming it
+
+        Returns:
+            memoryview of the data, empty at the end of the capture
+        """
+        current = self._mapping(self._piece)
+        view = memoryview(current)[self._pos:self._pos + self.chunk_size]
+        if len(view) < self.join_size and self._piece + 1 < len(self._pieces):
+            # Join the end of this piece to the start of the following ones
+            joined = bytearray(view)
+            piece = self._piece + 1
+            while len(joined) < len(view) + self.join_size and piece < len(self._pieces):
+                joined += self._mapping(piece)[:len(view) + self.join_size - len(joined)]
+                piece += 1
+            view = memoryview(joined)
+        gap = self.next_loss()
+        return view[:self.occupancy if gap is None else min(self.occupancy, gap)]
+
+    def consume(self, n):
+        """Release n bytes returned by :method:peek once they have been parsed"""
+        n = min(n, self.occupancy)
+        self.bytes_consumed += n
+        self._pos += n
+        # Move on to the next piece, releasing the last one once nothing refers to it anymore
+        while self._pos >= len(self._mapping(self._piece)) and self._piece + 1 < len(self._pieces):
+            self._pos -= len(self._maps.pop(self._piece))
+            self._piece += 1
+
+    def next_loss(self):
+        """Get the number of unconsumed bytes before the next gap the recorder left, where peek stops
+
+        Returns:
+            number of bytes, or None if no data is missing
+        """
+        if self._gap < len(self._gaps):
+            return self._gaps[self._gap][0] - self.bytes_consumed
+        return None
+
+    def pop_lost(self):
+        """Get the size of the gap at the read position, once everything before it has been consumed
+
+        Returns:
+            number of bytes the recorder dropped there, 0 if none
+        """
+        if self._gap < len(self._gaps) and self._gaps[self._gap][0] <= self.bytes_consumed:
+            self._gap += 1
+            return self._gaps[self._gap - 1][1]
+        return 0
+
+    def receive(self):
+        """Read and consume data
+
+        Returns:
+            bytes of data or empty bytes at the end of the capture
+        """
+        result = bytes(self.peek())
+        self.consume(len(result))
+        return result
+
+    def close(self):
+        """Unmap the capture"""
+        for m in self._maps.values():
+            try:
+                m.close()
+            except (AttributeError, BufferError):
+                pass  # Decompressed block, empty segment or still in use; unmapped once released
+        self._maps = {}
+        for reader in self._readers:
+            reader.close()
+        logger.critical("Closed capture after {} of {} bytes".format(self.bytes_consumed, self._total))
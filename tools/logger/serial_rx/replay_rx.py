@@ -0,0 +1,110 @@
+"""Class to replay a recorded capture at its original pace"""
+
+import time
+import logging
+from .file_rx import FileRx
+
+logger = logging.getLogger("Replay Rx")
+
+
+class ReplayRx(FileRx):
+    """Replay a raw capture at the pace it was received, scaled by speed.
+
+    Each chunk of the capture is made available at the host arrival time stored in the capture index, relative to the
+    first chunk and divided by speed, so 10 replays ten times faster than real time and 0.1 ten times slower. Captures
+    without an index, such as raw files, can be paced at a constant byte rate instead. Data is otherwise read the same
+    way as with FileRx.
+
+    How far the consumer falls behind is tracked, so the output side of the pipeline can be load-tested without a board.
+
+    Args:
+        path: capture path prefix as recorded with CaptureWriter, or a single raw file
+        speed: replay speed relative to real time
+        rate: bytes per second (at speed 1) for captures without an index, None to require an index
+        chunk_size: maximum size of the view returned by peek
+    """
+
+    def __init__(self, path, speed=1.0, rate=None, chunk_size=1 << 20):
+        super().__init__(path, chunk_size, rate=rate)
+        self.speed = float(speed)
+        if self._times is None and rate is None:
+            raise FileNotFoundError("No capture index next to {}. Give a byte rate to replay it".format(path))
+        self.high_water = 0
+        self.max_lag = 0
+        self._start = time.monotonic()
+
+    def _released(self):
+        """Number of bytes that have been received by now"""
+        return self.arrival_offset((time.monotonic() - self._start) * self.speed)
+
+    @property
+    def eof(self):
+        """True once the whole capture has been released"""
+        return self._released() >= self._end
+
+    @property
+    def occupancy(self):
+        """Bytes received but not yet consumed"""
+        return min(self._released(), self._end) - self.bytes_consumed
+
+    def seek(self, offset):
+        """Skip to a byte offset into the capture, and carry on replaying from the time it was received
+
+        Args:
+          offset: number of bytes from the start of the capture
+        """
+        super().seek(offset)
+        self._start = time.monotonic() - self.arrival_time(self.bytes_consumed) / self.speed
+
+    def due(self, min_size=1):
+        """Time until min_size bytes will have been received and not consumed
+
+        Returns:
+            seconds from now, 0 or less if they already have been
+        """
+        target = min(self.bytes_consumed + min_size, self._end)
+        return self.arrival_time(target) / self.speed - (time.monotonic() - self._start)
+
+    def wait(self, min_size=1, timeout=None):
+        """Block until at least min_size bytes have been received and not consumed, or timeout expires
+
+        Args:
+          min_size: number of bytes to wait for
+          timeout: maximum time to wait in seconds, None to wait forever
+
+        Returns:
+            True if min_size bytes are available, False on timeout or at the end of the capture
+        """
+        delay = self.due(min_size)
+        if timeout is not None:
+            delay = min(delay, timeout)
+        if delay > 0:
+            time.sleep(delay)
+        return self.occupancy >= min_size
+
+    def peek(self):
+        """Get a contiguous view of the data received so far without copying or consuming it
+
+        Returns:
+            memoryview of received data, empty if there is none
+        """
+        occupancy = self.occupancy
+        if occupancy > self.high_water:
+            self.high_water = occupancy
+        return super().peek()[:occupancy]
+
+    def consume(self, n):
+        """Release n bytes returned by :method:peek once they have been parsed
+
+        The consumer is running late by how long ago the first of them was received
+        """
+        if n > 0 and self.bytes_consumed < self._end:
+            received = self.arrival_time(self.bytes_consumed + 1) / self.speed
+            self.max_lag = max(self.max_lag, time.monotonic() - self._start - received)
+        super().consume(n)
+
+    def close(self):
+        """Unmap the capture and report how far the consumer fell behind"""
+        super().close()
+        logger.critical("Replay at {}x: backlog high-water mark {} bytes, maximum lag {:.3f} s".format(
+            self.speed, self.high_water, self.max_lag))
@@ -0,0 +1,308 @@
+"""Preallocated ring buffer shared between the serial receive thread and the parser"""
+
+import threading
+import time
+from collections import deque
+
+# What the writer does when the buffer is full
+OVERFLOW_BLOCK = "block"  # Wait for the reader to make room, pushing back on the sender
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # Drop the oldest unread data to make room
+OVERFLOW_DROP_NEWEST = "drop_newest"  # Drop the data that doesn't fit
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class RingBuffer(object):
+    """Fixed-size byte ring buffer with a single writer and a single reader.
+
+    The writer reads straight into free space (e.g. with readinto on :method:writable) and then commits it. The reader
+    takes contiguous memoryviews of unread data with :method:peek and releases them with :method:consume once parsed,
+    blocking in :method:wait until the writer has committed enough data. Data is never copied on the way through except
+    for the first `mirror` bytes of the buffer, which are duplicated after its end so that a packet straddling the wrap
+    point can still be read as one contiguous view.
+
+    The buffer never grows. What happens when it is full is set by policy, see :method:reserve. Every dropped byte is
+    counted, and the position of each gap in the data is kept so that the reader can tell where data is missing:
+    :method:peek never returns data across a gap, and :method:pop_lost returns the size of the gap once the reader has
+    consumed everything before it.
+
+    Args:
+        size: capacity of the buffer in bytes
+        mirror: number of bytes at the start of the buffer that are mirrored after its end
+        policy: one of OVERFLOW_POLICIES
+    """
+
+    def __init__(self, size=1 << 22, mirror=4096, policy=OVERFLOW_DROP_NEWEST):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {}, expected one of {}".format(policy, OVERFLOW_POLICIES))
+        self.size = int(size)
+        self.policy = policy
+        self._mirror = min(int(mirror), self.size)
+        self._buf = bytearray(self.size + self._mirror)
+        self._view = memoryview(self._buf)
+        self._lock = threading.Lock()
+        self._data_ready = threading.Condition(self._lock)
+        self._space_ready = threading.Condition(self._lock)
+        self._held = False  # The reader holds a view returned by peek that it hasn't consumed yet
+        self._losses = deque()  # [stream offset, bytes dropped] of each gap the reader hasn't reached yet
+        self._head = 0  # Total bytes committed by the writer
+        self._tail = 0  # Total bytes consumed by the reader
+        self.high_water = 0
+        self.overruns = 0
+        self.overrun_bytes = 0
+        self.blocked_time = 0
+        self._listeners = []
+
+    @property
+    def occupancy(self):
+        """Number of bytes received but not yet consumed"""
+        return self._head - self._tail
+
+    @property
+    def free(self):
+        """Number of bytes that can be written before the buffer is full"""
+        return self.size - self.occupancy
+
+    def writable(self, max_size):
+        """Get a view of the contiguous free space at the write position
+
+        Args:
+          max_size: maximum size of the returned view
+
+        Returns:
+            memoryview to write into, empty if the buffer is full
+        """
+        with self._lock:
+            pos = self._head % self.size
+            n = min(self.size - (self._head - self._tail), self.size - pos, max_size)
+        return self._view[pos:pos + n]
+
+    def reserve(self, max_size, timeout=None):
+        """Get a view of the contiguous free space at the write position, making room according to the policy
+
+        With OVERFLOW_BLOCK, wait until the reader has made room. With OVERFLOW_DROP_OLDEST, drop the oldest unread data.
+        The data the reader is parsing is never dropped, so wait for it to be consumed first. With OVERFLOW_DROP_NEWEST,
+        don't make room. The writer must still read whatever the view can't hold and report it with :method:overrun.
+
+        Args:
+          max_size: maximum size of the returned view
+          timeout: maximum time in seconds to wait for room
+
+        Returns:
+            memoryview to write into, empty if the buffer is still full
+        """
+        with self._lock:
+            if self._head - self._tail >= self.size:
+                if self.policy == OVERFLOW_BLOCK:
+                    start = time.monotonic()
+                    self._space_ready.wait_for(lambda: self._head - self._tail < self.size, timeout)
+                    self.blocked_time += time.monotonic() - start
+                elif self.policy == OVERFLOW_DROP_OLDEST:
+                    if self._space_ready.wait_for(lambda: not self._held, timeout):
+                        # Drop at least 1/16th of the buffer, so that it isn't done for every read
+                        self._drop_oldest(min(max(max_size, self.size >> 4), self._head - self._tail))
+            pos = self._head % self.size
+            n = min(self.size - (self._head - self._tail), self.size - pos, max_size)
+        return self._view[pos:pos + n]
+
+    def _drop_oldest(self, n):
+        """Drop n bytes of unread data from the start. Must be called with the lock held"""
+        self._tail += n
+        self.overruns += 1
+        self.overrun_bytes += n
+        # Gaps in the dropped data become part of the new one
+        while self._losses and self._losses[0][0] <= self._tail:
+            n += self._losses.popleft()[1]
+        self._losses.appendleft([self._tail, n])
+
+    def commit(self, n):
+        """Publish n bytes written into the view returned by :method:writable"""
+        if n <= 0:
+            return
+        pos = self._head % self.size
+        # Keep the mirror after the end of the buffer in sync with its start
+        if pos < self._mirror:
+            end = min(pos + n, self._mirror)
+            self._buf[self.size + pos:self.size + end] = self._view[pos:end]
+        with self._lock:
+            self._head += n
+            occupancy = self._head - self._tail
+            self._data_ready.notify_all()
+        for event in self._listeners:
+            event.set()
+        if occupancy > self.high_water:
+            self.high_water = occupancy
+
+    def overrun(self, n):
+        """Account for n bytes that were dropped because the buffer was full"""
+        if n > 0:
+            with self._lock:
+                if self._losses and self._losses[-1][0] == self._head:
+                    self._losses[-1][1] += n
+                else:
+                    self._losses.append([self._head, n])
+            self.overruns += 1
+            self.overrun_bytes += n
+
+    def next_loss(self):
+        """Get the number of unread bytes before the next gap in the data
+
+        Returns:
+            number of bytes, or None if no data is missing
+        """
+        with self._lock:
+            return self._losses[0][0] - self._tail if self._losses else None
+
+    def pop_lost(self):
+        """Get the size of the gap the reader has reached, once everything before it has been consumed
+
+        Returns:
+            number of bytes dropped at the read position, 0 if none
+        """
+        with self._lock:
+            if self._losses and self._losses[0][0] <= self._tail:
+                return self._losses.popleft()[1]
+        return 0
+
+    def add_listener(self, event):
+        """Also set a threading.Event on every commit, so one reader can wait on several buffers at once"""
+        self._listeners.append(event)
+
+    def remove_listener(self, event):
+        """Stop setting an event added with :method:add_listener, if it was"""
+        # Replaced rather than changed, so that a commit going through the listeners meanwhile isn't disturbed
+        self._listeners = [x for x in self._listeners if x is not event]
+
+    def wait(self, min_size, timeout=None):
+        """Block until at least min_size bytes are unread or timeout expires
+
+        Args:
+          min_size: number of unread bytes to wait for
+          timeout: maximum time to wait in seconds, None to wait forever
+
+        Returns:
+            True if min_size bytes are available, False on timeout
+        """
+        with self._lock:
+            return self._data_ready.wait_for(lambda: self._head - self._tail >= min_size, timeout)
+
+    def peek(self):
+        """Get a contiguous view of unread data without consuming it
+
+        The view may be shorter than :property:occupancy when the data wraps around the end of the buffer. The rest
+        becomes available once the returned data has been consumed.
+
+        The view also ends at the next gap in the data, see :method:next_loss. It stays valid until :method:consume is
+        called, even with OVERFLOW_DROP_OLDEST.
+
+        Returns:
+            memoryview of unread data, empty if there is none
+        """
+        with self._lock:
+            pos = self._tail % self.size
+            n = min(self._head - self._tail, self.size + self._mirror - pos)
+            if self._losses:
+                n = min(n, self._losses[0][0] - self._tail)
+            self._held = n > 0
+        return self._view[pos:pos + n]
+
+    def consume(self, n):
+        """Release n bytes from the start of the unread data, and the view returned by :method:peek"""
+        with self._lock:
+            if n > 0:
+                self._tail += min(n, self._head - self._tail)
+            self._held = False
+            self._space_ready.notify_all()
+
+    def __len__(self):
+        return self.occupancy
+
+
+class RingRx(object):
+    """Base for receivers that fill a RingBuffer from a receive thread
+
+    Subclasses create self.ring and the thread that writes to it. Received data can be read without copying with peek /
+    consume, or as bytes with receive. wait blocks the reader until enough data has arrived.
+    """
+
+    eof = False  # Set once no more data will be received
+
+    def wait(self, min_size=1, timeout=None):
+        """Block until at least min_size bytes have been received and not consumed, or timeout expires
+
+        Args:
+          min_size: number of bytes to wait for
+          timeout: maximum time to wait in seconds, None to wait forever
+
+        Returns:
+            True if min_size bytes are available, False on timeout
+        """
+        return self.ring.wait(min_size, timeout)
+
+    def due(self, min_size=1):
+        """Data arrives whenever it is received, so it is never due at a known time
+
+        Returns:
+            None
+        """
+        return None
+
+    def notify(self, event):
+        """Set a threading.Event whenever data is received, to wait on several receivers at once"""
+        self.ring.add_listener(event)
+
+    def unnotify(self, event):
+        """Stop setting an event passed to :method:notify"""
+        self.ring.remove_listener(event)
+
+    def peek(self):
+        """Get a contiguous view of received data without copying or consuming it
+
+        Returns:
+            memoryview of received data, empty if there is none
+        """
+        return self.ring.peek()
+
+    def consume(self, n):
+        """Release n bytes returned by :method:peek once they have been parsed"""
+        self.ring.consume(n)
+
+    def next_loss(self):
+        """Number of unconsumed bytes before the next gap where received data was dropped, None if there is none"""
+        return self.ring.next_loss()
+
+    def pop_lost(self):
+        """Number of bytes dropped at the read position, 0 if none. See RingBuffer.pop_lost"""
+        return self.ring.pop_lost()
+
+    def receive(self):
+        """Read and consume received data
+
+        Returns:
+            bytes of data or empty bytes
+        """
+        view = self.ring.peek()
+        result = bytes(view)
+        self.ring.consume(len(result))
+        return result
+
+    @property
+    def occupancy(self):
+        """Bytes received but not yet consumed"""
+        return self.ring.occupancy
+
+    @property
+    def high_water(self):
+        """Highest occupancy of the receive buffer so far"""
+        return self.ring.high_water
+
+    @property
+    def overruns(self):
+        """Number of times received data was dropped because the receive buffer was full"""
+        return self.ring.overruns
+
+    def stats(self):
+        """Describe the receive buffer usage for logging"""
+        ring = self.ring
+        return "Receive buffer: size {}, {} policy, high-water mark {}, {} overruns ({} bytes dropped), " \
+               "{:.3f} s blocked".format(ring.size, ring.policy, ring.high_water, ring.overruns, ring.overrun_bytes,
+                                         ring.blocked_time)
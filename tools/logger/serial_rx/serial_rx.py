@@ -1,17 +1,18 @@
 """Class to receive from serial port"""
 
+import os
 import threading
 import time
-import queue
 import serial
 import logging
+from .ring_buffer import RingBuffer, RingRx, OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST
 
 logger = logging.getLogger("Serial Rx")
 
 verbose_rx = 0  # Set to 1 to show received serial data
 
 
-def receive_thread(ser, chunk_size, q, stop_event):
+def receive_thread(ser, chunk_size, ring, stop_event, capture=None):
     """Target thread for SerialRx
     
     Can be stopped with SerialRx.close
@@ -19,49 +20,68 @@ def receive_thread(ser, chunk_size, q, stop_event):
     Args:
       ser: serial instance
       chunk_size: maximum byte size to read for
-      q: output queue, can be read with :method:receive
+      ring: output ring buffer, can be read with :method:SerialRx.peek or :method:SerialRx.receive
       stop_event: used by close() to end this thread
+      capture: optional CaptureWriter that all received bytes are recorded to
 
     Returns:
 
     """
+    # Used to keep draining the serial port when the ring buffer is full
+    scratch = memoryview(bytearray(chunk_size))
     while not stop_event.is_set():
-        # Read chunk bytes at a time or until read times out
-        buf = ser.read(size=chunk_size)
+        # Read whatever is already waiting, up to chunk bytes. If nothing is, block for the first byte until the read
+        # times out so that data is published as soon as it arrives
+        size = min(max(ser.in_waiting, 1), chunk_size)
+        view = ring.reserve(size, ser.timeout)
+        buffered = len(view) > 0
+        if not buffered:
+            if ring.policy == OVERFLOW_BLOCK:
+                continue  # Leave the data in the port until the parser makes room
+            # No room left: keep draining the port into scratch, then drop the data and count it
+            view = scratch[:size]
+        n = ser.readinto(view)
         # If there was data
-        if len(buf) > 0:
-            # Enqueue read buffer
-            if verbose_rx:
-                logger.debug("SERIAL Stream of size %d:" % len(buf) + "".join(["0x%x " % i for i in buf]))
-            # Put on output queue
-            try:
-                q.put(buf)
-            except Exception as e:
-                logger.error(e)
-        time.sleep(0.001)
+        if n:
+            # Record even what could not be buffered
+            if capture is not None:
+                capture.write(view[:n].tobytes(), time.time())
+            if not buffered:
+                ring.overrun(n)
+            else:
+                if verbose_rx:
+                    logger.debug("SERIAL Stream of size %d:" % n + "".join(["0x%x " % i for i in view[:n]]))
+                # Publish to the parser, waking it up
+                ring.commit(n)
 
 
-class SerialRx(object):
+class SerialRx(RingRx):
     """Create a thread to receive from serial port.
     
-    Reads for timeout or chunk_size, whichever happens first, then places received data on queue which can be read
-    with receive
+    Reads whatever has arrived, up to chunk_size, straight into a preallocated ring buffer as soon as it arrives.
+    Received data can be read without copying with peek / consume, or as bytes with receive. wait blocks the reader
+    until enough data has arrived
 
     Args:
         port: port to receive on, for win: COM54, for mac: /dev/tty.usbmodemXXX
         baud: baud rate
-        timeout: maximum time to read before placing data on output queue
-        chunk_size: maximum bytes to read before placing data on output queue
+        timeout: maximum time to block on a serial read, which is how long close() may take to stop the thread
+        chunk_size: maximum bytes to read at once
         parity: parity (from serial module)
         stopbits: stopbits (from serial module)
         bytesize: bytesize (from serial module)
+        buffer_size: size of the receive ring buffer in bytes
+        capture: optional CaptureWriter that all received bytes are recorded to. It is not closed by close()
+        overflow: what to do when the receive buffer is full, one of OVERFLOW_POLICIES. Blocking leaves the data to the
+          serial driver, which drops it silently once its own buffer is full
     """
 
     def __init__(self, port, baud=12000000, timeout=0.2, chunk_size=1000, parity=serial.PARITY_NONE,
-                 stopbits=serial.STOPBITS_ONE, bytesize=serial.EIGHTBITS):
+                 stopbits=serial.STOPBITS_ONE, bytesize=serial.EIGHTBITS, buffer_size=1 << 22,
+                 capture=None, overflow=OVERFLOW_DROP_NEWEST):
         self.timeout = timeout
-        # Check port path for corner case
-        if (port[0] != '\\') and ('/dev' not in port):
+        # Use the device namespace on Windows so that ports above COM9 can be opened
+        if os.name == 'nt' and not port.startswith('\\'):
             port = '\\\\.\\' + port
         # Open serial port
         self._ser = serial.Serial(port=port, baudrate=baud, timeout=timeout, parity=parity, stopbits=stopbits,
@@ -73,25 +93,12 @@ class SerialRx(object):
         logger.critical("Serial port opened")
         # Create and start receive thread
         self._stop_event = threading.Event()
-        self._rxq = queue.Queue()
+        self.ring = RingBuffer(buffer_size, policy=overflow)
         self._rx_thread = threading.Thread(target=receive_thread,
-                                           args=(self._ser, chunk_size, self._rxq, self._stop_event))
+                                           args=(self._ser, chunk_size, self.ring, self._stop_event, capture))
         self._rx_thread.daemon = True
         self._rx_thread.start()
 
-    def receive(self):
-        """Try to read received data from internal queue
-
-        Returns:
-            bytes of data or empty bytes
-        """
-        try:
-            result = self._rxq.get(block=False)
-        except queue.Empty:
-            return bytes()
-        else:
-            return result
-
     def close(self):
         """Stop the receive thread and close the serial port"""
         # Stop thread
@@ -101,3 +108,4 @@ class SerialRx(object):
         # Close serial port
         logger.critical("Closing serial port")
         self._ser.close()
+        logger.critical(self.stats())
@@ -8,7 +8,6 @@ import os
 import logging
 import argparse
 from . import SerialRx
-import time
 
 ######################################################
 ###  MAIN  ##################
@@ -61,11 +60,10 @@ if __name__ == '__main__':
     # Continuously receive and display until keyboard interrupt
     try:
         while True:
-            buf = serial_rx.receive()
-            if len(buf) == 0:
+            if not serial_rx.wait(1, 0.3):
                 logger.debug("No data received")
-                time.sleep(0.3)
             else:
+                buf = serial_rx.receive()
                 logger.info("%d bytes received\n " % len(buf) + " ".join("{0:#0{1}x}".format(x, 4) for x in buf))
     except Exception as e:
         logger.error(e)
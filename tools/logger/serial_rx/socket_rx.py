@@ -0,0 +1,101 @@
+"""Class to receive from a stream socket in place of a serial port"""
+
+import socket
+import threading
+import time
+import logging
+from .ring_buffer import RingBuffer, RingRx, OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST
+
+logger = logging.getLogger("Socket Rx")
+
+
+def socket_receive_thread(sock, chunk_size, ring, stop_event, eof_event, capture=None):
+    """Target thread for SocketRx
+
+    Can be stopped with SocketRx.close. Stops by itself when the peer closes the connection
+
+    Args:
+      sock: connected socket with a timeout set
+      chunk_size: maximum byte size to read for
+      ring: output ring buffer, can be read with :method:SocketRx.peek or :method:SocketRx.receive
+      stop_event: used by close() to end this thread
+      eof_event: set when the peer has closed the connection
+      capture: optional CaptureWriter that all received bytes are recorded to
+    """
+    # Used to keep draining the socket when the ring buffer is full
+    scratch = memoryview(bytearray(chunk_size))
+    while not stop_event.is_set():
+        view = ring.reserve(chunk_size, sock.gettimeout())
+        buffered = len(view) > 0
+        if not buffered:
+            if ring.policy == OVERFLOW_BLOCK:
+                continue  # Stop reading so that TCP flow control slows down the sender
+            # No room left: keep draining the socket into scratch, then drop the data and count it
+            view = scratch
+        try:
+            # Returns as soon as anything has arrived, with as much as has arrived
+            n = sock.recv_into(view)
+        except socket.timeout:
+            continue
+        except OSError as e:
+            logger.error("Socket receive failed: " + str(e))
+            break
+        if n == 0:
+            logger.critical("Connection closed by peer")
+            break
+        if capture is not None:
+            capture.write(view[:n].tobytes(), time.time())
+        if not buffered:
+            ring.overrun(n)
+        else:
+            ring.commit(n)
+    eof_event.set()
+
+
+class SocketRx(RingRx):
+    """Create a thread to receive from a TCP or UNIX domain stream socket, such as a probe server.
+
+    Works like SerialRx: each recv_into reads as much as has arrived, up to chunk_size, straight into the ring buffer.
+
+    Args:
+        address: (host, port) for TCP or a path for a UNIX domain socket
+        family: socket.AF_INET, socket.AF_INET6 or socket.AF_UNIX
+        timeout: maximum time to block on a receive, which is how long close() may take to stop the thread
+        chunk_size: maximum bytes to read at once
+        buffer_size: size of the receive ring buffer in bytes
+        capture: optional CaptureWriter that all received bytes are recorded to. It is not closed by close()
+        overflow: what to do when the receive buffer is full, one of OVERFLOW_POLICIES
+    """
+
+    def __init__(self, address, family=socket.AF_INET, timeout=0.2, chunk_size=1 << 18, buffer_size=1 << 22,
+                 capture=None, overflow=OVERFLOW_DROP_NEWEST):
+        self.timeout = timeout
+        self.address = address
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, chunk_size)
+        self._sock.connect(address)
+        self._sock.settimeout(timeout)
+        logger.critical("Connected to {}".format(address))
+        # Create and start receive thread
+        self._stop_event = threading.Event()
+        self._eof_event = threading.Event()
+        self.ring = RingBuffer(buffer_size, policy=overflow)
+        self._rx_thread = threading.Thread(target=socket_receive_thread,
+                                           args=(self._sock, chunk_size, self.ring, self._stop_event,
+                                                 self._eof_event, capture))
+        self._rx_thread.daemon = True
+        self._rx_thread.start()
+
+    @property
+    def eof(self):
+        """True once the peer has closed the connection"""
+        return self._eof_event.is_set()
+
+    def close(self):
+        """Stop the receive thread and close the socket"""
+        logger.critical("Stopping socket thread")
+        self._stop_event.set()
+        self._rx_thread.join()
+        logger.critical("Closing socket")
+        self._sock.close()
+        logger.critical(self.stats())
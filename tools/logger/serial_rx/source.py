@@ -0,0 +1,50 @@
+"""Open a byte source by name"""
+
+import socket
+from .serial_rx import SerialRx
+from .file_rx import FileRx
+from .replay_rx import ReplayRx
+from .socket_rx import SocketRx
+from .tpiu_rx import TPIURx
+
+FILE_PREFIX = "file:"
+TCP_PREFIX = "tcp:"
+UNIX_PREFIX = "unix:"
+
+
+def open_source(port, speed=None, **kwargs):
+    """Open the byte source named by port
+
+    Args:
+      port: a serial port (for win: COM54, for mac: /dev/tty.usbmodemXXX), file:PATH to read back a capture
+        recorded with CaptureWriter or any raw file, tcp:HOST:PORT to connect to a TCP stream, or unix:PATH to
+        connect to a UNIX domain stream socket
+      speed: for file:PATH, None to read at maximum speed, otherwise replay at this multiple of the recorded pace
+      kwargs: passed on to SerialRx when opening a serial port. buffer_size, capture and overflow are also used by
+        sockets.
+        For a capture, baud gives the time of the data in captures without an index.
+        tpiu is the trace source ID to deframe from TPIU formatter frames, None if the data is raw ITM
+
+    Returns:
+        SerialRx, FileRx, ReplayRx or SocketRx, wrapped in TPIURx with tpiu
+    """
+    tpiu = kwargs.pop("tpiu", None)
+    source = _open_source(port, speed, **kwargs)
+    return source if tpiu is None else TPIURx(source, tpiu)
+
+
+def _open_source(port, speed=None, **kwargs):
+    """Open the byte source named by port, see :func:open_source"""
+    if port.startswith(FILE_PREFIX):
+        # Serial data takes 10 bits per byte with a start and stop bit
+        rate = kwargs.get("baud", 12000000) / 10
+        if speed is None:
+            return FileRx(port[len(FILE_PREFIX):], rate=rate)
+        return ReplayRx(port[len(FILE_PREFIX):], speed, rate=rate)
+    socket_kwargs = {k: v for k, v in kwargs.items() if k in ("buffer_size", "capture", "overflow")}
+    if port.startswith(TCP_PREFIX):
+        host, _, tcp_port = port[len(TCP_PREFIX):].rpartition(":")
+        return SocketRx((host or "localhost", int(tcp_port)), socket.AF_INET, **socket_kwargs)
+    if port.startswith(UNIX_PREFIX):
+        return SocketRx(port[len(UNIX_PREFIX):], socket.AF_UNIX, **socket_kwargs)
+    return SerialRx(port, **kwargs)
@@ -0,0 +1,46 @@
+"""Tests of ReplayRx pacing and lag tracking"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from serial_rx.replay_rx import ReplayRx
+
+
+class ReplayLagTest(unittest.TestCase):
+    """How far behind the consumer of a paced replay falls"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "capture.bin")
+        with open(self.path, "wb") as f:
+            f.write(bytes(range(256)) * 8)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_slow_consumer_lags(self):
+        # 2048 bytes at 20 kB/s are all received after about 0.1 s, and only read after 0.3 s
+        source = ReplayRx(self.path, rate=20000)
+        time.sleep(0.3)
+        buf = source.peek()
+        source.consume(len(buf))
+        del buf
+        source.close()
+        self.assertGreater(source.max_lag, 0.2)
+
+    def test_consumer_keeping_up_doesnt_lag(self):
+        source = ReplayRx(self.path, rate=20000)
+        while not source.eof or source.occupancy:
+            source.wait(256, 0.05)
+            buf = source.peek()
+            source.consume(len(buf))
+            del buf
+        source.close()
+        self.assertLess(source.max_lag, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Read the ITM data of a byte source that delivers it in TPIU formatter frames"""
+
+import logging
+from itm.tpiu import TPIUDeframer, TPIU_FRAME_SIZE, TPIU_PAYLOAD_SIZE
+
+logger = logging.getLogger("TPIU Rx")
+
+
+class TPIURx(object):
+    """Deframe the data of one trace source ID from another byte source
+
+    Has the same interface as the byte source it wraps, so the rest of the pipeline reads raw ITM data as usual. Data
+    is deframed as it is peeked, and the data of other source IDs is dropped. Gaps in the wrapped source lose frame
+    alignment, so they are reported together with what is discarded until the next synchronization packet.
+
+    Args:
+        source: byte source delivering TPIU formatter frames, such as SerialRx, FileRx or SocketRx
+        trace_id: source ID of the ITM data, set in the TRCENA ATB ID of the device
+        synced: True if the source starts on a frame boundary, False to wait for a synchronization packet
+    """
+
+    def __init__(self, source, trace_id=1, synced=False):
+        self.source = source
+        self.trace_id = trace_id
+        self._deframer = TPIUDeframer(synced)
+        self._out = bytearray()
+        self._pos = 0
+        self._loss_at = None  # Position in _out of a gap in the data
+        self._lost = 0
+        self.other_bytes = 0  # Data of other source IDs
+
+    @property
+    def timeout(self):
+        return self.source.timeout
+
+    def _pull(self):
+        """Deframe whatever the wrapped source has received"""
+        if self._loss_at is not None:
+            return  # Hold new data back until the gap has been reported
+        view = self.source.peek()
+        if len(view) < TPIU_FRAME_SIZE and self.source.next_loss() is None:
+            return
+        discarded = self._deframer.discarded
+        out, consumed = self._deframer.deframe(view)
+        gap = self.source.next_loss()
+        if gap is not None and gap <= len(view):
+            # Whatever is left before the gap can't be completed by what comes after it
+            consumed = len(view)
+            self._deframer.reset()
+        del view
+        self.source.consume(consumed)
+        data = out.pop(self.trace_id, bytes())
+        for other in out.values():
+            self.other_bytes += len(other)
+        # Drop what was consumed in place, so that a slow consumer doesn't copy what it left over and over
+        try:
+            del self._out[:self._pos]
+            self._out += data
+        except BufferError:
+            # A view returned by peek is still held, so it must not move
+            self._out = self._out[self._pos:] + data
+        self._pos = 0
+        lost = self.source.pop_lost() + self._deframer.discarded - discarded
+        if lost:
+            self._lost += lost
+            self._loss_at = len(self._out)
+
+    @property
+    def eof(self):
+        """True once the wrapped source is done and no whole frame is left in it"""
+        self._pull()
+        return self.source.eof and self.source.occupancy < TPIU_FRAME_SIZE
+
+    @property
+    def occupancy(self):
+        """Deframed bytes not yet consumed"""
+        self._pull()
+        return len(self._out) - self._pos
+
+    def due(self, min_size=1):
+        """See the wrapped source, counting frames needed for min_size deframed bytes"""
+        return self.source.due(self._raw_size(min_size))
+
+    def _raw_size(self, min_size):
+        """Number of bytes the wrapped source needs to have received to hold min_size deframed bytes"""
+        missing = min_size - (len(self._out) - self._pos)
+        return self.source.occupancy + max(0, -(-missing // TPIU_PAYLOAD_SIZE) * TPIU_FRAME_SIZE)
+
+    def wait(self, min_size=1, timeout=None):
+        """Block until at least min_size deframed bytes are available, or timeout expires
+
+        Returns:
+            True if min_size bytes are available, False otherwise
+        """
+        if self.occupancy < min_size:
+            self.source.wait(self._raw_size(min_size), timeout)
+        return self.occupancy >= min_size
+
+    def notify(self, event):
+        """Set event whenever the wrapped source receives data"""
+        self.source.notify(event)
+
+    def unnotify(self, event):
+        """Stop setting an event passed to :method:notify"""
+        self.source.unnotify(event)
+
+    def peek(self):
+        """Get a view of the deframed data without consuming it
+
+        Returns:
+            memoryview of the data, which ends at the next gap
+        """
+        self._pull()
+        end = len(self._out) if self._loss_at is None else self._loss_at
+        return memoryview(self._out)[self._pos:end]
+
+    def consume(self, n):
+        """Release n bytes returned by :method:peek once they have been parsed"""
+        self._pos += n
+
+    def next_loss(self):
+        """Number of bytes before the next gap in the deframed data, None if there is none"""
+        return None if self._loss_at is None else self._loss_at - self._pos
+
+    def pop_lost(self):
+        """Get and clear the number of bytes dropped at gaps that have been reached"""
+        if self._loss_at is None or self._pos < self._loss_at:
+            return 0
+        lost = self._lost
+        self._lost = 0
+        self._loss_at = None
+        return lost
+
+    def receive(self):
+        """Read and consume data
+
+        Returns:
+            bytes of data or empty bytes if there is none
+        """
+        result = bytes(self.peek())
+        self.consume(len(result))
+        return result
+
+    def close(self):
+        """Close the wrapped source"""
+        self.source.close()
+        logger.critical("TPIU source ID {}: {} bytes of other IDs dropped, frame alignment lost {} time(s)".format(
+            self.trace_id, self.other_bytes, self._deframer.lost_sync))
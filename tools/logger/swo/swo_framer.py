@@ -10,35 +10,11 @@ from abc import ABC, abstractmethod
 import os
 import sys
 from dataclasses import *
-from itm import ITMOpcode, build_value, ITMStimulusPort
+from itm import ITMOpcode, build_value, ITMStimulusPort, TraceEvent
 from wireshark_output import WSOutputElement, Protofields
 
-VERBOSE_FRAMING = 0  # Display ITM frames and SWO framing information
-VERBOSE_SWO = 0 # If 0, all SWO logging below info is turned off
-
 logger = logging.getLogger("SWO Framer")
 
-class LoggingFilter(logging.Filter):
-    """Implement logging filter"""
-
-    def filter(self, record):
-        """Test whether to filter out message
-
-        Args:
-          record: message to filter on
-
-        Returns:
-          True: display (don't filter)
-          False: don't display (do filter)
-
-        """
-        if not VERBOSE_SWO and record.levelno < 30:
-            return False
-        if not VERBOSE_FRAMING:
-            return not record.getMessage().startswith("FRAMING")
-        else:
-            return True
-
 SWO_SWIT_SIZE = 4
 
 SWO_RESET_TOKEN = bytes([0xBB, 0xBB, 0xBB, 0xBB])
@@ -79,6 +55,7 @@ class SWOOpcode(enum.Enum):
     EVENT_SET = 9
     PC_SAMPLE_TRACE = 10
     RESET = 11
+    DATA_LOST = 12
     EVENT_CREATION = 0xFF
 
 
@@ -103,7 +80,16 @@ class FrameBase(ABC):
 
 
 class FramerBase(ABC):
-    """The base framer that should be inherited by all custom modules"""
+    """
+    The base framer that should be inherited by all custom modules
+
+    Attributes:
+        tracer: itm.Tracer recording framing events, None to not trace
+
+    """
+
+    # Framing events are recorded when a Tracer is set
+    tracer = None
 
     @abstractmethod
     def parse(self, frame):
@@ -136,7 +122,22 @@ class SWOFrame(FrameBase):
     line: str = ""
     level: str = ""
     module: str = ""
-    wireshark_out: list = None
+    _wireshark_out = None
+
+    @property
+    def wireshark_out(self):
+        """Wireshark output, only built the first time it is read since most sinks never do"""
+        if self._wireshark_out is None:
+            self.build_output()
+            # Surround in a tree, unless the frame has no output
+            if self._wireshark_out is not None:
+                self._wireshark_out = [WSOutputElement(Protofields.COMMON_OPEN_TREE, "SWO Logger Frame")] + \
+                                      self._wireshark_out + [WSOutputElement(Protofields.COMMON_CLOSE_TREE)]
+        return self._wireshark_out
+
+    @wireshark_out.setter
+    def wireshark_out(self, value):
+        self._wireshark_out = value
 
     def build_output(self):
         """Build wirshark output"""
@@ -170,6 +171,7 @@ class SWOSoftwareFrame(SWOFrame):
         self.is_event_set = False
         self._trace_db = trace_db
         self.remaining_length = 0
+        self.last_packet = 0  # SWOFramer.sw_packets when the frame last got data
         self._deferred = None
         self._is_event_set = None
         self.string = ""
@@ -203,7 +205,7 @@ class SWOSoftwareFrame(SWOFrame):
         """Base parsing for software frame. Subclassed frames will extend this"""
         # Adjust for special three byte case...discard last byte
         if self.remaining_length == 3:
-            itm_frame.data.pop()
+            itm_frame.data = itm_frame.data[:3]
             itm_frame.size = 3
         # Adjust remaining length
         self.remaining_length -= len(itm_frame)
@@ -228,6 +230,8 @@ class SWOFormattedTextFrame(SWOSoftwareFrame):
 
     """
 
+    _formattable = False  # Values are formatted into the string once they have all been received
+
     def __init__(self, rat_ts_s, rtc_ts_s, rat_ts_t, elf_string, trace_db):
         super().__init__(rat_ts_s, rtc_ts_s, rat_ts_t, elf_string, trace_db)
         self.values = []
@@ -237,10 +241,11 @@ class SWOFormattedTextFrame(SWOSoftwareFrame):
         self.deferred, self.is_event_set, self.file, self.line, self.level, self.module, \
             self.string, self._nargs = elf_string.value.split(":::")
         self._nargs = int(self._nargs)
+        self._formattable = self._nargs == self.string.count("%")
         # Set remaining length
         self.remaining_length = self._nargs * SWO_SWIT_SIZE
         # Alert of formatting error
-        if self._nargs > 1 and self._nargs != self.string.count("%"):
+        if self._nargs > 1 and not self._formattable:
             self.string += "[ARGUMENT MISMATCH]"
         # Expect a one-byte packet to complete header if this is an event set
         if self.is_event_set:
@@ -251,17 +256,30 @@ class SWOFormattedTextFrame(SWOSoftwareFrame):
         """Append value to list of values and format string if complete frame has been received"""
         super().parse(itm_frame)
         if self.parse_state is ParseState.DATA:
-            if self._nargs == self.string.count("%"):
-                # Build 32-bit value and append
+            if self._formattable:
+                # Build 32-bit value and append. The string is formatted when it is first read
                 self.values.append(build_value(itm_frame.data))
-                # Format string if we've received all data
-                if self.remaining_length == 0:
-                    self.string = self.string % (tuple(self.values))
         elif self.parse_state is ParseState.EVENT_SET_INFO:
             self.parse_state = ParseState.DATA
             # Extract record and handle
             self.record, self.handle = itm_frame.data
 
+    @property
+    def string(self):
+        """Text of the frame, formatted with its values once all of them have been received"""
+        if self._formattable and self.values and self.remaining_length == 0:
+            self._formattable = False
+            try:
+                self._string = self._string % tuple(self.values)
+            except (TypeError, ValueError, OverflowError) as e:
+                logger.error("Formatting {!r} failed: {}".format(self._string, e))
+                self._string += "[FORMAT ERROR]"
+        return self._string
+
+    @string.setter
+    def string(self, value):
+        self._string = value
+
     def __str__(self):
         # Indicate if this is an individual record in an event set
         string = "Event Record, " + self.string if self.is_event_set else self.string
@@ -506,6 +524,41 @@ class SWOBufferOverflowFrame(SWOSoftwareFrame):
                               WSOutputElement(Protofields.COMMON_INFO, info)]
 
 
+class SWODataLostFrame(SWOSoftwareFrame):
+    """
+    SWO Data Lost indicating received data was dropped on the host because the receive buffer was full
+
+    Not sent by the device. Built by the host where the gap in the received data is
+
+    Args:
+        rat_ts_s: radio time in seconds
+        rtc_ts_s: real-time-clock in seconds
+        rat_ts_t: radio time in ticks
+        lost_bytes: number of bytes dropped
+
+    """
+
+    def __init__(self, rat_ts_s, rtc_ts_s, rat_ts_t, lost_bytes):
+        super().__init__(rat_ts_s, rtc_ts_s, rat_ts_t)
+        self.opcode = SWOOpcode.DATA_LOST
+        self.lost_bytes = lost_bytes
+        self._output = True
+
+    def __str__(self):
+        return ("WARNING!!! DATA_LOST : RAT: {:.7f} s, RTC: {:.7f} s : {} bytes dropped by host".format(
+            self.rat_ts_s, self.rtc_ts_s, self.lost_bytes))
+
+    def build_output(self):
+        """Build wireshark output"""
+        info = "WARNING!!! DATA_LOST: {} bytes dropped by host".format(self.lost_bytes)
+        self.wireshark_out = [WSOutputElement(Protofields.SWO_RAT_S, self.rat_ts_s),
+                              WSOutputElement(Protofields.SWO_RTC_S, self.rtc_ts_s),
+                              WSOutputElement(Protofields.SWO_RAT_T, self.rat_ts_t),
+                              WSOutputElement(Protofields.SWO_OPCODE, self.opcode.name),
+                              WSOutputElement(Protofields.SWO_INFO, info),
+                              WSOutputElement(Protofields.COMMON_INFO, info)]
+
+
 class SWOWatchpointEnableFrame(SWOSoftwareFrame):
     """
     SWO Watchpoint Enable Frame
@@ -636,7 +689,7 @@ class SWOHWDataFrame(SWOFrame):
 
     def __init__(self, itm_frame, watchpoints, rat_ts_s, rtc_ts_s, rat_ts_t):
         self.opcode = SWOOpcode.HW_DATA_TRACE
-        self.itm_string = str(itm_frame)
+        self.itm_frame = itm_frame
         self.hw_wp_comparator = itm_frame.comparator
         self.wp_string = watchpoints[self.hw_wp_comparator]
         self.output = True
@@ -649,6 +702,11 @@ class SWOHWDataFrame(SWOFrame):
         return ("RAT: {:.7f} s, RTC: {:.7f} s -> {} : {}".format(
             self.rat_ts_s, self.rtc_ts_s, self.wp_string + " : " + self.itm_string, self.opcode.name))
 
+    @property
+    def itm_string(self):
+        """Description of the ITM frame, only built when it is read"""
+        return str(self.itm_frame)
+
     def build_output(self):
         """Build wireshark output"""
         self.wireshark_out = [WSOutputElement(Protofields.SWO_RAT_S, self.rat_ts_s),
@@ -676,7 +734,7 @@ class SWOHWPCSample(SWOFrame):
 
     def __init__(self, itm_frame, db, rat_ts_s, rtc_ts_s, rat_ts_t):
         self.opcode = SWOOpcode.PC_SAMPLE_TRACE
-        self.itm_string = str(itm_frame)
+        self.itm_frame = itm_frame
         self.pc_counter = itm_frame.value
         self.output = True
         self.rat_ts_s = rat_ts_s
@@ -693,6 +751,11 @@ class SWOHWPCSample(SWOFrame):
     def __str__(self):
         return "RAT: {:.7f} s, RTC: {:.7f} s -> {}".format(self.rat_ts_s, self.rtc_ts_s, self.string)
 
+    @property
+    def itm_string(self):
+        """Description of the ITM frame, only built when it is read"""
+        return str(self.itm_frame)
+
     def build_output(self):
         """Build wireshark output"""
         self.wireshark_out = [WSOutputElement(Protofields.SWO_RAT_S, self.rat_ts_s),
@@ -742,6 +805,12 @@ def rat_from_rtc(rtc_s):
     return rat_s, rat_t
 
 
+# A partial immediate frame that gets no data for this many software packets is dropped, since the rest of it was lost
+STALE_PACKETS = 1024
+# Most deferred frames waiting for idle time to send their data. The oldest are dropped beyond it
+MAX_DEFERRED_FRAMES = 256
+
+
 class SWOFramer(FramerBase):
     """
     Manages parsing ITM frames into SWO frames
@@ -755,12 +824,21 @@ class SWOFramer(FramerBase):
         db: trace database
         clock: clock speed of embedded device
 
+    Attributes:
+        sw_packets: number of ITM software packets parsed
+        corrupt_headers: number of SWO headers outside the trace section, which can only come from corrupt data
+        unknown_headers: number of SWO headers in the trace section but not in the trace database, or of an unknown
+            opcode, such as when the elf file doesn't match the device
+        frames_discarded: number of partial frames dropped because the rest of their data was lost
+
     """
 
     def __init__(self, db=None, clock=48000000, baud=12000000):
-        # Set up logging
-        logger.addFilter(LoggingFilter())
         self._trace_db = db
+        # Headers are checked against the addresses of the trace section before looking them up
+        addresses = () if db is None else db.traceDB.keys()
+        self._first_address = min(addresses, default=0)
+        self._last_address = max(addresses, default=-1)
         self._immediate_frames = deque()
         self._deferred_frames = deque()
         self._event_sets = {}
@@ -772,12 +850,35 @@ class SWOFramer(FramerBase):
         self.offset = 0
         self.baudrate = int(baud)
         self.time_sync_state = TimeSyncState.SECONDS
-
+        self.sw_packets = 0
+        self.corrupt_headers = 0
+        self.unknown_headers = 0
+        self.frames_discarded = 0
 
     def enqueue(self, frame, location):
         # Add to appropriate frame queue
         q = self._deferred_frames if frame.deferred and frame.parse_state is ParseState.DATA else self._immediate_frames
         q.append(frame) if location is EnqueueLocation.RIGHT else q.appendleft(frame)
+        # Remember when the frame last got data
+        frame.last_packet = self.sw_packets
+
+    def purge_stale(self):
+        """
+        Drop partial frames whose data was lost
+
+        Only the top immediate frame gets data, so frames below it that got none for STALE_PACKETS packets are never
+        completed. Deferred frames are only dropped when too many of them wait, since they can wait for idle time
+        for long.
+        """
+        while self._immediate_frames and self.sw_packets - self._immediate_frames[0].last_packet > STALE_PACKETS:
+            self._discard(self._immediate_frames.popleft())
+        while len(self._deferred_frames) > MAX_DEFERRED_FRAMES:
+            self._discard(self._deferred_frames.popleft())
+
+    def _discard(self, frame):
+        """Count and trace a partial frame that is dropped"""
+        self.frames_discarded += 1
+        if self.tracer is not None: self.tracer.record(TraceEvent.SWO_STALE_FRAME, frame.opcode)
 
     def parse(self, itm_frame=None):
         """
@@ -794,7 +895,6 @@ class SWOFramer(FramerBase):
 
         """
         try:
-            # logger.debug("FRAMING " + str(itm_frame))
             frame = None
             if itm_frame.opcode == ITMOpcode.TIMESTAMP:
                 # Update running timestamps then discard the frame
@@ -842,27 +942,38 @@ class SWOFramer(FramerBase):
         """
         try:
             frame = None
+            self.sw_packets += 1
             # Check port to see if this is a new frame
             if itm_frame.port == ITMStimulusPort.STIM_HEADER:
+                self.purge_stale()
+                header = build_value(itm_frame.data)
+                # Corrupt headers are rejected without a lookup
+                if not self._first_address <= header <= self._last_address:
+                    self.corrupt_headers += 1
+                    if self.tracer is not None: self.tracer.record(TraceEvent.SWO_CORRUPT_HEADER, header)
+                    return None
                 # Get elf data from header
                 try:
-                    header = build_value(itm_frame.data)
                     elf_string = self._trace_db.traceDB[header]
                 except KeyError:
                     # This address does not exist in the trace database
-                    logger.warning("FRAMING: corruption: no trace database information at {}".format(hex(header)))
+                    self.unknown_headers += 1
+                    if self.tracer is not None: self.tracer.record(TraceEvent.SWO_NO_DB_ENTRY, header)
                     return None
                 # Build new frame
                 try:
                     frame = frame_opcode_dict[elf_string.opcode](self._rat_s + offset, self._rtc_s + offset,
                                                                  self._rat_t, elf_string, self._trace_db)
                 except KeyError:
-                    # Unknown Frame type, print error.
-                    logger.warning('FRAMING: corruption: unknown opcode 0x%x' % elf_string.opcode.value)
+                    # Unknown Frame type
+                    self.unknown_headers += 1
+                    if self.tracer is not None:
+                        self.tracer.record(TraceEvent.SWO_UNKNOWN_OPCODE, elf_string.opcode.value)
                     return None
                 # Add to appropriate queue
                 self.enqueue(frame, EnqueueLocation.RIGHT)
-                logger.debug('FRAMING: New Frame of opcode {}, len {}'.format(frame.opcode.name, frame.remaining_length))
+                if self.tracer is not None:
+                    self.tracer.record(TraceEvent.SWO_NEW_FRAME, frame.opcode, frame.remaining_length)
             elif itm_frame.port == ITMStimulusPort.STIM_IDLE:
                 # Get frame on left of deferred queue
                 frame = self._deferred_frames.popleft()
@@ -876,10 +987,8 @@ class SWOFramer(FramerBase):
                     # Get frame from right of immediate queue
                     frame = self._immediate_frames.pop()
                     frame.parse(itm_frame)
-                    logger.debug(
-                        'FRAMING: {} Continue --> {} bytes received, remaining length: {}'.format(frame.opcode.name,
-                                                                                                  len(itm_frame),
-                                                                                                  frame.remaining_length))
+                    if self.tracer is not None:
+                        self.tracer.record(TraceEvent.SWO_CONTINUE, frame.opcode, frame.remaining_length)
                     # Put back on right of appropriate queue
                     self.enqueue(frame, EnqueueLocation.RIGHT)
                 except Exception as e:
@@ -894,16 +1003,16 @@ class SWOFramer(FramerBase):
                     self._rtc_s = (build_value(itm_frame.data) / (2 ** 32)) + self._rtc_s
                     self._rat_s, self._rat_t = rat_from_rtc(self._rtc_s)
                     self.time_sync_state = TimeSyncState.SECONDS
-                    logger.debug("FRAME_SYNC_TIME       : RTC: {:.7f} s".format(self._rtc_s))
+                    if self.tracer is not None: self.tracer.record(TraceEvent.SWO_SYNC_TIME, self._rtc_s)
 
             elif itm_frame.port == ITMStimulusPort.STIM_DRIVER:
                 if SWO_RESET_TOKEN in itm_frame.data:
                     frame = SWOResetFrame(self._rat_s + offset, self._rtc_s + offset, self._rat_t)
                 elif build_value(itm_frame.data) == 0xCCCCCCCC:
                     frame = SWOBufferOverflowFrame(self._rat_s + offset, self._rtc_s + offset, self._rat_t)
-            else:
-                # Print raw data
-                logger.debug("Raw ITM Data: {}".format(" ".join(["0x{:02x}".format(x) for x in list(reversed(itm_frame.data))])))
+            elif self.tracer is not None:
+                # Keep raw data
+                self.tracer.record(TraceEvent.SWO_RAW_DATA, itm_frame.port, itm_frame.data.hex())
             return frame
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -939,41 +1048,88 @@ class SWOFramer(FramerBase):
                         self._event_sets[swo_frame.handle] = {}
                         self._event_sets[swo_frame.handle][0] = swo_frame
                         # Add to event sets
-                        logger.debug(f"FRAMING: Create event set {swo_frame.handle}")
+                        if self.tracer is not None: self.tracer.record(TraceEvent.SWO_EVENT_SET_START, swo_frame.handle)
                     else:
                         self._event_sets[swo_frame.handle][swo_frame.record + 1] = swo_frame
-                        logger.debug(f"FRAMING: Store record {swo_frame.record} of event set {swo_frame.handle}")
+                        if self.tracer is not None:
+                            self.tracer.record(TraceEvent.SWO_EVENT_SET_RECORD, swo_frame.handle, swo_frame.record)
             # Update watchpoint dict if this frame is enabling a watchpoint
             elif swo_frame.opcode == SWOOpcode.WATCHPOINT:
                 # Store in watchpoint list. Concatenate string passed at enable call with access type string
                 self._watchpoints[swo_frame.watchpoint] = swo_frame.wp_string + " (" + swo_frame.function + ")"
             # Remove frame from deferred queue that corresponds to the overflow
             elif swo_frame.opcode == SWOOpcode.BUFFER_OVERFLOW:
-                self._deferred_frames.pop()
+                self._discard(self._deferred_frames.pop())
 
             # Remove frame from queue
             if itm_frame.port in [ITMStimulusPort.STIM_TRACE, ITMStimulusPort.STIM_HEADER, ITMStimulusPort.STIM_IDLE]:
-                logger.debug("FRAMING: Deleting SWO frame of opcode: %s" % swo_frame.opcode.name)
+                if self.tracer is not None: self.tracer.record(TraceEvent.SWO_DELETE, swo_frame.opcode)
                 self._deferred_frames.popleft() if swo_frame.deferred else self._immediate_frames.pop()
 
-            # Display frame
-            logger.info(str(swo_frame))
+            # Trace frame
+            if self.tracer is not None: self.tracer.record(TraceEvent.SWO_FRAME, swo_frame)
             return swo_frame
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             logger.error("{} @ {} {}: ".format(exc_type, fname, exc_tb.tb_lineno) + str(e))
 
+    def data_lost(self, lost_bytes):
+        """
+        Handle a gap in the received data
+
+        Frames still being built when the data was dropped can't be completed, so they are discarded.
+
+        Args:
+          lost_bytes: number of bytes dropped
+
+        Returns:
+            SWODataLostFrame to output in place of the lost data
+
+        """
+        discarded = len(self._immediate_frames) + len(self._deferred_frames)
+        if discarded:
+            logger.warning("Discarding {} incomplete frame(s) after {} bytes were lost".format(discarded, lost_bytes))
+            self.frames_discarded += discarded
+        self._immediate_frames.clear()
+        self._deferred_frames.clear()
+        self._event_sets = {}
+        return self.completed(SWODataLostFrame(self._rat_s + self.offset, self._rtc_s + self.offset, self._rat_t,
+                                               lost_bytes))
+
+    @property
+    def rtc_s(self):
+        """Real-time clock of the last timestamp, in seconds"""
+        return self._rtc_s
+
+    @property
+    def time_synced(self):
+        """True unless only the seconds of a time sync have been received so far"""
+        return self.time_sync_state is TimeSyncState.SECONDS
+
+    def resume(self, rtc_s, offset=0):
+        """
+        Continue parsing from another point in the stream
+
+        Frames that were being built are discarded, since the rest of their data is not coming.
+
+        Args:
+          rtc_s: real-time clock of the last timestamp before that point, in seconds
+          offset: time the packets since that timestamp add to it, in seconds
+
+        """
+        self._immediate_frames.clear()
+        self._deferred_frames.clear()
+        self._event_sets = {}
+        self._rtc_s = rtc_s
+        self._rat_s, self._rat_t = rat_from_rtc(rtc_s)
+        self.offset = offset
+        self.time_sync_state = TimeSyncState.SECONDS
+
     def reset(self):
         """Handle reset frame."""
         pass
 
     def completed(self, frame):
-        """Build wireshark output"""
-        # Build wireshark formatting and surround in a tree
-        frame.build_output()
-        if frame.wireshark_out is not None:
-            frame.wireshark_out = [WSOutputElement(Protofields.COMMON_OPEN_TREE, "SWO Logger Frame")] + \
-                                  frame.wireshark_out + [WSOutputElement(Protofields.COMMON_CLOSE_TREE)]
-
+        """Finish a frame. Its wireshark output is built when a sink first reads it"""
         return frame
@@ -0,0 +1 @@
+from .swol import decode
\ No newline at end of file
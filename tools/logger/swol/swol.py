@@ -0,0 +1,92 @@
+"""
+Decode SWO logs from scripts and notebooks
+
+    import swol
+    for frame in swol.decode("file:capture.bin", elf="app.out"):
+        print(frame)
+
+decode runs the same Pipeline as logger.py, a batch of bytes at a time, and yields the output frames as they are
+decoded. Only one batch of frames is held at a time, so arbitrarily long captures and live streams decode in bounded
+memory, and stopping the loop early stops reading.
+"""
+
+import threading
+import logging
+from concurrent.futures import Future
+
+from pipeline import Pipeline, seek_time
+from serial_rx import open_source
+from trace_db import load_trace_db
+
+logger = logging.getLogger("SWOL")
+
+
+def decode(source, elf=None, db=None, sdk_path="", clock=48000000, modules=None, packet_filter=None, tracer=None,
+           raw_channels=None, start=None, end=None, min_batch=256, max_wait=0.01, batch_size=1 << 16, **kwargs):
+    """
+    Decode a stream into output frames, lazily
+
+    The trace database is built in the background right away. A source given as a port is opened once iteration starts,
+    so that a live stream is buffered while the database is still being built, and closed when the generator is done
+    or closed. Nothing is opened by a generator that is never iterated. A source object is left open.
+
+    Args:
+      source: byte source such as SerialRx or FileRx, or a port to open with serial_rx.open_source such as
+        file:PATH, tcp:HOST:PORT or COM54
+      elf: elf file running on the device, to build the trace database from
+      db: TraceDB to use instead of building one from elf, such as one shared by several calls
+      sdk_path: path to the SDK. Used to pick up ROM symbols
+      clock: clock speed of the embedded processor in Hz
+      modules: dict of module parsers keyed by SWO module name, see :class:pipeline.Pipeline
+      packet_filter: ITMFilter of the ITM packets to decode, None for all
+      tracer: itm.Tracer recording framing events, None to not trace
+      raw_channels: itm.RawChannels to stream the samples of raw stimulus ports to, None to decode them as frames
+      start: only decode a capture from this many seconds after its start, see :func:pipeline.seek_time
+      end: stop decoding a capture this many seconds after its start
+      min_batch: number of new bytes to wait for before parsing. Lower for latency
+      max_wait: maximum time in seconds to wait for min_batch bytes before parsing what has arrived
+      batch_size: maximum number of bytes parsed at a time, which bounds the number of frames held
+      kwargs: passed on to serial_rx.open_source when source is a port, such as baud, speed or tpiu
+
+    Returns:
+        generator of output frames in order: module frames, SWO frames, and SWODataLostFrame where data was dropped
+
+    """
+    if elf is None and db is None:
+        raise ValueError("decode needs the elf file running on the device, or its TraceDB")
+    if db is None:
+        db = load_trace_db(elf, sdk_path)
+    return _frames(source, kwargs, db, clock, modules, packet_filter, tracer, raw_channels, start, end, min_batch,
+                   max_wait, batch_size)
+
+
+def _frames(source, kwargs, db, clock, modules, packet_filter, tracer, raw_channels, start, end, min_batch, max_wait,
+            batch_size):
+    """Generator of :func:decode, which owns the source it opens from a port"""
+    owned = isinstance(source, str)
+    if owned:
+        source = open_source(source, **kwargs)
+    data_event = threading.Event()
+    try:
+        source.notify(data_event)
+        # Wait for a database still being built
+        if isinstance(db, Future):
+            if not db.done():
+                logger.critical("Buffering until the trace database is ready")
+            db = db.result()
+        pipeline = Pipeline(source, db, clock, modules=modules, packet_filter=packet_filter, tracer=tracer,
+                            raw_channels=raw_channels)
+        if start is not None or end is not None:
+            seek_time(pipeline, start, end)
+        while not pipeline.done:
+            # Clear before checking so that data arriving meanwhile still wakes us up
+            data_event.clear()
+            if pipeline.ready(min_batch, max_wait):
+                yield from pipeline.process(batch_size)
+            else:
+                pipeline.tick()
+                data_event.wait(max_wait)
+    finally:
+        source.unnotify(data_event)
+        if owned:
+            source.close()
@@ -1,2 +1,3 @@
 from .trace_db import TraceDB
 from .trace_db import ElfString
+from .trace_db import load_trace_db
\ No newline at end of file
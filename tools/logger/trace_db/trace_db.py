@@ -5,6 +5,8 @@ import logging
 import pickle
 import hashlib
 import json
+import threading
+from concurrent.futures import Future
 from appdirs import AppDirs
 from swo.swo_framer import SWOOpcode
 
@@ -28,6 +30,9 @@ logger = logging.getLogger("TraceDB")
 TRACE_BASE_ADDR = 0x60000000
 TRACE_SECTION_NAME = ".swo_trace"
 
+# Databases are cached in the same files whatever the elf, so only build one at a time
+_build_lock = threading.Lock()
+
 
 class ElfString:
     def __init__(self, value):
@@ -333,3 +338,36 @@ class TraceDB:
 
     def get_elf_string(self, addr_offset):
         return self.traceDB[hex(TRACE_BASE_ADDR + addr_offset)]
+
+
+def load_trace_db(elf, sdk_path=""):
+    """
+    Build a TraceDB in a background thread
+
+    Building from a cold cache parses the DWARF information of the elf and the ROM elf files, which can take tens of
+    seconds. Use this to keep receiving meanwhile.
+
+    Args:
+        elf: elf file where the trace strings need to be extracted from
+        sdk_path: path to the SDK. Used to pick up ROM symbols
+
+    Returns:
+        concurrent.futures.Future of the TraceDB
+
+    """
+    future = Future()
+
+    def build():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with _build_lock:
+                future.set_result(TraceDB(elf, sdk_path))
+        except Exception as e:
+            future.set_exception(e)
+
+    # Daemon so that exiting doesn't wait for a build nobody needs anymore
+    thread = threading.Thread(target=build)
+    thread.daemon = True
+    thread.start()
+    return future
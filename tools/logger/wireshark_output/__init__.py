@@ -2,5 +2,13 @@ from .wireshark_output import WSOutputElement
 from .wireshark_output import Protofields
 from .wireshark_output import gandelf_send_data
 from .wireshark_output import gandelf_send_message
+from .wireshark_output import wlogger_send_data
+from .wireshark_output import wlogger_send_message
 from .wireshark_output import pipe_open
-from .wireshark_output import pipe_close
\ No newline at end of file
+from .wireshark_output import pipe_close
+from .wireshark_output import gandelf_encode
+from .wireshark_output import gandelf_message
+from .wireshark_output import wlogger_encode
+from .wireshark_output import wlogger_message
+from .async_output import AsyncGandelfSink
+from .async_output import AsyncWloggerSink
\ No newline at end of file
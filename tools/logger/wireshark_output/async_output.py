@@ -0,0 +1,118 @@
+"""Send wireshark data from an asyncio event loop, without blocking it"""
+
+import os
+import json
+import asyncio
+import logging
+from .wireshark_output import gandelf_encode, gandelf_message, wlogger_encode, wlogger_message
+from . import wlogger_plugin
+
+logger = logging.getLogger('wireshark_output')
+
+
+async def open_pipe(pipe_name):
+    """
+    Connect to a Gandelf pipe
+
+    Args:
+        pipe_name: Windows named pipe, or UNIX domain socket path elsewhere
+
+    Returns:
+        asyncio.StreamWriter to the pipe
+
+    """
+    if os.name == 'nt':
+        # Named pipes need the proactor event loop, the default on Windows
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, protocol = await loop.create_pipe_connection(lambda: asyncio.StreamReaderProtocol(reader),
+                                                                pipe_name)
+        return asyncio.StreamWriter(transport, protocol, reader, loop)
+    _, writer = await asyncio.open_unix_connection(pipe_name)
+    return writer
+
+
+class AsyncGandelfSink(object):
+    """
+    Send frames to the Gandelf pipe
+
+    Replaces pipe_send_data, which runs the pyuv loop to completion for every write. Writes are buffered by the event
+    loop and send_data only waits when the pipe is backed up.
+
+    Args:
+        pipe_name: name of GUI pipe to send data to
+
+    """
+
+    def __init__(self, pipe_name):
+        self.pipe_name = pipe_name
+        self._writer = None
+
+    async def open(self):
+        logger.info('Connecting to pipe')
+        self._writer = await open_pipe(self.pipe_name)
+        logger.info('Pipe connected')
+
+    async def send_data(self, stream_id, frame):
+        """
+        Send data to wireshark to be parsed into protofields
+
+        Args:
+          stream_id: identifier on wireshark output of logger's stream
+          frame: list of WSOutputElement
+
+        """
+        self._writer.write(gandelf_encode(frame))
+        await self._writer.drain()
+
+    async def send_message(self, stream_id, msg):
+        """Send a string to wireshark for output"""
+        await self.send_data(stream_id, gandelf_message(stream_id, msg))
+
+    async def close(self):
+        if self._writer is not None:
+            logger.info("Closing pipe")
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+
+class AsyncWloggerSink(object):
+    """
+    Send frames to the wlogger dissector over UDP
+
+    Args:
+        host: address the dissector listens on
+        port: UDP port the dissector listens on
+
+    """
+
+    def __init__(self, host=wlogger_plugin.HOST, port=wlogger_plugin.PORT):
+        self.address = (host, port)
+        self._transport = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                                 remote_addr=self.address)
+
+    async def send_data(self, stream_id, frame):
+        """
+        Send data to wireshark to be parsed into protofields
+
+        Args:
+          stream_id: identifier on wireshark output of logger's stream
+          frame: list of WSOutputElement
+
+        """
+        # Datagrams are never held back, so there is nothing to wait for
+        self._transport.sendto(json.dumps(wlogger_encode(stream_id, frame)).encode())
+
+    async def send_message(self, stream_id, msg):
+        """Send a string to wireshark for output"""
+        self._transport.sendto(json.dumps(wlogger_message(stream_id, msg)).encode())
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
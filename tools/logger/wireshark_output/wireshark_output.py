@@ -122,35 +122,48 @@ def pipe_send_data(buf):
     loop.run()
 
 
-def gandelf_send_message(stream_id, msg):
+def gandelf_message(stream_id, msg):
     """
-    Send a string to wireshark for output
+    Build the output of a string for wireshark
 
     Args:
         stream_id: identifier for packet in wireshark output
         msg: string to send
 
+    Returns:
+        list of WSOutputElement
+
     """
-    data = [
+    return [
         WSOutputElement(Protofields.COMMON_OPEN_TREE, "General"),
         WSOutputElement(Protofields.COMMON_PROTOCOL, stream_id),
         WSOutputElement(Protofields.COMMON_INFO, str(msg)),
         WSOutputElement(Protofields.COMMON_CLOSE_TREE)
     ]
 
-    gandelf_send_data(stream_id, data)
 
+def gandelf_send_message(stream_id, msg):
+    """
+    Send a string to wireshark for output
+
+    Args:
+        stream_id: identifier for packet in wireshark output
+        msg: string to send
 
-def gandelf_send_data(stream_id, frame):
     """
-    Send data to wireshark to be parsed into protofields
+    gandelf_send_data(stream_id, gandelf_message(stream_id, msg))
+
+
+def gandelf_encode(frame):
+    """
+    Encode data for Gandelf as length:value pairs of protofield names and values
 
     Args:
       frame: list of WSOutputElement
-      stream_id: identifier on wireshark output of logger's stream
-    """
 
-    # TODO: send stream_id
+    Returns:
+        bytes to write to the pipe
+    """
 
     # string => length:value
     def lv(s):
@@ -170,27 +183,55 @@ def gandelf_send_data(stream_id, frame):
             data += lv(protofield)
             data += lv(str(value))
 
-    pipe_send_data(data)
+    return data
+
+
+def gandelf_send_data(stream_id, frame):
+    """
+    Send data to wireshark to be parsed into protofields
+
+    Args:
+      frame: list of WSOutputElement
+      stream_id: identifier on wireshark output of logger's stream
+    """
+
+    # TODO: send stream_id
+
+    pipe_send_data(gandelf_encode(frame))
 
 
 ##########################################################################################
 # Wlogger Functionality
 
-def wlogger_send_message(stream_id, msg):
+def wlogger_message(stream_id, msg):
     """
-    Send a string to wireshark for output
+    Build the output of a string for wireshark
 
     Args:
         stream_id: identifier for packet in wireshark output
         msg: string to send
 
+    Returns:
+        OrderedDict to send as JSON
+
     """
     data = OrderedDict()
     data["General"] = OrderedDict()
     data["General"]["Stream ID"] = stream_id
     data["General"]["Message"] = "{}".format(msg)
+    return data
+
+
+def wlogger_send_message(stream_id, msg):
+    """
+    Send a string to wireshark for output
+
+    Args:
+        stream_id: identifier for packet in wireshark output
+        msg: string to send
 
-    send_data(data)
+    """
+    send_data(wlogger_message(stream_id, msg))
 
 
 def wlogger_get_leaf(data, group_name_stack):
@@ -214,14 +255,17 @@ def wlogger_get_leaf(data, group_name_stack):
     return ret
 
 
-def wlogger_send_data(stream_id, frame):
+def wlogger_encode(stream_id, frame):
     """
-    Send data to wireshark to be parsed into protofields
+    Build the tree of protofields sent to the wlogger dissector
 
     Args:
       frame: list of WSOutputElement
       stream_id: identifier on wireshark output of logger's stream
 
+    Returns:
+        OrderedDict to send as JSON
+
     """
     data = OrderedDict()
     data["General"] = OrderedDict()
@@ -250,4 +294,16 @@ def wlogger_send_data(stream_id, frame):
             if x.protofield is not None and x.value is not None:
                 leaf[PROTO_FIELD_ID_TO_STRING[x.protofield]] = "{}".format(x.value)
 
-    send_data(data)
+    return data
+
+
+def wlogger_send_data(stream_id, frame):
+    """
+    Send data to wireshark to be parsed into protofields
+
+    Args:
+      frame: list of WSOutputElement
+      stream_id: identifier on wireshark output of logger's stream
+
+    """
+    send_data(wlogger_encode(stream_id, frame))